@@ -6,7 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tennis_booking.settings')
+    # Тесты используют дополнительные базы (реплика и шарды) из test_settings
+    settings_module = 'tennis_booking.test_settings' if sys.argv[1:2] == ['test'] else 'tennis_booking.settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
@@ -1,13 +1,124 @@
-from django.contrib import admin
-from .models import TennisCenter, TennisCourt, Booking, BookingSession
+import io
+from datetime import date, timedelta
+
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.utils import unquote
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import render, redirect
+from django.urls import path
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from .models import TennisCenter, TennisCourt, CourtBlock, Booking, BookingSession
+from .routers import replica_reads
+from . import sharding
+from .profiling import hot_spots, reset_profiles
+from .search import search_bookings
+from .reconciliation import StatementError, read_statement, reconcile
+from .events import publish_availability_change
+from .analytics import build_report
+from .blocks import BlockConflict, apply_block, find_conflicts, release_block
+from .occupancy import refresh_bookings
+from .timetable import build_timetable
+
+
+class ReplicaChangeListMixin:
+    """Списки объектов в админке читаются с реплики (кроме действий над ними)"""
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super().changelist_view(request, extra_context)
+        with replica_reads():
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+            return response
+
+
+class ShardAdminMixin:
+    """Админка шардированной модели: шард выбирается по id объекта или центру.
+
+    Центр берется из фильтра списка, параметра tennis_center формы
+    добавления или отправленной формы. Без центра показывается первый шард,
+    а поля выбора корта в форме перечисляют корты всех шардов: отправленная
+    форма проверяется уже на шарде выбранного центра.
+    """
+
+    def request_shard(self, request, object_id=None):
+        if not sharding.enabled():
+            return None
+        if object_id is not None:
+            return sharding.shard_for_pk(unquote(object_id))
+        center_id = (
+            request.POST.get('tennis_center')
+            or request.GET.get('tennis_center__id__exact')
+            or request.GET.get('tennis_center')
+        )
+        if center_id and center_id.isdigit():
+            return sharding.shard_for_center(center_id)
+        request.shard_fallback = True
+        return sharding.shard_aliases()[0]
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        field = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        return self.list_courts_of_all_shards(db_field, request, field)
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        field = super().formfield_for_manytomany(db_field, request, **kwargs)
+        return self.list_courts_of_all_shards(db_field, request, field)
+
+    def list_courts_of_all_shards(self, db_field, request, field):
+        if field is None or db_field.related_model is not TennisCourt or not getattr(request, 'shard_fallback', False):
+            return field
+        with sharding.use_shard(None):
+            courts = sharding.scatter_gather(
+                TennisCourt.objects.select_related('tennis_center').order_by('tennis_center__name', 'court_number'),
+                key=lambda court: (court.tennis_center.name, court.court_number),
+            )
+        empty = [('', field.empty_label)] if field.empty_label is not None else []
+        field.choices = empty + [(court.pk, field.label_from_instance(court)) for court in courts]
+        return field
+
+    def changelist_view(self, request, extra_context=None):
+        alias = sharding.activate(self.request_shard(request))
+        if alias and 'tennis_center__id__exact' not in request.GET:
+            messages.info(request, f'Показаны данные шарда {alias}. Выберите теннисный центр в фильтре.')
+        return super().changelist_view(request, extra_context)
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        sharding.activate(self.request_shard(request, object_id))
+        return super().changeform_view(request, object_id, form_url, extra_context)
+
+    def delete_view(self, request, object_id, extra_context=None):
+        sharding.activate(self.request_shard(request, object_id))
+        return super().delete_view(request, object_id, extra_context)
+
+    def history_view(self, request, object_id, extra_context=None):
+        sharding.activate(self.request_shard(request, object_id))
+        return super().history_view(request, object_id, extra_context)
 
 
 @admin.register(TennisCenter)
-class TennisCenterAdmin(admin.ModelAdmin):
+class TennisCenterAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     list_display = ['name', 'address', 'phone_number', 'number_of_courts', 'opening_time', 'closing_time']
     list_filter = ['opening_time', 'closing_time']
     search_fields = ['name', 'address']
     ordering = ['name']
+    readonly_fields = ['shard']
+
+    # Справочник центров живет в default и копируется на шарды
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        sharding.replicate(obj)
+
+    def delete_model(self, request, obj):
+        sharding.unreplicate(obj)
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        for center in queryset:
+            sharding.unreplicate(center)
+        super().delete_queryset(request, queryset)
 
 
 class TennisCourtInline(admin.TabularInline):
@@ -16,23 +127,127 @@ class TennisCourtInline(admin.TabularInline):
 
 
 @admin.register(TennisCourt)
-class TennisCourtAdmin(admin.ModelAdmin):
+class TennisCourtAdmin(ShardAdminMixin, ReplicaChangeListMixin, admin.ModelAdmin):
     list_display = ['tennis_center', 'court_number', 'price_per_hour', 'surface_type', 'indoor']
     list_filter = ['tennis_center', 'surface_type', 'indoor']
+    list_select_related = ['tennis_center']
     search_fields = ['tennis_center__name', 'court_number']
     ordering = ['tennis_center', 'court_number']
 
 
+class CourtBlockForm(forms.ModelForm):
+    # Сколько пересечений показывать в сообщении об ошибке
+    CONFLICTS_SHOWN = 10
+
+    class Meta:
+        model = CourtBlock
+        fields = ['tennis_center', 'courts', 'date_from', 'date_to', 'start_time', 'end_time', 'reason', 'comment']
+        help_texts = {'courts': 'Если не выбрано ни одного, блокируются все корты центра'}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['courts'].required = False
+        self.fields['courts'].queryset = TennisCourt.objects.select_related('tennis_center').order_by(
+            'tennis_center__name', 'court_number'
+        )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        tennis_center = cleaned_data.get('tennis_center')
+        date_from = cleaned_data.get('date_from')
+        date_to = cleaned_data.get('date_to')
+        start_time = cleaned_data.get('start_time')
+        end_time = cleaned_data.get('end_time')
+        if not all([tennis_center, date_from, date_to, start_time, end_time]):
+            return cleaned_data
+
+        if date_to < date_from:
+            raise forms.ValidationError('Дата окончания раньше даты начала')
+        if end_time <= start_time:
+            raise forms.ValidationError('Время окончания должно быть позже времени начала')
+        if start_time.minute or end_time.minute:
+            raise forms.ValidationError('Блокировка задается целыми часами')
+
+        courts = list(cleaned_data.get('courts') or [])
+        if any(court.tennis_center_id != tennis_center.id for court in courts):
+            raise forms.ValidationError('Выбраны корты другого центра')
+        if not courts:
+            courts = list(tennis_center.courts.order_by('court_number'))
+        self.blocked_courts = courts
+
+        # Пересечения со всеми кортами и днями блокировки - одним запросом
+        conflicts = list(find_conflicts(tennis_center, courts, date_from, date_to, start_time, end_time))
+        if conflicts:
+            errors = [f'Пересечения с активными бронированиями: {len(conflicts)}']
+            errors += [
+                f"{booking.date.strftime('%d.%m.%Y')} {booking.start_time.strftime('%H:%M')} "
+                f"({booking.duration_hours} ч), корт {booking.court.court_number}: "
+                f"{booking.full_name} [{booking.get_status_display()}, #{booking.id}]"
+                for booking in conflicts[:self.CONFLICTS_SHOWN]
+            ]
+            raise forms.ValidationError(errors)
+        return cleaned_data
+
+
+@admin.register(CourtBlock)
+class CourtBlockAdmin(ShardAdminMixin, ReplicaChangeListMixin, admin.ModelAdmin):
+    form = CourtBlockForm
+    list_display = ['reason', 'tennis_center', 'date_from', 'date_to', 'start_time', 'end_time', 'comment', 'created_by']
+    list_filter = ['reason', 'tennis_center', 'date_from']
+    list_select_related = ['tennis_center', 'created_by']
+    ordering = ['-date_from']
+
+    def get_readonly_fields(self, request, obj=None):
+        # Блокировка не редактируется: чтобы изменить, ее удаляют и создают заново
+        if obj is not None:
+            return CourtBlockForm.Meta.fields + ['created_by', 'created_at']
+        return []
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.created_by = request.user
+        super().save_model(request, obj, form, change)
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        try:
+            return super().changeform_view(request, object_id, form_url, extra_context)
+        except BlockConflict:
+            # Бронь появилась между проверкой формы и записью: транзакция
+            # откатилась, повторная проверка формы покажет пересечения
+            return super().changeform_view(request, object_id, form_url, extra_context)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if not change:
+            form.instance.courts.set(form.blocked_courts)
+            created = apply_block(form.instance, form.blocked_courts)
+            self.message_user(request, f'Заблокировано корто-интервалов: {created}.')
+
+    def delete_model(self, request, obj):
+        release_block(obj)
+
+    def delete_queryset(self, request, queryset):
+        for block in queryset:
+            release_block(block)
+
+
+class StatementUploadForm(forms.Form):
+    statement = forms.FileField(label='CSV-выписка банка или POS-терминала')
+    dry_run = forms.BooleanField(label='Только проверить, не менять статусы', required=False)
+
+
 @admin.register(Booking)
-class BookingAdmin(admin.ModelAdmin):
+class BookingAdmin(ShardAdminMixin, ReplicaChangeListMixin, admin.ModelAdmin):
     list_display = [
         'full_name', 'tennis_center', 'court', 'date', 'start_time',
         'duration_hours', 'total_price', 'status', 'created_at', 'id'
     ]
     list_filter = ['status', 'tennis_center', 'date', 'trainer_service', 'created_at']
+    list_select_related = ['tennis_center', 'court__tennis_center']
     search_fields = ['full_name', 'phone', 'email', 'user__username']
+    search_help_text = 'Имя, email, логин или телефон в любом формате'
     ordering = ['-created_at']
-    readonly_fields = ['created_at', 'updated_at', 'total_price']
+    readonly_fields = ['created_at', 'updated_at', 'total_price', 'reminder_sent_at']
 
     fieldsets = (
         ('Основная информация', {
@@ -52,37 +267,236 @@ class BookingAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
         ('Системная информация', {
-            'fields': ('created_at', 'updated_at'),
+            'fields': ('created_at', 'updated_at', 'reminder_sent_at'),
             'classes': ('collapse',)
         }),
     )
 
     actions = ['mark_as_paid', 'mark_as_cancelled']
 
+    change_list_template = 'admin/tennis/booking/change_list.html'
+
+    def get_urls(self):
+        urls = [
+            path(
+                'reconcile/',
+                self.admin_site.admin_view(self.reconcile_view),
+                name='tennis_booking_reconcile',
+            ),
+            path(
+                'timetable/',
+                self.admin_site.admin_view(self.timetable_view),
+                name='tennis_booking_timetable',
+            ),
+        ]
+        return urls + super().get_urls()
+
+    # Быстрая смена статуса из расписания: допустимые переходы
+    TIMETABLE_TRANSITIONS = {
+        'paid': ['pending'],
+        'cancelled': ['pending', 'paid'],
+    }
+
+    def timetable_view(self, request):
+        """Расписание центра на день: корты x часы"""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+
+        if request.method == 'POST':
+            return self.timetable_change_status(request)
+
+        try:
+            day = parse_date(request.GET.get('date') or '') or date.today()
+        except ValueError:
+            day = date.today()
+
+        with replica_reads():
+            centers = list(TennisCenter.objects.order_by('name'))
+            tennis_center = next((c for c in centers if str(c.pk) == request.GET.get('center')), None)
+            if tennis_center is None and centers:
+                tennis_center = centers[0]
+            if tennis_center:
+                sharding.activate_for_center(tennis_center.pk)
+            hours, matrix = build_timetable(tennis_center, day) if tennis_center else ([], [])
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Расписание кортов',
+            'opts': self.model._meta,
+            'centers': centers,
+            'tennis_center': tennis_center,
+            'day': day,
+            'previous_day': day - timedelta(days=1),
+            'next_day': day + timedelta(days=1),
+            'hours': hours,
+            'matrix': matrix,
+            'can_change': self.has_change_permission(request),
+        }
+        return render(request, 'admin/tennis/booking/timetable.html', context)
+
+    def timetable_change_status(self, request):
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+
+        status = request.POST.get('status')
+        allowed = self.TIMETABLE_TRANSITIONS.get(status, [])
+        sharding.activate(sharding.shard_for_pk(request.POST.get('booking_id')))
+        with sharding.atomic():
+            booking = Booking.objects.select_for_update().filter(
+                pk=request.POST.get('booking_id'), status__in=allowed
+            ).first()
+            if booking is None:
+                messages.error(request, 'Статус этого бронирования уже изменен или переход недопустим.')
+            else:
+                booking.status = status
+                booking.save(update_fields=['status', 'updated_at'])
+                if status == 'cancelled':
+                    refresh_bookings([booking])
+                    publish_availability_change(booking, 'cancelled')
+                messages.success(request, f'Бронирование #{booking.id}: {booking.get_status_display()}.')
+        return redirect(request.get_full_path())
+
+    def reconcile_view(self, request):
+        """Загрузка выписки и сверка оплат"""
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+
+        report = None
+        if request.method == 'POST':
+            form = StatementUploadForm(request.POST, request.FILES)
+            if form.is_valid():
+                statement = io.TextIOWrapper(form.cleaned_data['statement'].file, encoding='utf-8-sig', newline='')
+                try:
+                    rows, errors = read_statement(statement)
+                    report = reconcile(rows, errors, apply=not form.cleaned_data['dry_run'])
+                    messages.success(request, report.summary())
+                except (StatementError, UnicodeDecodeError) as e:
+                    messages.error(request, f'Не удалось прочитать выписку: {e}')
+        else:
+            form = StatementUploadForm()
+
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'Сверка оплат по выписке',
+            'opts': self.model._meta,
+            'form': form,
+            'report': report,
+        }
+        return render(request, 'admin/tennis/booking/reconcile.html', context)
+
+    def get_search_results(self, request, queryset, search_term):
+        """Индексированный поиск вместо icontains по всем search_fields"""
+        return search_bookings(queryset, search_term), False
+
+    @staticmethod
+    def occupied_slot(booking):
+        """Что видят подписчики занятости: корт, время и занимает ли бронь корт"""
+        return (
+            booking.court_id, booking.date, booking.start_time, booking.duration_hours,
+            booking.status in Booking.ACTIVE_STATUSES,
+        )
+
+    def save_model(self, request, obj, form, change):
+        # Пересчитываем занятость и старого, и нового дня брони
+        previous = Booking.objects.filter(pk=obj.pk).first() if change else None
+        super().save_model(request, obj, form, change)
+        refresh_bookings([previous, obj] if previous else [obj])
+        if previous is not None and self.occupied_slot(previous) == self.occupied_slot(obj):
+            return
+        if previous is not None and previous.status in Booking.ACTIVE_STATUSES:
+            publish_availability_change(previous, 'cancelled')
+        if obj.status in Booking.ACTIVE_STATUSES:
+            publish_availability_change(obj, 'created')
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        refresh_bookings([obj])
+        if obj.status in Booking.ACTIVE_STATUSES:
+            publish_availability_change(obj, 'cancelled')
+
+    def delete_queryset(self, request, queryset):
+        bookings = list(queryset.only(
+            'id', 'tennis_center_id', 'court_id', 'date', 'start_time', 'duration_hours', 'status'
+        ))
+        super().delete_queryset(request, queryset)
+        refresh_bookings(bookings)
+        for booking in bookings:
+            if booking.status in Booking.ACTIVE_STATUSES:
+                publish_availability_change(booking, 'cancelled')
+
     def mark_as_paid(self, request, queryset):
         """Действие для пометки бронирований как оплаченные"""
-        updated = queryset.update(status='paid')
+        updated = queryset.filter(status__in=Booking.CUSTOMER_STATUSES).update(status='paid', updated_at=timezone.now())
         self.message_user(request, f'{updated} бронирований помечены как оплаченные.')
 
     mark_as_paid.short_description = "Пометить как оплаченное"
 
     def mark_as_cancelled(self, request, queryset):
         """Действие для отмены бронирований"""
-        updated = queryset.update(status='cancelled')
+        with sharding.atomic():
+            released = list(queryset.filter(status__in=Booking.ACTIVE_STATUSES))
+            updated = queryset.update(status='cancelled', updated_at=timezone.now())
+            refresh_bookings(released)
+        for booking in released:
+            publish_availability_change(booking, 'cancelled')
         self.message_user(request, f'{updated} бронирований отменены.')
 
     mark_as_cancelled.short_description = "Отменить бронирование"
 
 
 @admin.register(BookingSession)
-class BookingSessionAdmin(admin.ModelAdmin):
+class BookingSessionAdmin(ReplicaChangeListMixin, admin.ModelAdmin):
     list_display = ['session_key', 'user', 'tennis_center_id', 'date', 'created_at']
     list_filter = ['created_at', 'date']
+    list_select_related = ['user']
     search_fields = ['session_key', 'user__username']
     ordering = ['-created_at']
     readonly_fields = ['created_at', 'updated_at']
 
 
+def profiler_report_view(request):
+    """Отчет о горячих точках профилированных запросов"""
+    if request.method == 'POST':
+        reset_profiles()
+        messages.success(request, 'Статистика профилирования очищена.')
+        return redirect('profiler_report')
+
+    project_only = request.GET.get('project') == '1'
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Горячие точки (cProfile)',
+        'report': hot_spots(project_only=project_only),
+        'project_only': project_only,
+    }
+    return render(request, 'admin/tennis/profiler_report.html', context)
+
+
+def analytics_view(request):
+    """Загрузка кортов и спрос за период"""
+    try:
+        date_to = parse_date(request.GET.get('to') or '') or date.today()
+        date_from = parse_date(request.GET.get('from') or '') or date_to - timedelta(days=27)
+    except ValueError:
+        date_to = date.today()
+        date_from = date_to - timedelta(days=27)
+    if date_from > date_to:
+        date_from, date_to = date_to, date_from
+
+    with replica_reads():
+        centers = list(TennisCenter.objects.order_by('name'))
+        tennis_center = next((c for c in centers if str(c.pk) == request.GET.get('center')), None)
+        report = build_report(date_from, date_to, tennis_center)
+
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Аналитика загрузки',
+        'report': report,
+        'centers': centers,
+        'tennis_center': tennis_center,
+    }
+    return render(request, 'admin/tennis/analytics.html', context)
+
+
 # Настройка админки
 admin.site.site_header = 'Управление теннисными кортами'
 admin.site.site_title = 'Tennis Admin'
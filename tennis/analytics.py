@@ -0,0 +1,157 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.db.models import Count
+from django.utils import timezone
+
+from . import sharding
+from .availability import MAX_DURATION_HOURS
+from .models import TennisCenter, TennisCourt, Booking
+
+
+WEEKDAYS = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
+SURFACES = [code for code, label in TennisCourt.SURFACE_CHOICES]
+
+
+class BookingColumns:
+    """Бронирования за период в виде компактных колонок NumPy"""
+
+    def __init__(self, center_ids, rows):
+        n = len(rows)
+        self.center_ids = center_ids
+        center_index = {center_id: index for index, center_id in enumerate(center_ids)}
+        surface_index = {code: index for index, code in enumerate(SURFACES)}
+
+        def column(position, dtype, convert=None):
+            values = (row[position] for row in rows)
+            if convert:
+                values = map(convert, values)
+            return np.fromiter(values, dtype=dtype, count=n)
+
+        self.center = column(0, np.int16, center_index.__getitem__)
+        dates = column(1, 'datetime64[D]', np.datetime64)
+        # 1970-01-01 - четверг
+        self.weekday = ((dates.astype(np.int64) + 3) % 7).astype(np.int8)
+        start_minutes = column(2, np.int16, lambda value: value.hour * 60 + value.minute)
+        self.hour = (start_minutes // 60).astype(np.int8)
+        self.duration = column(3, np.int8)
+        self.trainer = column(4, np.bool_)
+        self.rackets = column(5, np.int8)
+        self.balls = column(6, np.bool_)
+        self.surface = column(7, np.int8, surface_index.__getitem__)
+
+        # Время до игры: начало (местное время) минус момент создания (UTC).
+        # Смещение пояса берется на дату каждой брони: 1 марта 2024 года
+        # Казахстан перешел с UTC+6 на UTC+5
+        tz = timezone.get_current_timezone()
+        created = column(8, 'datetime64[s]', lambda value: np.datetime64(value.replace(tzinfo=None), 's'))
+        starts = np.fromiter(
+            (int(datetime.combine(row[1], row[2], tzinfo=tz).timestamp()) for row in rows),
+            dtype=np.int64, count=n,
+        ).astype('datetime64[s]')
+        self.lead_hours = ((starts - created) / np.timedelta64(1, 'h')).astype(np.float32)
+
+    def __len__(self):
+        return len(self.center)
+
+
+def load_columns(date_from, date_to, tennis_center=None):
+    """Загрузка активных бронирований за период одним запросом на шард"""
+    bookings = Booking.objects.filter(
+        date__range=(date_from, date_to),
+        status__in=Booking.CUSTOMER_STATUSES,
+    )
+    centers = TennisCenter.objects.order_by('id')
+    if tennis_center is not None:
+        bookings = bookings.filter(tennis_center=tennis_center)
+        centers = centers.filter(pk=tennis_center.pk)
+
+    rows = sharding.scatter_gather(bookings.values_list(
+        'tennis_center_id', 'date', 'start_time', 'duration_hours',
+        'trainer_service', 'racket_rental', 'balls_rental',
+        'court__surface_type', 'created_at',
+    ))
+    return BookingColumns(list(centers.values_list('id', flat=True)), rows)
+
+
+def weekday_counts(date_from, date_to):
+    """Сколько раз каждый день недели встречается в периоде"""
+    days = np.arange(np.datetime64(date_from), np.datetime64(date_to + timedelta(days=1)))
+    return np.bincount((days.astype(np.int64) + 3) % 7, minlength=7)
+
+
+def occupancy_heatmap(columns, date_from, date_to):
+    """Загрузка кортов: центр x день недели x час (доля занятых корт-часов)"""
+    booked = np.zeros((len(columns.center_ids), 7, 24), dtype=np.float32)
+    for offset in range(MAX_DURATION_HOURS):
+        # Бронь занимает часы hour .. hour + duration - 1
+        mask = (columns.duration > offset) & (columns.hour + offset < 24)
+        np.add.at(booked, (columns.center[mask], columns.weekday[mask], columns.hour[mask] + offset), 1)
+
+    # Корты центра лежат на одном шарде, поэтому счетчики шардов просто объединяются
+    courts = dict(sharding.scatter_gather(
+        TennisCourt.objects.filter(tennis_center_id__in=columns.center_ids)
+        .values_list('tennis_center_id').annotate(total=Count('id'))
+    ))
+    court_counts = np.array([courts.get(center_id, 0) for center_id in columns.center_ids], dtype=np.float32)
+    capacity = court_counts[:, None, None] * weekday_counts(date_from, date_to)[None, :, None]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(capacity > 0, booked / capacity, 0.0)
+
+
+def surface_demand(columns):
+    """Забронированные часы по типу покрытия"""
+    hours = np.bincount(columns.surface, weights=columns.duration, minlength=len(SURFACES))
+    return dict(zip(SURFACES, hours.astype(int).tolist()))
+
+
+def addon_attach_rates(columns):
+    """Доля бронирований с дополнительными услугами"""
+    if not len(columns):
+        return {'trainer_service': 0.0, 'racket_rental': 0.0, 'balls_rental': 0.0, 'rackets_per_booking': 0.0}
+    return {
+        'trainer_service': float(columns.trainer.mean()),
+        'racket_rental': float((columns.rackets > 0).mean()),
+        'balls_rental': float(columns.balls.mean()),
+        'rackets_per_booking': float(columns.rackets.mean()),
+    }
+
+
+def lead_time_stats(columns):
+    """Среднее и медианное время от бронирования до игры, в часах"""
+    if not len(columns):
+        return {'mean': 0.0, 'median': 0.0}
+    return {
+        'mean': float(columns.lead_hours.mean()),
+        'median': float(np.median(columns.lead_hours)),
+    }
+
+
+def build_report(date_from, date_to, tennis_center=None):
+    """Полный отчет по спросу за период"""
+    columns = load_columns(date_from, date_to, tennis_center)
+    heatmap = occupancy_heatmap(columns, date_from, date_to)
+    centers = TennisCenter.objects.in_bulk(columns.center_ids)
+
+    # Показываем только часы, в которые была хоть одна бронь в любом центре
+    active_hours = np.flatnonzero(heatmap.sum(axis=(0, 1)) > 0).tolist()
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'bookings': len(columns),
+        'hours': active_hours,
+        'heatmaps': [
+            {
+                'center': centers[center_id],
+                'rows': [
+                    (WEEKDAYS[weekday], [round(float(heatmap[index, weekday, hour]) * 100) for hour in active_hours])
+                    for weekday in range(7)
+                ],
+            }
+            for index, center_id in enumerate(columns.center_ids)
+        ],
+        'surface_demand': surface_demand(columns),
+        'addons': addon_attach_rates(columns),
+        'lead_time': lead_time_stats(columns),
+    }
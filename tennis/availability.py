@@ -0,0 +1,243 @@
+from collections import namedtuple
+from datetime import time, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from . import sharding
+from .models import TennisCourt, Booking, CourtOccupancy
+from .routers import replica_reads
+from .singleflight import coalesce, forget
+
+
+FreeSlot = namedtuple('FreeSlot', ['date', 'start_time', 'court'])
+
+# Максимальная продолжительность брони (валидатор Booking.duration_hours)
+MAX_DURATION_HOURS = 3
+
+
+def _to_minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def _from_minutes(minutes):
+    return time(minutes // 60, minutes % 60)
+
+
+def working_minutes(tennis_center):
+    """Часы работы центра в минутах от начала суток"""
+    opening = _to_minutes(tennis_center.opening_time)
+    closing = _to_minutes(tennis_center.closing_time)
+    if closing <= opening:
+        # Центр работает до полуночи
+        closing = 24 * 60
+    return opening, closing
+
+
+def hours_mask(start_time, duration_hours):
+    """Биты часов, которые занимает бронь (неполный час считается занятым)"""
+    start = start_time.hour * 60 + start_time.minute
+    end = min(start + int(duration_hours) * 60, 24 * 60)
+    first, last = start // 60, -(-end // 60)
+    return ((1 << (last - first)) - 1) << first
+
+
+def window_mask(tennis_center):
+    """Биты часов работы центра"""
+    opening, closing = working_minutes(tennis_center)
+    first, last = -(-opening // 60), closing // 60
+    return ((1 << (last - first)) - 1) << first if last > first else 0
+
+
+def run_starts(free, hours):
+    """Биты часов, с которых начинается hours свободных часов подряд"""
+    starts = free
+    for shift in range(1, hours):
+        starts &= free >> shift
+    return starts
+
+
+def overlap_q(start_time, duration_hours):
+    """Условие пересечения брони с интервалом [start_time, start_time + duration).
+
+    Бронь пересекается, если начинается до конца интервала и заканчивается
+    после его начала. Конец брони в базе не хранится, поэтому нижняя граница
+    начала задается отдельно для каждой возможной продолжительности.
+    """
+    start = _to_minutes(start_time)
+    end = start + int(duration_hours) * 60
+
+    condition = Q()
+    if end < 24 * 60:
+        condition &= Q(start_time__lt=_from_minutes(end))
+
+    ends_after_start = Q()
+    for hours in range(1, MAX_DURATION_HOURS + 1):
+        lower = start - hours * 60
+        if lower >= 0:
+            ends_after_start |= Q(duration_hours=hours, start_time__gt=_from_minutes(lower))
+        else:
+            ends_after_start |= Q(duration_hours=hours)
+    return condition & ends_after_start
+
+
+def center_key(tennis_center_id):
+    return f'availability:{tennis_center_id}'
+
+
+def range_availability(tennis_center, date_from, date_to):
+    """Корты центра и их занятость на диапазон дат: (courts, {(court_id, date): маска часов}).
+
+    Два запроса на весь диапазон: корты и маски из таблицы занятости
+    (CourtOccupancy) по индексу (центр, дата); корт без строки в этот день
+    свободен. Одновременные запросы на тот же диапазон объединяются: расчет
+    выполняется один раз, остальные получают его результат
+    (tennis.singleflight). Результат живет AVAILABILITY_CACHE_SECONDS
+    и сбрасывается после коммита изменений бронирований центра
+    (occupancy.refresh). Снимок общий для всех пользователей и может
+    отставать, поэтому годится только для показа; проверки перед записью
+    читают основную базу.
+    """
+    return coalesce(
+        f'{center_key(tennis_center.id)}:{date_from.isoformat()}:{date_to.isoformat()}',
+        lambda: _range_availability(tennis_center, date_from, date_to),
+        ttl=getattr(settings, 'AVAILABILITY_CACHE_SECONDS', 5),
+        scope=center_key(tennis_center.id),
+    )
+
+
+def _range_availability(tennis_center, date_from, date_to):
+    courts = list(TennisCourt.objects.filter(tennis_center=tennis_center).order_by('court_number'))
+    masks = {
+        (court_id, day): mask
+        for court_id, day, mask in CourtOccupancy.objects.filter(
+            tennis_center=tennis_center, date__range=(date_from, date_to), mask__gt=0,
+        ).values_list('court_id', 'date', 'mask')
+    }
+    return courts, masks
+
+
+def day_availability(tennis_center, booking_date):
+    """Корты центра и их занятость на день: (courts, {court_id: маска часов})"""
+    courts, masks = range_availability(tennis_center, booking_date, booking_date)
+    return courts, {court_id: mask for (court_id, day), mask in masks.items()}
+
+
+def invalidate_center(tennis_center_id):
+    """Сброс снимков занятости центра после изменения бронирований"""
+    forget(center_key(tennis_center_id))
+
+
+def lock_free_court(tennis_center, booking_date, start_time, duration_hours, court=None):
+    """Окончательная проверка перед записью брони; вызывается внутри транзакции.
+
+    Корты центра (или выбранный корт) блокируются select_for_update, поэтому
+    параллельные брони этих кортов проверяются и записываются по очереди.
+    Возвращает первый свободный корт или None.
+    """
+    courts = TennisCourt.objects.select_for_update().filter(
+        tennis_center=tennis_center
+    ).order_by('court_number')
+    if court is not None:
+        courts = courts.filter(pk=court.pk)
+    courts = list(courts)
+    occupied = set(Booking.objects.filter(
+        court__in=courts,
+        date=booking_date,
+        status__in=Booking.ACTIVE_STATUSES,
+    ).filter(overlap_q(start_time, duration_hours)).values_list('court_id', flat=True))
+    return next((c for c in courts if c.id not in occupied), None)
+
+
+def find_free_slots(tennis_center, start_date, duration_hours, court=None,
+                    limit=5, days=14, from_time=None):
+    """Поиск ближайших свободных слотов начиная с указанной даты.
+
+    Только для показа: занятость всего диапазона дат берется из общего
+    снимка (range_availability), который может отставать на
+    AVAILABILITY_CACHE_SECONDS. Если корт не указан, для каждого времени
+    возвращается первый свободный корт центра. Снимок считается с реплики,
+    если запрос не закреплен за основной базой.
+    """
+    with replica_reads():
+        return _find_free_slots(tennis_center, start_date, duration_hours, court, limit, days, from_time)
+
+
+def _find_free_slots(tennis_center, start_date, duration_hours, court, limit, days, from_time):
+    if limit <= 0 or days <= 0:
+        return []
+
+    hours = int(duration_hours)
+    window = window_mask(tennis_center)
+    now = timezone.localtime()
+    date_from = max(start_date, now.date())
+    date_to = start_date + timedelta(days=days - 1)
+    if date_from > date_to:
+        return []
+
+    courts, masks = range_availability(tennis_center, date_from, date_to)
+    if court is not None:
+        courts = [c for c in courts if c.id == court.id]
+    if not courts:
+        return []
+
+    slots = []
+    day = date_from
+    while day <= date_to:
+        not_before = 0
+        if day == start_date and from_time is not None:
+            not_before = _to_minutes(from_time)
+        if day == now.date():
+            not_before = max(not_before, now.hour * 60 + now.minute)
+        # Часы, с которых еще можно начать: не раньше not_before
+        allowed = window & ~((1 << -(-not_before // 60)) - 1)
+
+        # Для каждого часа начала - первый свободный корт
+        by_start = {}
+        for c in courts:
+            starts = run_starts(window & ~masks.get((c.id, day), 0), hours) & allowed
+            for hour in range(24):
+                if starts >> hour & 1:
+                    by_start.setdefault(hour, c)
+
+        for hour in sorted(by_start):
+            slots.append(FreeSlot(day, time(hour), by_start[hour]))
+            if len(slots) >= limit:
+                return slots
+        day += timedelta(days=1)
+
+    return slots
+
+
+def find_free_runs(date_from, date_to, hours, tennis_center=None, limit=None):
+    """Корты и дни, где есть hours свободных часов подряд в часы работы центра.
+
+    Читаются только маленькие целые маски по индексу (центр, дата) - один
+    запрос кортов и один запрос масок на шард за весь диапазон; корт без
+    строки занятости в этот день свободен. Возвращает список
+    (дата, корт, часы начала), отсортированный по дате и номеру корта.
+    """
+    courts = TennisCourt.objects.select_related('tennis_center').order_by('tennis_center_id', 'court_number')
+    occupancy = CourtOccupancy.objects.filter(date__range=(date_from, date_to), mask__gt=0)
+    if tennis_center is not None:
+        courts = courts.filter(tennis_center=tennis_center)
+        occupancy = occupancy.filter(tennis_center=tennis_center)
+    courts = sharding.scatter_gather(courts, key=lambda court: (court.tennis_center_id, court.court_number))
+    masks = {
+        (court_id, day): mask
+        for court_id, day, mask in sharding.scatter_gather(occupancy.values_list('court_id', 'date', 'mask'))
+    }
+    windows = {court.tennis_center_id: window_mask(court.tennis_center) for court in courts}
+
+    result = []
+    day = date_from
+    while day <= date_to:
+        for court in courts:
+            starts = run_starts(windows[court.tennis_center_id] & ~masks.get((court.id, day), 0), hours)
+            if starts:
+                result.append((day, court, [hour for hour in range(24) if starts >> hour & 1]))
+                if limit and len(result) >= limit:
+                    return result
+        day += timedelta(days=1)
+    return result
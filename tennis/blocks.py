@@ -0,0 +1,103 @@
+from datetime import timedelta
+
+from . import sharding
+from .availability import MAX_DURATION_HOURS, _from_minutes, _to_minutes, overlap_q
+from .events import publish_availability_change
+from .models import Booking, TennisCourt
+from .occupancy import refresh_bookings
+
+
+class BlockConflict(Exception):
+    """Пересекающиеся бронирования появились после проверки формы"""
+
+    def __init__(self, conflicts):
+        super().__init__(f'Пересечения с активными бронированиями: {len(conflicts)}')
+        self.conflicts = conflicts
+
+
+def block_dates(block):
+    day = block.date_from
+    while day <= block.date_to:
+        yield day
+        day += timedelta(days=1)
+
+
+def block_chunks(start_time, end_time):
+    """Разбиение интервала на части не длиннее MAX_DURATION_HOURS часов.
+
+    Продолжительность брони ограничена, и на это опирается overlap_q,
+    поэтому длинная блокировка хранится несколькими строками подряд.
+    """
+    start = _to_minutes(start_time)
+    end = _to_minutes(end_time)
+    while start < end:
+        hours = min(MAX_DURATION_HOURS, (end - start) // 60)
+        yield _from_minutes(start), hours
+        start += hours * 60
+
+
+def find_conflicts(tennis_center, courts, date_from, date_to, start_time, end_time):
+    """Активные бронирования, пересекающиеся с блокировкой, одним запросом"""
+    hours = (_to_minutes(end_time) - _to_minutes(start_time)) // 60
+    return Booking.objects.filter(
+        tennis_center=tennis_center,
+        court__in=courts,
+        date__range=(date_from, date_to),
+        status__in=Booking.ACTIVE_STATUSES,
+    ).filter(overlap_q(start_time, hours)).select_related('court').order_by('date', 'start_time', 'court__court_number')
+
+
+def apply_block(block, courts):
+    """Запись блокировки: строки Booking для каждого корта и дня одной пачкой.
+
+    Строки не принадлежат пользователю (автор - block.created_by), поэтому
+    удаление учетной записи сотрудника не снимает блокировку.
+
+    Корты блокируются select_for_update, как при подтверждении брони
+    (availability.lock_free_court), и пересечения проверяются заново под
+    блокировкой; при пересечении - BlockConflict.
+    """
+    label = f"{block.get_reason_display()}: {block.comment}" if block.comment else block.get_reason_display()
+    rows = [
+        Booking(
+            tennis_center_id=block.tennis_center_id,
+            court=court,
+            user=None,
+            date=day,
+            start_time=start_time,
+            duration_hours=hours,
+            total_price=0,
+            status='blocked',
+            full_name=label[:200],
+            phone='',
+            email='',
+            block=block,
+        )
+        for court in courts
+        for day in block_dates(block)
+        for start_time, hours in block_chunks(block.start_time, block.end_time)
+    ]
+    with sharding.atomic():
+        courts = list(TennisCourt.objects.select_for_update().filter(
+            pk__in=[court.pk for court in courts]
+        ).order_by('court_number'))
+        conflicts = list(find_conflicts(
+            block.tennis_center_id, courts, block.date_from, block.date_to, block.start_time, block.end_time
+        ))
+        if conflicts:
+            raise BlockConflict(conflicts)
+        Booking.objects.bulk_create(rows, batch_size=500)
+        refresh_bookings(rows)
+        for booking in rows:
+            publish_availability_change(booking, 'blocked')
+    return len(rows)
+
+
+def release_block(block):
+    """Удаление блокировки вместе с ее строками занятости"""
+    rows = list(block.bookings.only('id', 'tennis_center_id', 'court_id', 'date', 'start_time', 'duration_hours'))
+    with sharding.atomic():
+        block.delete()
+        refresh_bookings(rows)
+        for booking in rows:
+            publish_availability_change(booking, 'cancelled')
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from . import sharding
+
+
+logger = logging.getLogger(__name__)
+
+
+def availability_channel(tennis_center_id, booking_date):
+    return f'availability:{tennis_center_id}:{booking_date.isoformat()}'
+
+
+class LocalBroker:
+    """Pub/sub внутри одного процесса.
+
+    Подписчики - asyncio-очереди в своих event loop; публиковать можно из
+    любого потока (синхронные view, команды). Подходит для одного
+    ASGI-процесса и для тестов. Для нескольких процессов нужен бэкенд с
+    тем же интерфейсом поверх общего хранилища (AVAILABILITY_BROKER).
+    """
+
+    queue_size = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, channel):
+        """Подписка из event loop; возвращает очередь сообщений"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add((loop, queue))
+        return queue
+
+    def unsubscribe(self, channel, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(channel, set())
+            subscribers.difference_update({item for item in subscribers if item[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(channel, None)
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, message)
+            except RuntimeError:
+                # Event loop подписчика уже закрыт
+                self.unsubscribe(channel, queue)
+
+    @staticmethod
+    def _deliver(queue, message):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Медленный клиент пропускает изменения и получит их при переподключении
+            pass
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    """Брокер из settings.AVAILABILITY_BROKER"""
+    path = getattr(settings, 'AVAILABILITY_BROKER', 'tennis.events.LocalBroker')
+    return import_string(path)()
+
+
+def publish_availability_change(booking, action):
+    """Публикация изменения занятости корта после коммита транзакции.
+
+    Ждем коммита базы текущего шарда (sharding.atomic()), а не default:
+    при откате записи на шарде сообщение не отправляется.
+    action - 'created', 'cancelled' или 'expired'.
+    """
+    channel = availability_channel(booking.tennis_center_id, booking.date)
+    message = {
+        'action': action,
+        'court_id': booking.court_id,
+        'date': booking.date.isoformat(),
+        'start_time': booking.start_time.strftime('%H:%M'),
+        'duration_hours': booking.duration_hours,
+    }
+
+    def send():
+        try:
+            get_broker().publish(channel, message)
+        except Exception:
+            logger.exception('Ошибка публикации изменения занятости', extra={'booking_id': booking.id})
+
+    transaction.on_commit(send, using=sharding.current_db())
@@ -2,6 +2,7 @@ from django import forms
 from django.core.exceptions import ValidationError
 from datetime import datetime, date, time
 from .models import TennisCenter, TennisCourt, Booking
+from .availability import find_free_slots, overlap_q
 
 
 class BookingStep2Form(forms.Form):
@@ -38,9 +39,13 @@ class BookingStep2Form(forms.Form):
         widget=forms.Select(attrs={'class': 'form-control'})
     )
 
+    # Сколько альтернативных слотов предлагать, если время занято
+    SUGGESTIONS_LIMIT = 5
+
     def __init__(self, *args, **kwargs):
         self.tennis_center = kwargs.pop('tennis_center', None)
         super().__init__(*args, **kwargs)
+        self.suggested_slots = []
 
         if self.tennis_center:
             self.fields['court'].queryset = TennisCourt.objects.filter(
@@ -80,45 +85,53 @@ class BookingStep2Form(forms.Form):
         court = cleaned_data.get('court')
 
         if booking_date and start_time and self.tennis_center:
-            # Проверяем доступность выбранного корта
+            # Проверка по основной базе; окончательная - на шаге 4 под блокировкой кортов
             if court:
                 if self.is_court_occupied(court, booking_date, start_time, duration_hours):
-                    raise ValidationError("Выбранный корт занят на это время")
+                    self.raise_with_suggestions("Выбранный корт занят на это время", court)
             else:
                 # Проверяем, есть ли хотя бы один свободный корт
                 available_courts = self.get_available_courts(booking_date, start_time, duration_hours)
                 if not available_courts:
-                    raise ValidationError("Нет свободных кортов на выбранное время")
+                    self.raise_with_suggestions("Нет свободных кортов на выбранное время")
 
         return cleaned_data
 
-    def is_court_occupied(self, court, booking_date, start_time, duration_hours):
-        """Проверка, занят ли корт на указанное время"""
-        end_datetime = datetime.combine(booking_date, start_time)
-        end_datetime = end_datetime.replace(hour=end_datetime.hour + duration_hours)
-        end_time = end_datetime.time()
-
-        overlapping_bookings = Booking.objects.filter(
+    def raise_with_suggestions(self, message, court=None):
+        """Ошибка занятости с ближайшими свободными вариантами"""
+        cleaned_data = self.cleaned_data
+        self.suggested_slots = find_free_slots(
+            self.tennis_center,
+            cleaned_data['date'],
+            int(cleaned_data.get('duration_hours', 1)),
             court=court,
-            date=booking_date,
-            status__in=['pending', 'paid']
-        ).filter(
-            start_time__lt=end_time,
-            start_time__gte=start_time
+            limit=self.SUGGESTIONS_LIMIT,
+            from_time=cleaned_data['start_time'],
         )
+        if self.suggested_slots:
+            options = ', '.join(
+                f"{slot.date.strftime('%d.%m')} {slot.start_time.strftime('%H:%M')} (корт {slot.court.court_number})"
+                for slot in self.suggested_slots
+            )
+            message = f"{message}. Ближайшие свободные варианты: {options}"
+        raise ValidationError(message)
 
-        return overlapping_bookings.exists()
+    def occupied_court_ids(self, booking_date, start_time, duration_hours):
+        return Booking.objects.filter(
+            tennis_center=self.tennis_center,
+            date=booking_date,
+            status__in=Booking.ACTIVE_STATUSES,
+        ).filter(overlap_q(start_time, duration_hours)).values_list('court_id', flat=True)
+
+    def is_court_occupied(self, court, booking_date, start_time, duration_hours):
+        """Проверка, занят ли корт на указанное время"""
+        return self.occupied_court_ids(booking_date, start_time, duration_hours).filter(court=court).exists()
 
     def get_available_courts(self, booking_date, start_time, duration_hours):
         """Получение списка свободных кортов"""
-        all_courts = TennisCourt.objects.filter(tennis_center=self.tennis_center)
-        available_courts = []
-
-        for court in all_courts:
-            if not self.is_court_occupied(court, booking_date, start_time, duration_hours):
-                available_courts.append(court)
-
-        return available_courts
+        return list(TennisCourt.objects.filter(tennis_center=self.tennis_center).exclude(
+            id__in=self.occupied_court_ids(booking_date, start_time, duration_hours)
+        ).order_by('court_number'))
 
 
 class BookingStep3Form(forms.Form):
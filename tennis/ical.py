@@ -0,0 +1,139 @@
+import heapq
+import secrets
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from . import sharding
+from .models import CalendarToken
+
+
+# Сколько дней прошедших бронирований попадает в ленту
+PAST_DAYS = 30
+PRODID = '-//Tennis Booking//RU'
+
+STATUS_MAP = {
+    'pending': 'TENTATIVE',
+    'paid': 'CONFIRMED',
+    'blocked': 'CONFIRMED',
+    'cancelled': 'CANCELLED',
+}
+
+
+# Токены читаются и пишутся в основной базе: новая ссылка должна работать
+# сразу, а старая - перестать, не дожидаясь реплики
+def user_token(user):
+    """Секретный токен ленты пользователя; создается при первом обращении"""
+    token, created = CalendarToken.objects.using('default').get_or_create(
+        user=user, defaults={'token': secrets.token_urlsafe(32)},
+    )
+    return token.token
+
+
+def regenerate_token(user):
+    """Новый токен ленты; ссылка со старым токеном перестает работать"""
+    token = secrets.token_urlsafe(32)
+    tokens = CalendarToken.objects.using('default')
+    if not tokens.filter(user=user).update(token=token, created_at=timezone.now()):
+        tokens.create(user=user, token=token)
+    return token
+
+
+def user_id_from_token(token):
+    return CalendarToken.objects.using('default').filter(token=token).values_list('user_id', flat=True).first()
+
+
+def feed_window(queryset):
+    """Бронирования ленты: будущие и за последние PAST_DAYS дней"""
+    return queryset.filter(date__gte=timezone.localdate() - timedelta(days=PAST_DAYS))
+
+
+def feed_version(request, queryset):
+    """(последнее изменение, число строк) ленты одним запросом на шард, с кешем на запрос.
+
+    Число строк меняет версию при удалении бронирования, которое не
+    затрагивает max(updated_at).
+    """
+    if not hasattr(request, '_ical_version'):
+        parts = [
+            part.aggregate(last=Max('updated_at'), count=Count('id'))
+            for part in sharding.shard_querysets(queryset)
+        ]
+        request._ical_version = {
+            'last': max((part['last'] for part in parts if part['last']), default=None),
+            'count': sum(part['count'] for part in parts),
+        }
+    return request._ical_version
+
+
+def feed_etag(request, queryset):
+    version = feed_version(request, queryset)
+    last = version['last'].timestamp() if version['last'] else 0
+    return f'{version["count"]}-{last}'
+
+
+def feed_last_modified(request, queryset):
+    return feed_version(request, queryset)['last']
+
+
+def _escape(value):
+    return (
+        str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+    )
+
+
+def _fold(line):
+    """Перенос строк длиннее 75 октетов (RFC 5545, 3.1)"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts = []
+    while encoded:
+        limit = 75 if not parts else 74
+        cut = min(limit, len(encoded))
+        # Не разрезаем многобайтовый символ UTF-8
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _utc(value):
+    return value.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def render_event(booking, summary, host):
+    starts_at = timezone.make_aware(datetime.combine(booking.date, booking.start_time))
+    ends_at = starts_at + timedelta(hours=booking.duration_hours)
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:booking-{booking.id}@{host}',
+        f'DTSTAMP:{_utc(booking.updated_at)}',
+        f'LAST-MODIFIED:{_utc(booking.updated_at)}',
+        f'DTSTART:{_utc(starts_at)}',
+        f'DTEND:{_utc(ends_at)}',
+        f'SUMMARY:{_escape(summary)}',
+        f'LOCATION:{_escape(booking.tennis_center.name + ", " + booking.tennis_center.address)}',
+        f'STATUS:{STATUS_MAP.get(booking.status, "CONFIRMED")}',
+        'END:VEVENT',
+    ]
+    return ''.join(_fold(line) for line in lines)
+
+
+def stream_feed(querysets, name, summary, host, chunk_size=500):
+    """Потоковая генерация .ics: бронирования шардов читаются пачками через
+    iterator() и сливаются по дате и времени начала"""
+    yield _fold('BEGIN:VCALENDAR')
+    yield _fold('VERSION:2.0')
+    yield _fold(f'PRODID:{PRODID}')
+    yield _fold('CALSCALE:GREGORIAN')
+    yield _fold(f'X-WR-CALNAME:{_escape(name)}')
+    bookings = heapq.merge(
+        *(queryset.iterator(chunk_size=chunk_size) for queryset in querysets),
+        key=lambda booking: (booking.date, booking.start_time),
+    )
+    for booking in bookings:
+        yield render_event(booking, summary(booking), host)
+    yield _fold('END:VCALENDAR')
@@ -0,0 +1,91 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+# Идентификатор текущего запроса, выставляется RequestIdMiddleware
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+# Стандартные атрибуты LogRecord, которые не попадают в поля JSON
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime', 'taskName'}
+
+
+class RequestIdFilter(logging.Filter):
+    """Добавляет request_id текущего запроса в запись лога"""
+
+    def filter(self, record):
+        if getattr(record, 'request_id', None) is None:
+            record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной JSON-строкой.
+
+    Поля, переданные через extra (booking_id, user_id и т.п.), выводятся
+    как отдельные ключи.
+    """
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and value is not None:
+                data[key] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class QueueFileHandler(QueueHandler):
+    """Неблокирующая запись лога в файл с ротацией.
+
+    В потоке запроса запись только кладется в ограниченную очередь; в файл
+    ее пишет отдельный поток QueueListener через RotatingFileHandler. При
+    переполнении очереди записи отбрасываются, а не задерживают запрос.
+    """
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, backup_count=5, queue_size=10000):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.dropped = 0
+        target = RotatingFileHandler(
+            filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True
+        )
+        target.setFormatter(JsonFormatter())
+        self.listener = QueueListener(self.queue, target, respect_handler_level=True)
+        self.listener.start()
+        self._stopped = False
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Остановка потока записи после выгрузки очереди; повторный вызов ничего не делает"""
+        if not self._stopped:
+            self._stopped = True
+            self.listener.stop()
+
+    def prepare(self, record):
+        # Сохраняем структуру записи, но делаем ее безопасной для передачи в другой поток
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
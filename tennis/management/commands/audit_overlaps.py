@@ -0,0 +1,85 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tennis import sharding
+from tennis.models import Booking
+from tennis.occupancy import refresh
+
+
+class Command(BaseCommand):
+    help = 'Поиск пересекающихся активных бронирований одного корта (двойных броней)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--report', help='CSV-файл отчета (по умолчанию вывод в консоль)')
+        parser.add_argument(
+            '--cancel', action='store_true',
+            help='Отменить более поздние по времени создания дубликаты',
+        )
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Размер пачки при чтении из базы')
+
+    def handle(self, *args, **options):
+        stream = open(options['report'], 'w', encoding='utf-8', newline='') if options['report'] else sys.stdout
+        writer = csv.writer(stream)
+        writer.writerow(['court_id', 'date', 'kept_id', 'kept_start', 'duplicate_id', 'duplicate_start'])
+
+        # Корт со всеми бронями лежит на одном шарде, поэтому шарды проверяются по очереди
+        duplicates = {}
+        try:
+            for alias in sharding.each_shard():
+                rows = Booking.objects.filter(
+                    status__in=Booking.ACTIVE_STATUSES
+                ).order_by('court_id', 'date', 'start_time', 'id').values_list(
+                    'id', 'court_id', 'date', 'start_time', 'duration_hours', 'created_at'
+                ).iterator(chunk_size=options['chunk_size'])
+                for kept, duplicate in self.sweep(rows):
+                    writer.writerow([kept[1], kept[2], kept[0], kept[3], duplicate[0], duplicate[3]])
+                    duplicates.setdefault(alias, []).append(duplicate)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        if options['cancel'] and duplicates:
+            cancelled = 0
+            for alias, shard_duplicates in duplicates.items():
+                with sharding.use_shard(alias), sharding.atomic():
+                    for offset in range(0, len(shard_duplicates), 500):
+                        chunk = shard_duplicates[offset:offset + 500]
+                        cancelled += Booking.objects.filter(
+                            id__in=[row[0] for row in chunk],
+                            status__in=Booking.ACTIVE_STATUSES,
+                        ).update(status='cancelled', updated_at=timezone.now())
+                        refresh((row[1], row[2]) for row in chunk)
+            self.stdout.write(f'Отменено дубликатов: {cancelled}')
+
+        found = sum(len(shard_duplicates) for shard_duplicates in duplicates.values())
+        self.stdout.write(self.style.SUCCESS(f'Найдено пересечений: {found}'))
+
+    @staticmethod
+    def sweep(rows):
+        """Один проход по броням, отсортированным по (корт, дата, начало).
+
+        Хранится только последняя сохраняемая бронь текущего корта и дня:
+        сохраняемые брони не пересекаются между собой, поэтому новая бронь
+        может конфликтовать только с ней. Из пары пересекающихся дубликатом
+        считается созданная позже.
+        """
+        kept = None
+        kept_end = None
+        for row in rows:
+            booking_id, court_id, booking_date, start_time, duration_hours, created_at = row
+            start = start_time.hour * 60 + start_time.minute
+            end = start + duration_hours * 60
+
+            if kept is None or (kept[1], kept[2]) != (court_id, booking_date) or start >= kept_end:
+                kept, kept_end = row, end
+                continue
+
+            if (created_at, booking_id) < (kept[5], kept[0]):
+                # Текущая бронь создана раньше - дубликатом становится сохраненная
+                yield row, kept
+                kept, kept_end = row, end
+            else:
+                yield kept, row
@@ -0,0 +1,63 @@
+import csv
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tennis.analytics import build_report
+from tennis.models import TennisCenter
+from tennis.routers import replica_reads
+
+
+class Command(BaseCommand):
+    help = 'Загрузка кортов по дням недели и часам, спрос по покрытиям и доп. услугам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat,
+                            help='Начало периода, ГГГГ-ММ-ДД (по умолчанию 28 дней назад)')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat,
+                            help='Конец периода включительно (по умолчанию сегодня)')
+        parser.add_argument('--center', type=int, help='ID теннисного центра')
+        parser.add_argument('--heatmap', help='CSV-файл с тепловой картой загрузки')
+
+    def handle(self, *args, **options):
+        date_to = options['date_to'] or date.today()
+        date_from = options['date_from'] or date_to - timedelta(days=27)
+        if date_from > date_to:
+            raise CommandError('Начало периода позже конца')
+
+        with replica_reads():
+            tennis_center = None
+            if options['center']:
+                tennis_center = TennisCenter.objects.filter(pk=options['center']).first()
+                if tennis_center is None:
+                    raise CommandError(f'Теннисный центр {options["center"]} не найден')
+            report = build_report(date_from, date_to, tennis_center)
+
+        self.stdout.write(f'Период: {date_from} - {date_to}, бронирований: {report["bookings"]}')
+        self.stdout.write('Забронировано часов по покрытию:')
+        for surface, hours in report['surface_demand'].items():
+            self.stdout.write(f'  {surface}: {hours}')
+        addons = report['addons']
+        self.stdout.write(
+            f'Тренер: {addons["trainer_service"]:.0%}, ракетки: {addons["racket_rental"]:.0%} '
+            f'(в среднем {addons["rackets_per_booking"]:.2f}), мячи: {addons["balls_rental"]:.0%}'
+        )
+        lead_time = report['lead_time']
+        self.stdout.write(
+            f'Бронируют за {lead_time["mean"]:.1f} ч до игры (медиана {lead_time["median"]:.1f} ч)'
+        )
+
+        if options['heatmap']:
+            with open(options['heatmap'], 'w', encoding='utf-8', newline='') as stream:
+                self.write_heatmap(report, stream)
+        else:
+            self.write_heatmap(report, self.stdout)
+
+    @staticmethod
+    def write_heatmap(report, stream):
+        """Загрузка в процентах: строка на центр и день недели, колонка на час"""
+        writer = csv.writer(stream)
+        writer.writerow(['center', 'weekday'] + [f'{hour:02d}:00' for hour in report['hours']])
+        for heatmap in report['heatmaps']:
+            for weekday, values in heatmap['rows']:
+                writer.writerow([heatmap['center'].name, weekday] + values)
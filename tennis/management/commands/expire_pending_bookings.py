@@ -0,0 +1,74 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tennis import sharding
+from tennis.events import publish_availability_change
+from tennis.models import Booking
+from tennis.notifications import build_booking_expired_email
+from tennis.occupancy import refresh_bookings
+
+
+class Command(BaseCommand):
+    help = 'Отмена бронирований, не оплаченных в срок, с уведомлением пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=int,
+            default=getattr(settings, 'BOOKING_PAYMENT_DEADLINE_HOURS', 24),
+            help='Срок оплаты в часах с момента создания бронирования',
+        )
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=getattr(settings, 'BOOKING_EXPIRY_BATCH_SIZE', 500),
+            help='Количество бронирований в одной пачке',
+        )
+        parser.add_argument('--no-email', action='store_true', help='Не отправлять уведомления')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['hours'])
+        # Прошедшие бронирования не отменяем и не беспокоим ими клиентов
+        today = timezone.localdate()
+        batch_size = options['batch_size']
+        expired = 0
+        notified = 0
+
+        connection = None if options['no_email'] else get_connection()
+        if connection:
+            connection.open()
+        try:
+            for alias in sharding.each_shard():
+                while True:
+                    with sharding.atomic():
+                        # Индекс booking_status_created_idx; занятые другим процессом строки пропускаем
+                        batch = list(
+                            Booking.objects.filter(status='pending', created_at__lt=cutoff, date__gte=today)
+                            .select_related('tennis_center', 'court__tennis_center')
+                            .select_for_update(skip_locked=True, of=('self',))
+                            .order_by('created_at')[:batch_size]
+                        )
+                        if not batch:
+                            break
+                        Booking.objects.filter(id__in=[booking.id for booking in batch]).update(
+                            status='cancelled', updated_at=timezone.now()
+                        )
+                        refresh_bookings(batch)
+                        for booking in batch:
+                            publish_availability_change(booking, 'expired')
+                    expired += len(batch)
+
+                    if connection:
+                        try:
+                            notified += connection.send_messages(
+                                [build_booking_expired_email(booking) for booking in batch]
+                            ) or 0
+                        except Exception as e:
+                            self.stderr.write(f'Ошибка отправки уведомлений: {e}')
+        finally:
+            if connection:
+                connection.close()
+
+        self.stdout.write(self.style.SUCCESS(f'Отменено бронирований: {expired}, уведомлений: {notified}'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tennis import sharding
+from tennis.models import TennisCenter
+
+
+class Command(BaseCommand):
+    help = 'Подготовка шардов: диапазоны id и копия справочника теннисных центров'
+
+    def handle(self, *args, **options):
+        aliases = sharding.shard_aliases()
+        if not aliases:
+            raise CommandError('Шарды не настроены: укажите DATABASE_SHARD_URLS')
+
+        centers = list(TennisCenter.objects.using('default').order_by('id'))
+        for alias in aliases:
+            sharding.prepare_shard(alias)
+            self.stdout.write(f'{alias}: id с {(sharding.shard_index(alias) + 1) * sharding.SHARD_ID_SPAN}')
+        for center in centers:
+            if not center.shard:
+                # Центр, созданный до включения шардов, получает шард при сохранении
+                center.save(update_fields=['shard'])
+            sharding.replicate(center)
+            self.stdout.write(f'{center.name}: {sharding.shard_for_center(center.pk)}')
+
+        self.stdout.write(self.style.SUCCESS(f'Шардов: {len(aliases)}, центров скопировано: {len(centers)}'))
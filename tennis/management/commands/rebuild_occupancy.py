@@ -0,0 +1,30 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tennis import sharding
+from tennis.models import TennisCenter
+from tennis.occupancy import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Пересчет таблицы занятости кортов (битовых масок по дням) из бронирований'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--center', type=int, help='ID теннисного центра')
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat, help='С даты, ГГГГ-ММ-ДД')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat, help='По дату включительно')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Размер пачки при чтении и записи')
+
+    def handle(self, *args, **options):
+        tennis_center = None
+        if options['center']:
+            tennis_center = TennisCenter.objects.filter(pk=options['center']).first()
+            if tennis_center is None:
+                raise CommandError(f'Теннисный центр {options["center"]} не найден')
+
+        rows = 0
+        for alias in sharding.each_shard():
+            if tennis_center is None or alias == sharding.shard_for_center(tennis_center.pk):
+                rows += rebuild(tennis_center, options['date_from'], options['date_to'], options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Записано строк занятости: {rows}'))
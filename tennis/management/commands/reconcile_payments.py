@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tennis.reconciliation import StatementError, read_statement, reconcile, write_report
+
+
+class Command(BaseCommand):
+    help = 'Сверка выписки банка/POS (CSV) с ожидающими оплаты бронированиями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('statement', help='Путь к CSV-файлу выписки')
+        parser.add_argument('--report', help='Куда записать CSV-отчет о сверке')
+        parser.add_argument('--dry-run', action='store_true', help='Только сверить, не менять статусы')
+        parser.add_argument('--encoding', default='utf-8-sig', help='Кодировка файла выписки')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['statement'], encoding=options['encoding'], newline='') as statement:
+                rows, errors = read_statement(statement)
+                report = reconcile(rows, errors, apply=not options['dry_run'])
+        except (OSError, StatementError) as e:
+            raise CommandError(str(e))
+
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8', newline='') as stream:
+                write_report(report, stream)
+
+        for row in report.unmatched:
+            self.stdout.write(f'Не найдено: строка {row.line}, {row.date} {row.amount} "{row.reference}"')
+        for row, ids in report.ambiguous:
+            self.stdout.write(f'Неоднозначно: строка {row.line}, {row.date} {row.amount} - брони {ids}')
+        for line, error in report.errors:
+            self.stderr.write(f'Ошибка в строке {line}: {error}')
+        self.stdout.write(self.style.SUCCESS(report.summary()))
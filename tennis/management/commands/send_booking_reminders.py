@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tennis import sharding
+from tennis.models import Booking
+from tennis.notifications import build_booking_reminder_email
+
+
+class Command(BaseCommand):
+    help = 'Отправка напоминаний о бронированиях, которые начнутся в ближайшие N часов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=int,
+            default=getattr(settings, 'BOOKING_REMINDER_HOURS', 24),
+            help='За сколько часов до начала отправлять напоминание',
+        )
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=getattr(settings, 'BOOKING_REMINDER_BATCH_SIZE', 100),
+            help='Количество писем в одной пачке',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, кому будут отправлены письма')
+
+    def handle(self, *args, **options):
+        now = timezone.localtime()
+        horizon = now + timedelta(hours=options['hours'])
+
+        # Один запрос на шард по частичному индексу booking_reminder_due_idx
+        candidates = sharding.scatter_gather(
+            Booking.objects.filter(
+                reminder_sent_at__isnull=True,
+                status__in=Booking.CUSTOMER_STATUSES,
+                date__range=(now.date(), horizon.date()),
+            ).select_related('tennis_center', 'court__tennis_center').order_by('date', 'start_time'),
+            key=lambda booking: (booking.date, booking.start_time),
+        )
+
+        due = []
+        for booking in candidates:
+            starts_at = timezone.make_aware(datetime.combine(booking.date, booking.start_time))
+            if now <= starts_at <= horizon:
+                due.append(booking)
+
+        if options['dry_run']:
+            for booking in due:
+                self.stdout.write(f'{booking.id}: {booking.email} - {booking.date} {booking.start_time}')
+            self.stdout.write(f'К отправке: {len(due)}')
+            return
+
+        sent = 0
+        failed = 0
+        batch_size = options['batch_size']
+        connection = get_connection()
+        connection.open()
+        try:
+            for offset in range(0, len(due), batch_size):
+                chunk = due[offset:offset + batch_size]
+
+                # Пачка захватывается до отправки: параллельный запуск получит только
+                # еще не помеченные строки и не отправит те же письма повторно
+                claimed = self.claim(chunk, timezone.now())
+                errors = []
+                for booking in claimed:
+                    try:
+                        sent += connection.send_messages([build_booking_reminder_email(booking)]) or 0
+                    except Exception as e:
+                        errors.append(booking)
+                        self.stderr.write(f'Ошибка отправки напоминания {booking.id}: {e}')
+                # Неотправленные возвращаются в очередь, отправленные остаются помеченными
+                self.release(errors)
+                failed += len(errors)
+        finally:
+            connection.close()
+
+        self.stdout.write(self.style.SUCCESS(f'Отправлено напоминаний: {sent} из {len(due)}, ошибок: {failed}'))
+
+    @staticmethod
+    def claim(bookings, stamp):
+        """Пометка еще не напомненных бронирований меткой этого запуска; возвращает захваченные"""
+        by_id = {booking.id: booking for booking in bookings}
+        claimed = []
+        for alias, ids in sharding.group_by_shard(by_id).items():
+            shard = Booking.objects.using(alias)
+            if shard.filter(id__in=ids, reminder_sent_at__isnull=True).update(reminder_sent_at=stamp):
+                claimed += [by_id[pk] for pk in shard.filter(id__in=ids, reminder_sent_at=stamp).values_list('id', flat=True)]
+        for booking in claimed:
+            booking.reminder_sent_at = stamp
+        return sorted(claimed, key=lambda booking: (booking.date, booking.start_time))
+
+    @staticmethod
+    def release(bookings):
+        for alias, ids in sharding.group_by_shard(booking.id for booking in bookings).items():
+            Booking.objects.using(alias).filter(id__in=ids).update(reminder_sent_at=None)
@@ -0,0 +1,167 @@
+import cProfile
+import random
+import re
+import uuid
+
+from django.conf import settings
+from django.shortcuts import render
+
+from . import waitingroom
+from .log import request_id_var
+from .profiling import save_profile
+from .routers import request_routing
+
+
+REQUEST_ID_RE = re.compile(r'^[\w\-]{1,64}$')
+
+
+class RequestIdMiddleware:
+    """Присваивает каждому запросу идентификатор для логов.
+
+    Берется из заголовка X-Request-ID (если его выставил прокси) или
+    генерируется заново и возвращается в ответе.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = request.headers.get('X-Request-ID', '')
+        if not REQUEST_ID_RE.match(request_id):
+            request_id = uuid.uuid4().hex
+        request.request_id = request_id
+        token = request_id_var.set(request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_id_var.reset(token)
+        response['X-Request-ID'] = request_id
+        return response
+
+
+class ReplicaPinMiddleware:
+    """Закрепляет чтения пользователя за основной базой после записи.
+
+    Если во время запроса была запись, выставляется короткоживущая cookie;
+    пока она есть, ReplicaRouter не отправляет чтения этого клиента на реплики.
+    """
+    cookie_name = 'primary_pin'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = self.cookie_name in request.COOKIES
+        with request_routing(pinned) as state:
+            response = self.get_response(request)
+        if state['wrote']:
+            response.set_cookie(
+                self.cookie_name, '1',
+                max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 10),
+                httponly=True, samesite='Lax',
+            )
+        return response
+
+
+class LazySessionRenewalMiddleware:
+    """Перезапись сессии только при необходимости.
+
+    Заменяет SESSION_SAVE_EVERY_REQUEST: сессия сохраняется, если ее данные
+    действительно изменились или до истечения осталось меньше
+    SESSION_RENEWAL_THRESHOLD секунд. Скользящий таймаут сохраняется с
+    точностью до SESSION_COOKIE_AGE - SESSION_RENEWAL_THRESHOLD.
+    Должен стоять после SessionMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        session = getattr(request, 'session', None)
+        if session is None or not hasattr(session, 'needs_renewal'):
+            return response
+        if settings.SESSION_COOKIE_NAME not in request.COOKIES or session.is_empty():
+            return response
+
+        if session.modified:
+            # Значение присвоено, но данные те же - запись не нужна
+            if not session.has_changed() and not session.needs_renewal():
+                session.modified = False
+        elif session.needs_renewal():
+            session.modified = True
+        return response
+
+
+class WaitingRoomMiddleware:
+    """Виртуальная очередь на шаги мастера бронирования.
+
+    Одновременно мастер проходят не больше WAITING_ROOM_CAPACITY
+    пользователей, остальные получают подписанный билет и легкую страницу
+    ожидания, которая опрашивает waiting_room_status. Состояние очереди
+    хранится в кеше. Должен стоять после AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if hasattr(request, 'waiting_room_ticket'):
+            waitingroom.write_ticket(response, request.waiting_room_ticket)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not waitingroom.enabled():
+            return None
+        if request.resolver_match.url_name not in getattr(settings, 'WAITING_ROOM_URL_NAMES', ()):
+            return None
+        if not request.user.is_authenticated:
+            # login_required отправит на вход, место в очереди не нужно
+            return None
+
+        ticket = waitingroom.read_ticket(request) or waitingroom.issue()
+        request.waiting_room_ticket = ticket
+        if waitingroom.admit(ticket):
+            return None
+
+        response = render(request, 'tennis/waiting_room.html', {'position': waitingroom.position(ticket)})
+        response['Cache-Control'] = 'no-store'
+        return response
+
+
+class ProfilerMiddleware:
+    """Выборочное профилирование запросов через cProfile.
+
+    Профилируется доля PROFILER_SAMPLE_RATE запросов, а также запросы
+    персонала с заголовком PROFILER_HEADER. Статистика накапливается по
+    имени view в PROFILER_DIR и смотрится в админке (admin/profiler/).
+    Должен стоять последним в MIDDLEWARE.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def should_profile(self, request):
+        header = getattr(settings, 'PROFILER_HEADER', 'X-Profile')
+        if request.headers.get(header) and getattr(request, 'user', None) and request.user.is_staff:
+            return True
+        rate = getattr(settings, 'PROFILER_SAMPLE_RATE', 0)
+        return rate > 0 and random.random() < rate
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+
+        match = request.resolver_match
+        view_name = (match.url_name or match.view_name) if match else None
+        if view_name:
+            save_profile(view_name, profiler)
+        return response
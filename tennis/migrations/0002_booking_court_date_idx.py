@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tennis', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['court', 'date', 'start_time'], name='booking_court_date_idx'),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:02
+
+import re
+
+from django.db import migrations, models
+
+
+TRIGRAM_INDEXES = [
+    ('booking_full_name_trgm', 'UPPER(("full_name")::text) gin_trgm_ops'),
+    ('booking_email_trgm', 'UPPER(("email")::text) gin_trgm_ops'),
+    ('booking_phone_digits_trgm', '("phone_digits")::text gin_trgm_ops'),
+]
+
+
+def normalize_phone(value):
+    # Копия tennis.search.normalize_phone: миграция не зависит от кода приложения
+    digits = re.sub(r'\D', '', value or '')
+    if len(digits) == 11 and digits.startswith('8'):
+        digits = '7' + digits[1:]
+    elif len(digits) == 10:
+        digits = '7' + digits
+    return digits
+
+
+def fill_phone_digits(apps, schema_editor):
+    Booking = apps.get_model('tennis', 'Booking')
+    db_alias = schema_editor.connection.alias
+    batch = []
+    for booking in Booking.objects.using(db_alias).only('id', 'phone').iterator(chunk_size=2000):
+        booking.phone_digits = normalize_phone(booking.phone)
+        batch.append(booking)
+        if len(batch) >= 2000:
+            Booking.objects.using(db_alias).bulk_update(batch, ['phone_digits'])
+            batch = []
+    if batch:
+        Booking.objects.using(db_alias).bulk_update(batch, ['phone_digits'])
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # Триграммные индексы есть только в PostgreSQL, на SQLite поиск идет сканированием.
+    # CONCURRENTLY не блокирует запись в tennis_booking, но работает только вне
+    # транзакции, поэтому миграция не атомарная. Недостроенный после сбоя индекс
+    # (INVALID) удаляется и строится заново
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, expression in TRIGRAM_INDEXES:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid '
+                'WHERE pg_class.relname = %s AND NOT pg_index.indisvalid', [name]
+            )
+            if cursor.fetchone():
+                cursor.execute(f'DROP INDEX CONCURRENTLY {name}')
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON tennis_booking USING gin ({expression})'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, expression in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('tennis', '0003_booking_reminder_sent_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='phone_digits',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=20),
+        ),
+        migrations.RunPython(fill_phone_digits, migrations.RunPython.noop, atomic=True),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
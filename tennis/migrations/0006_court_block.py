@@ -0,0 +1,47 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tennis', '0005_booking_status_created_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='booking',
+            name='status',
+            field=models.CharField(choices=[('pending', 'В ожидании'), ('paid', 'Оплачено'), ('cancelled', 'Отменено'), ('blocked', 'Заблокировано')], default='pending', max_length=10, verbose_name='Статус'),
+        ),
+        migrations.CreateModel(
+            name='CourtBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_from', models.DateField(verbose_name='С даты')),
+                ('date_to', models.DateField(verbose_name='По дату')),
+                ('start_time', models.TimeField(verbose_name='Время начала')),
+                ('end_time', models.TimeField(verbose_name='Время окончания')),
+                ('reason', models.CharField(choices=[('tournament', 'Турнир'), ('maintenance', 'Обслуживание покрытия'), ('other', 'Другое')], max_length=20, verbose_name='Причина')),
+                ('comment', models.CharField(blank=True, max_length=200, verbose_name='Комментарий')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('courts', models.ManyToManyField(related_name='blocks', to='tennis.tenniscourt', verbose_name='Корты')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Создал')),
+                ('tennis_center', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocks', to='tennis.tenniscenter', verbose_name='Теннисный центр')),
+            ],
+            options={
+                'verbose_name': 'Блокировка кортов',
+                'verbose_name_plural': 'Блокировки кортов',
+                'ordering': ['-date_from'],
+            },
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='block',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='bookings', to='tennis.courtblock', verbose_name='Блокировка'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:18
+
+import django.db.models.deletion
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def hours_mask(start_time, duration_hours):
+    # Копия tennis.availability.hours_mask: миграция не зависит от кода приложения
+    start = start_time.hour * 60 + start_time.minute
+    end = min(start + int(duration_hours) * 60, 24 * 60)
+    first, last = start // 60, -(-end // 60)
+    return ((1 << (last - first)) - 1) << first
+
+
+def fill_occupancy(apps, schema_editor):
+    Booking = apps.get_model('tennis', 'Booking')
+    CourtOccupancy = apps.get_model('tennis', 'CourtOccupancy')
+    db_alias = schema_editor.connection.alias
+    masks = defaultdict(int)
+    rows = Booking.objects.using(db_alias).filter(status__in=['pending', 'paid', 'blocked']).values_list(
+        'tennis_center_id', 'court_id', 'date', 'start_time', 'duration_hours'
+    )
+    for center_id, court_id, booking_date, start_time, duration_hours in rows.iterator(chunk_size=2000):
+        masks[(center_id, court_id, booking_date)] |= hours_mask(start_time, duration_hours)
+    CourtOccupancy.objects.using(db_alias).bulk_create([
+        CourtOccupancy(tennis_center_id=center_id, court_id=court_id, date=booking_date, mask=mask)
+        for (center_id, court_id, booking_date), mask in masks.items()
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tennis', '0006_court_block'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourtOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('mask', models.IntegerField(default=0)),
+                ('court', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occupancy', to='tennis.tenniscourt')),
+                ('tennis_center', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='tennis.tenniscenter')),
+            ],
+            options={
+                'verbose_name': 'Занятость корта',
+                'verbose_name_plural': 'Занятость кортов',
+                'indexes': [models.Index(fields=['tennis_center', 'date'], name='occupancy_center_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('court', 'date'), name='occupancy_court_date_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_occupancy, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-19 09:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def freeze_placement(apps, schema_editor):
+    # Прежнее размещение (карта или остаток от деления id) записывается в поле,
+    # чтобы строки уже существующих центров остались на своих шардах
+    aliases = sorted(getattr(settings, 'DATABASE_SHARDS', []), key=lambda alias: int(alias.rsplit('_', 1)[1]))
+    if not aliases:
+        return
+    TennisCenter = apps.get_model('tennis', 'TennisCenter')
+    db_alias = schema_editor.connection.alias
+    for center_id in TennisCenter.objects.using(db_alias).filter(shard='').values_list('id', flat=True):
+        shard = settings.TENNIS_SHARD_MAP.get(center_id) or aliases[center_id % len(aliases)]
+        TennisCenter.objects.using(db_alias).filter(pk=center_id).update(shard=shard)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tennis', '0009_calendar_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tenniscenter',
+            name='shard',
+            field=models.CharField(blank=True, editable=False, max_length=32, verbose_name='Шард'),
+        ),
+        migrations.RunPython(freeze_placement, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.5 on 2026-10-19 09:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def detach_block_rows(apps, schema_editor):
+    # Автор блокировки уже записан в CourtBlock.created_by
+    Booking = apps.get_model('tennis', 'Booking')
+    Booking.objects.using(schema_editor.connection.alias).filter(status='blocked').update(user=None)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tennis', '0010_tennis_center_shard'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='booking',
+            name='user',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        migrations.RunPython(detach_block_rows, migrations.RunPython.noop),
+    ]
@@ -3,6 +3,9 @@ from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from decimal import Decimal
 
+from . import sharding
+from .search import normalize_phone
+
 
 class TennisCenter(models.Model):
     name = models.CharField(max_length=200, verbose_name="Название")
@@ -12,6 +15,8 @@ class TennisCenter(models.Model):
     number_of_courts = models.PositiveIntegerField(verbose_name="Количество кортов")
     opening_time = models.TimeField(verbose_name="Время открытия")
     closing_time = models.TimeField(verbose_name="Время закрытия")
+    # Шард с кортами и бронированиями центра; выбирается при создании и не меняется
+    shard = models.CharField(max_length=32, blank=True, editable=False, verbose_name="Шард")
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -21,6 +26,12 @@ class TennisCenter(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        if not self.shard:
+            self.shard = sharding.choose_shard()
+        super().save(*args, **kwargs)
+        sharding.remember_placement(self.pk, self.shard)
+
 
 class TennisCourt(models.Model):
     SURFACE_CHOICES = [
@@ -57,12 +68,62 @@ class TennisCourt(models.Model):
         return f"{self.tennis_center.name} - Корт {self.court_number}"
 
 
+class CourtBlock(models.Model):
+    """Блокировка кортов персоналом на диапазон дат и времени.
+
+    Занятость хранится строками Booking со статусом 'blocked', поэтому ее
+    видят все проверки доступности. Удаление блокировки освобождает корты.
+    """
+    REASON_CHOICES = [
+        ('tournament', 'Турнир'),
+        ('maintenance', 'Обслуживание покрытия'),
+        ('other', 'Другое'),
+    ]
+
+    tennis_center = models.ForeignKey(
+        TennisCenter,
+        on_delete=models.CASCADE,
+        related_name='blocks',
+        verbose_name="Теннисный центр"
+    )
+    courts = models.ManyToManyField(TennisCourt, related_name='blocks', verbose_name="Корты")
+    date_from = models.DateField(verbose_name="С даты")
+    date_to = models.DateField(verbose_name="По дату")
+    start_time = models.TimeField(verbose_name="Время начала")
+    end_time = models.TimeField(verbose_name="Время окончания")
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, verbose_name="Причина")
+    comment = models.CharField(max_length=200, blank=True, verbose_name="Комментарий")
+    # Пользователи живут в default, блокировки - на шарде центра
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        db_constraint=False,
+        verbose_name="Создал"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Блокировка кортов"
+        verbose_name_plural = "Блокировки кортов"
+        ordering = ['-date_from']
+
+    def __str__(self):
+        return f"{self.get_reason_display()}: {self.tennis_center.name}, {self.date_from} - {self.date_to}"
+
+
 class Booking(models.Model):
     STATUS_CHOICES = [
         ('pending', 'В ожидании'),
         ('paid', 'Оплачено'),
         ('cancelled', 'Отменено'),
+        ('blocked', 'Заблокировано'),
     ]
+    # Статусы бронирований клиентов
+    CUSTOMER_STATUSES = ['pending', 'paid']
+    # Статусы, при которых корт считается занятым
+    ACTIVE_STATUSES = CUSTOMER_STATUSES + ['blocked']
 
     tennis_center = models.ForeignKey(
         TennisCenter,
@@ -74,9 +135,15 @@ class Booking(models.Model):
         on_delete=models.CASCADE,
         verbose_name="Корт"
     )
+    # Пользователи живут в default, бронирования - на шарде центра.
+    # У строк блокировок (status='blocked') пользователя нет: автор хранится
+    # в CourtBlock.created_by, и удаление автора не освобождает корты
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        db_constraint=False,
         verbose_name="Пользователь"
     )
     date = models.DateField(verbose_name="Дата")
@@ -108,6 +175,18 @@ class Booking(models.Model):
     full_name = models.CharField(max_length=200, verbose_name="Полное имя")
     phone = models.CharField(max_length=20, verbose_name="Телефон")
     email = models.EmailField(verbose_name="Email")
+    # Нормализованный телефон для индексированного поиска (tennis.search)
+    phone_digits = models.CharField(max_length=20, blank=True, db_index=True, editable=False)
+
+    reminder_sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Напоминание отправлено")
+    block = models.ForeignKey(
+        CourtBlock,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='bookings',
+        verbose_name="Блокировка"
+    )
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -116,6 +195,15 @@ class Booking(models.Model):
         verbose_name = "Бронирование"
         verbose_name_plural = "Бронирования"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['court', 'date', 'start_time'], name='booking_court_date_idx'),
+            models.Index(fields=['status', 'created_at'], name='booking_status_created_idx'),
+            models.Index(
+                fields=['date', 'start_time'],
+                condition=models.Q(reminder_sent_at__isnull=True),
+                name='booking_reminder_due_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.full_name} - {self.date} {self.start_time}"
@@ -134,6 +222,7 @@ class Booking(models.Model):
     def save(self, *args, **kwargs):
         if not self.total_price:
             self.total_price = self.calculate_total_price()
+        self.phone_digits = normalize_phone(self.phone)
         super().save(*args, **kwargs)
 
     def can_be_cancelled(self):
@@ -141,6 +230,46 @@ class Booking(models.Model):
         return self.status == 'pending'
 
 
+class CourtOccupancy(models.Model):
+    """Занятость корта за день: бит N маски - занят ли час N:00-N+1:00.
+
+    Денормализация Booking для показа свободных слотов
+    (availability.range_availability). Обновляется в той же транзакции, что и
+    бронирование (tennis.occupancy), пересчитывается командой rebuild_occupancy.
+    """
+    tennis_center = models.ForeignKey(TennisCenter, on_delete=models.CASCADE, related_name='+')
+    court = models.ForeignKey(TennisCourt, on_delete=models.CASCADE, related_name='occupancy')
+    date = models.DateField()
+    mask = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Занятость корта"
+        verbose_name_plural = "Занятость кортов"
+        constraints = [
+            models.UniqueConstraint(fields=['court', 'date'], name='occupancy_court_date_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['tennis_center', 'date'], name='occupancy_center_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.court_id} {self.date}: {self.mask:024b}"
+
+
+class CalendarToken(models.Model):
+    """Секретный токен ленты .ics пользователя; новый токен отключает старую ссылку"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='calendar_token')
+    token = models.CharField(max_length=64, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Токен календаря"
+        verbose_name_plural = "Токены календаря"
+
+    def __str__(self):
+        return f"{self.user}"
+
+
 class BookingSession(models.Model):
     """Модель для хранения данных между шагами бронирования"""
     session_key = models.CharField(max_length=40, unique=True)
@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.mail import EmailMessage
+
+
+def build_booking_reminder_email(booking):
+    """Письмо-напоминание о предстоящем бронировании"""
+    subject = f'Напоминание о бронировании - {booking.tennis_center.name}'
+    message = f"""
+    Здравствуйте, {booking.full_name}!
+
+    Напоминаем о вашем бронировании:
+
+    Теннисный центр: {booking.tennis_center.name}
+    Адрес: {booking.tennis_center.address}
+    Корт: {booking.court}
+    Дата: {booking.date}
+    Время: {booking.start_time}
+    Продолжительность: {booking.duration_hours} час(а/ов)
+
+    Статус: {booking.get_status_display()}
+
+    До встречи на корте!
+    """
+    return EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [booking.email])
+
+
+def build_booking_expired_email(booking):
+    """Письмо об автоматической отмене неоплаченного бронирования"""
+    subject = f'Бронирование отменено - {booking.tennis_center.name}'
+    message = f"""
+    Здравствуйте, {booking.full_name}!
+
+    Ваше бронирование не было оплачено вовремя и автоматически отменено:
+
+    Теннисный центр: {booking.tennis_center.name}
+    Корт: {booking.court}
+    Дата: {booking.date}
+    Время: {booking.start_time}
+    Общая стоимость: {booking.total_price} ₸
+
+    Вы можете оформить новое бронирование на сайте.
+    """
+    return EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [booking.email])
@@ -0,0 +1,117 @@
+from collections import defaultdict
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Q
+
+from . import sharding
+from .availability import hours_mask, invalidate_center
+from .models import TennisCourt, Booking, CourtOccupancy
+
+
+def compute_masks(rows):
+    """Маски по (корт, дата) из строк (court_id, date, start_time, duration_hours)"""
+    masks = defaultdict(int)
+    for court_id, booking_date, start_time, duration_hours in rows:
+        masks[(court_id, booking_date)] |= hours_mask(start_time, duration_hours)
+    return masks
+
+
+def _lock(court_ids, dates):
+    return {
+        (row.court_id, row.date): row
+        for row in CourtOccupancy.objects.select_for_update().filter(court_id__in=court_ids, date__in=dates)
+    }
+
+
+def refresh(pairs, centers=None):
+    """Пересчет масок для пар (court_id, date) в текущей транзакции.
+
+    Строки занятости блокируются до чтения бронирований, поэтому
+    параллельные транзакции по тому же корту и дню пересчитывают маску по
+    очереди и видят бронирования друг друга. centers - известные
+    {court_id: tennis_center_id}, чтобы не читать их для новых строк.
+    После коммита сбрасываются общие снимки занятости затронутых центров.
+    """
+    pairs = set(pairs)
+    if not pairs:
+        return
+    court_ids = {court_id for court_id, booking_date in pairs}
+    dates = {booking_date for court_id, booking_date in pairs}
+
+    with sharding.atomic(savepoint=False):
+        rows = _lock(court_ids, dates)
+        missing = pairs - set(rows)
+        if missing:
+            centers = dict(centers or {})
+            unknown = {court_id for court_id, booking_date in missing} - set(centers)
+            if unknown:
+                centers.update(TennisCourt.objects.filter(id__in=unknown).values_list('id', 'tennis_center_id'))
+            CourtOccupancy.objects.bulk_create([
+                CourtOccupancy(tennis_center_id=centers[court_id], court_id=court_id, date=booking_date)
+                for court_id, booking_date in missing if court_id in centers
+            ], ignore_conflicts=True)
+            rows = _lock(court_ids, dates)
+
+        masks = compute_masks(Booking.objects.filter(
+            court_id__in=court_ids,
+            date__in=dates,
+            status__in=Booking.ACTIVE_STATUSES,
+        ).values_list('court_id', 'date', 'start_time', 'duration_hours'))
+
+        changed = []
+        for pair in pairs & set(rows):
+            row = rows[pair]
+            if row.mask != masks.get(pair, 0):
+                row.mask = masks.get(pair, 0)
+                changed.append(row)
+        if changed:
+            CourtOccupancy.objects.bulk_update(changed, ['mask'])
+
+        center_ids = {rows[pair].tennis_center_id for pair in pairs & set(rows)}
+        transaction.on_commit(partial(_invalidate_centers, center_ids), using=sharding.current_db())
+
+
+def _invalidate_centers(center_ids):
+    for tennis_center_id in center_ids:
+        invalidate_center(tennis_center_id)
+
+
+def refresh_bookings(bookings):
+    """Пересчет масок дней, затронутых бронированиями"""
+    bookings = list(bookings)
+    refresh(
+        [(booking.court_id, booking.date) for booking in bookings],
+        centers={booking.court_id: booking.tennis_center_id for booking in bookings},
+    )
+
+
+def rebuild(tennis_center=None, date_from=None, date_to=None, chunk_size=2000):
+    """Полный пересчет таблицы занятости текущего шарда из Booking. Возвращает число строк"""
+    bookings = Booking.objects.filter(status__in=Booking.ACTIVE_STATUSES)
+    stale = CourtOccupancy.objects.all()
+    scope = Q()
+    if tennis_center is not None:
+        scope &= Q(tennis_center=tennis_center)
+    if date_from is not None:
+        scope &= Q(date__gte=date_from)
+    if date_to is not None:
+        scope &= Q(date__lte=date_to)
+    bookings = bookings.filter(scope)
+    stale = stale.filter(scope)
+
+    masks = defaultdict(int)
+    centers = {}
+    for court_id, center_id, booking_date, start_time, duration_hours in bookings.values_list(
+        'court_id', 'tennis_center_id', 'date', 'start_time', 'duration_hours'
+    ).iterator(chunk_size=chunk_size):
+        masks[(court_id, booking_date)] |= hours_mask(start_time, duration_hours)
+        centers[court_id] = center_id
+
+    with sharding.atomic():
+        stale.delete()
+        CourtOccupancy.objects.bulk_create([
+            CourtOccupancy(tennis_center_id=centers[court_id], court_id=court_id, date=booking_date, mask=mask)
+            for (court_id, booking_date), mask in masks.items()
+        ], batch_size=chunk_size)
+    return len(masks)
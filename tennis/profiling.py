@@ -0,0 +1,82 @@
+import os
+import pstats
+import re
+import threading
+from pathlib import Path
+
+from django.conf import settings
+
+
+_merge_lock = threading.Lock()
+_SAFE_NAME_RE = re.compile(r'[^\w.\-]')
+
+
+def profiles_dir():
+    return Path(getattr(settings, 'PROFILER_DIR', settings.BASE_DIR / 'profiles'))
+
+
+def profile_path(view_name):
+    return profiles_dir() / f'{_SAFE_NAME_RE.sub("_", view_name)}.prof'
+
+
+def save_profile(view_name, profiler):
+    """Добавление замера к накопленной статистике view.
+
+    Файл перезаписывается атомарно; при одновременной записи из разных
+    процессов один из замеров может потеряться, что допустимо для выборки.
+    """
+    path = profile_path(view_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _merge_lock:
+        stats = pstats.Stats(profiler)
+        if path.exists():
+            try:
+                stats.add(str(path))
+            except (EOFError, TypeError, ValueError):
+                # Поврежденный файл начинаем заново
+                pass
+        tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        stats.dump_stats(str(tmp_path))
+        os.replace(tmp_path, path)
+
+
+def hot_spots(limit=20, project_only=False):
+    """Топ функций по суммарному времени для каждого профилированного view"""
+    report = []
+    directory = profiles_dir()
+    if not directory.exists():
+        return report
+
+    base_dir = str(settings.BASE_DIR)
+    for path in sorted(directory.glob('*.prof')):
+        try:
+            stats = pstats.Stats(str(path))
+        except (EOFError, TypeError, ValueError):
+            continue
+
+        rows = []
+        for (filename, line, func), (cc, nc, tt, ct, callers) in stats.stats.items():
+            if project_only and not filename.startswith(base_dir):
+                continue
+            rows.append({
+                'function': f'{os.path.basename(filename)}:{line}({func})',
+                'calls': nc,
+                'tottime': tt,
+                'cumtime': ct,
+                'percall': ct / nc if nc else 0,
+            })
+        rows.sort(key=lambda row: row['cumtime'], reverse=True)
+        report.append({
+            'view': path.stem,
+            'total_time': stats.total_tt,
+            'rows': rows[:limit],
+        })
+    return report
+
+
+def reset_profiles():
+    """Удаление накопленной статистики"""
+    directory = profiles_dir()
+    if directory.exists():
+        for path in directory.glob('*.prof'):
+            path.unlink()
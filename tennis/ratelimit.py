@@ -0,0 +1,147 @@
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+
+CACHE_PREFIX = 'ratelimit'
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """Разбор лимита вида '30/m' в (количество, окно в секундах)"""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period]
+
+
+def get_client_ip(request):
+    """IP клиента с учетом доверенных прокси.
+
+    Каждый из RATELIMIT_PROXY_HOPS доверенных прокси дописывает в
+    X-Forwarded-For адрес, с которого пришел запрос, поэтому адрес клиента -
+    hops-я запись справа. Левые записи задает сам клиент, им не доверяем.
+    """
+    hops = getattr(settings, 'RATELIMIT_PROXY_HOPS', 0)
+    if hops > 0:
+        forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def hit(key, limit, window):
+    """Учет запроса по скользящему окну.
+
+    Используются два соседних фиксированных окна в кеше: счетчик прошлого
+    окна учитывается с весом оставшейся доли текущего. Возвращает
+    (разрешен ли запрос, остаток, через сколько секунд повторить).
+    """
+    now = time.time()
+    current = int(now // window)
+    elapsed = now - current * window
+    current_key = f'{CACHE_PREFIX}:{key}:{current}'
+    previous_key = f'{CACHE_PREFIX}:{key}:{current - 1}'
+
+    counts = cache.get_many([current_key, previous_key])
+    previous = counts.get(previous_key, 0)
+    used = counts.get(current_key, 0)
+    estimated = previous * (window - elapsed) / window + used
+
+    if estimated + 1 > limit:
+        if used + 1 > limit or not previous:
+            retry_after = window - elapsed
+        else:
+            # Ждем, пока вес прошлого окна не опустится достаточно
+            retry_after = window - elapsed - (limit - 1 - used) * window / previous
+        return False, 0, max(1, math.ceil(retry_after))
+
+    if cache.add(current_key, 1, timeout=window * 2):
+        used = 1
+    else:
+        try:
+            used = cache.incr(current_key)
+        except ValueError:
+            cache.set(current_key, 1, timeout=window * 2)
+            used = 1
+    remaining = max(0, int(limit - previous * (window - elapsed) / window - used))
+    return True, remaining, 0
+
+
+def _count(scope, outcome):
+    key = f'{CACHE_PREFIX}:stats:{scope}:{outcome}'
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def get_counters():
+    """Счетчики разрешенных и отклоненных запросов по областям"""
+    keys = {
+        (scope, outcome): f'{CACHE_PREFIX}:stats:{scope}:{outcome}'
+        for scope in getattr(settings, 'RATELIMITS', {})
+        for outcome in ('allowed', 'blocked')
+    }
+    values = cache.get_many(list(keys.values()))
+    counters = {}
+    for (scope, outcome), key in keys.items():
+        counters.setdefault(scope, {})[outcome] = values.get(key, 0)
+    return counters
+
+
+def too_many_requests(request, retry_after):
+    """Ответ 429 с заголовком Retry-After"""
+    message = 'Слишком много запросов. Попробуйте позже.'
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest' or request.path.startswith('/ajax/'):
+        response = JsonResponse({'error': message}, status=429)
+    else:
+        response = HttpResponse(message, status=429, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def ratelimit(scope, methods=None):
+    """Декоратор ограничения частоты запросов.
+
+    Лимиты берутся из settings.RATELIMITS[scope]: бюджет 'ip' считается по
+    адресу клиента, бюджет 'user' - по авторизованному пользователю.
+    methods ограничивает проверку указанными HTTP-методами.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            budgets = getattr(settings, 'RATELIMITS', {}).get(scope)
+            if not budgets or not getattr(settings, 'RATELIMIT_ENABLED', True):
+                return view_func(request, *args, **kwargs)
+            if methods and request.method not in methods:
+                return view_func(request, *args, **kwargs)
+
+            remaining = None
+            limit = None
+            for kind, rate in budgets.items():
+                if kind == 'user':
+                    if not request.user.is_authenticated:
+                        continue
+                    ident = f'user:{request.user.pk}'
+                else:
+                    ident = f'ip:{get_client_ip(request)}'
+                count, window = parse_rate(rate)
+                allowed, left, retry_after = hit(f'{scope}:{ident}', count, window)
+                if not allowed:
+                    _count(scope, 'blocked')
+                    return too_many_requests(request, retry_after)
+                if remaining is None or left < remaining:
+                    remaining, limit = left, count
+
+            _count(scope, 'allowed')
+            response = view_func(request, *args, **kwargs)
+            if limit is not None:
+                response['X-RateLimit-Limit'] = str(limit)
+                response['X-RateLimit-Remaining'] = str(remaining)
+            return response
+        return wrapper
+    return decorator
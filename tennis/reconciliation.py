@@ -0,0 +1,213 @@
+import csv
+import re
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import sharding
+from .models import Booking
+
+
+StatementRow = namedtuple('StatementRow', ['line', 'date', 'amount', 'reference'])
+
+# Возможные названия колонок в выписках банков и POS-терминалов
+COLUMN_ALIASES = {
+    'date': ['date', 'дата', 'дата операции', 'transaction date'],
+    'amount': ['amount', 'сумма', 'сумма операции', 'sum'],
+    'reference': ['reference', 'назначение', 'назначение платежа', 'description', 'комментарий'],
+}
+DATE_FORMATS = ['%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y', '%d.%m.%Y %H:%M', '%Y-%m-%d %H:%M:%S']
+
+# Номер бронирования в назначении платежа: "бронь 123", "бронирование №123",
+# "booking #123". Голые "№123"/"#123" не подходят: это номера счетов и чеков
+BOOKING_REF_RE = re.compile(r'\b(?:брон\w*|booking)\s*(?:[#№]|no\.?)?\s*(\d+)\b', re.IGNORECASE)
+
+# Сколько дней до даты платежа может быть создано бронирование
+MATCH_WINDOW_DAYS = 3
+
+# Сколько строк выписки сверяется за один проход (один запрос на шард)
+CHUNK_SIZE = 1000
+
+
+class StatementError(ValueError):
+    """Файл выписки не удалось разобрать"""
+
+
+def _parse_date(value):
+    value = value.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f'Неизвестный формат даты: {value}')
+
+
+def _parse_amount(value):
+    value = value.replace('\xa0', '').replace(' ', '').replace(',', '.')
+    try:
+        return Decimal(value).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f'Некорректная сумма: {value}')
+
+
+def read_statement(lines):
+    """Потоковое чтение CSV-выписки.
+
+    lines - итератор строк (открытый текстовый файл). Возвращает генератор
+    StatementRow и список ошибок разбора, который заполняется по мере чтения.
+    """
+    lines = iter(lines)
+    first = next(lines, '')
+    try:
+        dialect = csv.Sniffer().sniff(first, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+
+    def all_lines():
+        yield first
+        yield from lines
+
+    reader = csv.reader(all_lines(), dialect)
+    header = [name.strip().lower() for name in next(reader, [])]
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in header:
+                columns[field] = header.index(alias)
+                break
+    if 'date' not in columns or 'amount' not in columns:
+        raise StatementError('В выписке нет колонок с датой и суммой')
+
+    errors = []
+
+    def rows():
+        for line, values in enumerate(reader, start=2):
+            if not any(values):
+                continue
+            try:
+                reference = values[columns['reference']] if 'reference' in columns else ''
+                yield StatementRow(
+                    line,
+                    _parse_date(values[columns['date']]),
+                    _parse_amount(values[columns['amount']]),
+                    reference.strip(),
+                )
+            except (ValueError, IndexError) as e:
+                errors.append((line, str(e)))
+
+    return rows(), errors
+
+
+class ReconciliationReport:
+    """Результат сверки выписки с ожидающими оплаты бронированиями"""
+
+    def __init__(self):
+        self.matched = []      # (строка выписки, бронирование)
+        self.unmatched = []    # строки выписки без подходящего бронирования
+        self.ambiguous = []    # (строка выписки, список id подходящих бронирований)
+        self.errors = []       # (номер строки, ошибка разбора)
+        self.updated = 0
+
+    def summary(self):
+        return (
+            f'Сопоставлено: {len(self.matched)}, обновлено: {self.updated}, '
+            f'не найдено: {len(self.unmatched)}, неоднозначно: {len(self.ambiguous)}, '
+            f'ошибок разбора: {len(self.errors)}'
+        )
+
+
+def reconcile(rows, errors=None, apply=True, chunk_size=CHUNK_SIZE):
+    """Сопоставление строк выписки с бронированиями в статусе pending.
+
+    Выписка читается пачками по chunk_size строк, в памяти одна пачка и
+    отчет. Для пачки ожидающие бронирования читаются одним запросом на шард
+    и раскладываются по хеш-таблицам: по id (номер из назначения платежа) и
+    по паре (сумма, дата создания). Найденные бронирования переводятся в
+    paid одним UPDATE на шард в его транзакции.
+    """
+    report = ReconciliationReport()
+    if errors is not None:
+        report.errors = errors
+    used = set()
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return report
+        _reconcile_chunk(chunk, report, used, apply)
+
+
+def _reconcile_chunk(rows, report, used, apply):
+    referenced_ids = set()
+    for row in rows:
+        referenced_ids.update(int(match) for match in BOOKING_REF_RE.findall(row.reference))
+
+    first_date = min(row.date for row in rows) - timedelta(days=MATCH_WINDOW_DAYS)
+    last_date = max(row.date for row in rows)
+    window_start = timezone.make_aware(datetime.combine(first_date, datetime.min.time()))
+    window_end = timezone.make_aware(datetime.combine(last_date + timedelta(days=1), datetime.min.time()))
+
+    pending = Booking.objects.filter(status='pending').filter(
+        Q(id__in=referenced_ids) | Q(created_at__gte=window_start, created_at__lt=window_end)
+    ).only('id', 'total_price', 'created_at')
+
+    by_id = {}
+    by_amount_date = defaultdict(list)
+    for booking in sharding.scatter_gather(pending):
+        by_id[booking.id] = booking
+        created = timezone.localtime(booking.created_at).date()
+        by_amount_date[(booking.total_price, created)].append(booking)
+
+    matched = []
+    for row in rows:
+        # 1. Номер бронирования в назначении платежа и совпадающая сумма
+        candidates = [
+            by_id[int(ref)] for ref in BOOKING_REF_RE.findall(row.reference)
+            if int(ref) in by_id and by_id[int(ref)].total_price == row.amount
+        ]
+        # 2. Сумма и дата: бронирование создано в день платежа или незадолго до него
+        if not candidates:
+            for days in range(MATCH_WINDOW_DAYS + 1):
+                candidates = by_amount_date.get((row.amount, row.date - timedelta(days=days)), [])
+                candidates = [booking for booking in candidates if booking.id not in used]
+                if candidates:
+                    break
+
+        candidates = [booking for booking in candidates if booking.id not in used]
+        if not candidates:
+            report.unmatched.append(row)
+        elif len(candidates) > 1:
+            report.ambiguous.append((row, [booking.id for booking in candidates]))
+        else:
+            used.add(candidates[0].id)
+            matched.append((row, candidates[0]))
+    report.matched += matched
+
+    if apply and matched:
+        matched_ids = sharding.group_by_shard(booking.id for row, booking in matched)
+        for alias, ids in matched_ids.items():
+            with transaction.atomic(using=alias):
+                report.updated += Booking.objects.using(alias).filter(
+                    id__in=ids,
+                    status='pending',
+                ).update(status='paid', updated_at=timezone.now())
+
+
+def write_report(report, stream):
+    """Отчет о сверке в CSV"""
+    writer = csv.writer(stream)
+    writer.writerow(['result', 'line', 'date', 'amount', 'reference', 'booking_ids'])
+    for row, booking in report.matched:
+        writer.writerow(['matched', row.line, row.date, row.amount, row.reference, booking.id])
+    for row in report.unmatched:
+        writer.writerow(['unmatched', row.line, row.date, row.amount, row.reference, ''])
+    for row, ids in report.ambiguous:
+        writer.writerow(['ambiguous', row.line, row.date, row.amount, row.reference, ' '.join(map(str, ids))])
+    for line, error in report.errors:
+        writer.writerow(['error', line, '', '', error, ''])
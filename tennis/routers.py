@@ -0,0 +1,124 @@
+import contextvars
+import random
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+
+from . import sharding
+
+
+# Чтение с реплик разрешено только внутри replica_reads()/use_replica
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+# Состояние текущего запроса: закреплен ли он за основной базой и была ли запись
+_request_state = contextvars.ContextVar('replica_request_state', default=None)
+
+# Эти приложения всегда читаются с основной базы: сессия и права пользователя
+# должны быть видны сразу после входа
+PRIMARY_ONLY_APPS = {'sessions', 'auth', 'contenttypes', 'admin'}
+
+
+def replica_aliases():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+@contextmanager
+def replica_reads():
+    """Разрешает чтение с реплик внутри блока"""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def use_replica(view_func):
+    """Декоратор view, читающего данные с реплики"""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        with replica_reads():
+            response = view_func(request, *args, **kwargs)
+            # Ленивые шаблонные ответы рендерим, пока чтение с реплики разрешено
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+            return response
+    return wrapper
+
+
+@contextmanager
+def request_routing(pinned):
+    """Состояние маршрутизации на время обработки одного запроса"""
+    state = {'pinned': pinned, 'wrote': False}
+    token = _request_state.set(state)
+    try:
+        with sharding.use_shard(None):
+            yield state
+    finally:
+        _request_state.reset(token)
+
+
+class ShardRouter:
+    """Маршрутизатор кортов, бронирований и блокировок по шардам центров.
+
+    Шард берется из подсказки-экземпляра (центр, загруженная строка или ее
+    tennis_center_id), иначе из sharding.use_shard()/activate(). Без
+    шардов или для остальных моделей решение остается за ReplicaRouter.
+    """
+
+    def _db(self, model, hints):
+        if not sharding.is_sharded(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None:
+            if instance._meta.label_lower == 'tennis.tenniscenter':
+                return sharding.shard_for_center(instance.pk)
+            if sharding.is_sharded(type(instance)) and instance._state.db:
+                return instance._state.db
+            center_id = getattr(instance, 'tennis_center_id', None)
+            if center_id is not None:
+                return sharding.shard_for_center(center_id)
+        return sharding.current_shard()
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, hints)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return True if db.startswith('shard_') else None
+
+
+class ReplicaRouter:
+    """Маршрутизатор чтения на реплики с закреплением за основной базой.
+
+    Запись и любые чтения вне replica_reads() идут в default. После записи
+    запрос (а через cookie, выставляемую ReplicaPinMiddleware, и следующие
+    запросы пользователя в течение REPLICA_PIN_SECONDS) читает только с
+    основной базы, чтобы пользователь сразу видел свое бронирование.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_ONLY_APPS or not _replica_reads.get():
+            return 'default'
+        state = _request_state.get()
+        if state and state['pinned']:
+            return 'default'
+        replicas = replica_aliases()
+        if not replicas:
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None and model._meta.app_label != 'sessions':
+            state['wrote'] = True
+            state['pinned'] = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схема реплик приходит с основной базы
+        return db not in replica_aliases()
@@ -0,0 +1,56 @@
+import re
+
+from django.contrib.auth.models import User
+from django.db.models import Q
+
+
+_NON_DIGITS_RE = re.compile(r'\D')
+_PHONE_RE = re.compile(r'^[\d\s()+\-]+$')
+
+# Минимальная длина для поиска по части номера или имени (как у триграмм)
+MIN_TERM_LENGTH = 3
+
+# Сколько пользователей, найденных по части логина, попадает в условие
+MAX_USERNAME_MATCHES = 100
+
+
+def normalize_phone(value):
+    """Телефон в виде одних цифр в формате 7XXXXXXXXXX"""
+    digits = _NON_DIGITS_RE.sub('', value or '')
+    if len(digits) == 11 and digits.startswith('8'):
+        digits = '7' + digits[1:]
+    elif len(digits) == 10:
+        digits = '7' + digits
+    return digits
+
+
+def search_bookings(queryset, term):
+    """Поиск бронирований по имени, телефону, email или логину.
+
+    Условия подобраны так, чтобы использовать индексы: полный номер ищется
+    по B-tree индексу phone_digits, часть номера, имени и email - по
+    триграммным GIN-индексам на PostgreSQL (на SQLite - обычным сканированием).
+    Логин ищется по подстроке в auth_user отдельным запросом (не больше
+    MAX_USERNAME_MATCHES пользователей): бронирования могут лежать на шардах,
+    куда подзапрос к auth_user не передать. Короткий запрос - точный логин.
+    """
+    term = (term or '').strip()
+    if not term:
+        return queryset
+
+    digits = _NON_DIGITS_RE.sub('', term)
+    if _PHONE_RE.match(term) and len(digits) >= MIN_TERM_LENGTH:
+        normalized = normalize_phone(digits)
+        if len(normalized) == 11:
+            return queryset.filter(phone_digits=normalized)
+        return queryset.filter(phone_digits__contains=digits)
+
+    if len(term) < MIN_TERM_LENGTH:
+        return queryset.filter(user__username=term)
+
+    user_ids = list(User.objects.filter(username__icontains=term).values_list('id', flat=True)[:MAX_USERNAME_MATCHES])
+    return queryset.filter(
+        Q(full_name__icontains=term)
+        | Q(email__icontains=term)
+        | Q(user_id__in=user_ids)
+    )
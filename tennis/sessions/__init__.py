@@ -0,0 +1,50 @@
+import copy
+import time
+
+from django.conf import settings
+
+
+# Время последнего сохранения сессии (unix time), хранится в самих данных
+RENEWED_AT_KEY = '_renewed_at'
+
+
+class LazyRenewalMixin:
+    """Сессия, которая знает, нужно ли ее перезаписывать.
+
+    Запоминает загруженные данные и время последнего сохранения, чтобы
+    LazySessionRenewalMiddleware писал в базу только при реальном изменении
+    данных или когда до истечения остается меньше SESSION_RENEWAL_THRESHOLD.
+    """
+
+    _snapshot = None
+
+    def load(self):
+        data = super().load()
+        self._snapshot = (self._session_key, self._strip(data))
+        return data
+
+    def save(self, must_create=False):
+        self._get_session(no_load=must_create)[RENEWED_AT_KEY] = int(time.time())
+        super().save(must_create=must_create)
+        self._snapshot = (self._session_key, self._strip(self._session_cache))
+
+    @staticmethod
+    def _strip(data):
+        data = copy.deepcopy(data)
+        data.pop(RENEWED_AT_KEY, None)
+        return data
+
+    def has_changed(self):
+        """Отличаются ли данные от сохраненных в хранилище"""
+        if self._snapshot is None or not hasattr(self, '_session_cache'):
+            return True
+        key, data = self._snapshot
+        return key != self._session_key or data != self._strip(self._session_cache)
+
+    def needs_renewal(self):
+        """Пора ли продлить срок жизни сессии"""
+        renewed_at = self.get(RENEWED_AT_KEY)
+        if renewed_at is None:
+            return True
+        remaining = renewed_at + self.get_expiry_age() - time.time()
+        return remaining < getattr(settings, 'SESSION_RENEWAL_THRESHOLD', 0)
@@ -0,0 +1,7 @@
+from django.contrib.sessions.backends import cached_db
+
+from . import LazyRenewalMixin
+
+
+class SessionStore(LazyRenewalMixin, cached_db.SessionStore):
+    """Сессии в кеше с записью в базу и ленивым продлением"""
@@ -0,0 +1,7 @@
+from django.contrib.sessions.backends import db
+
+from . import LazyRenewalMixin
+
+
+class SessionStore(LazyRenewalMixin, db.SessionStore):
+    """Сессии в базе с ленивым продлением"""
@@ -0,0 +1,235 @@
+import contextvars
+import heapq
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import chain, islice
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.db.models import Count, prefetch_related_objects
+
+
+# Модели, строки которых живут на шарде своего теннисного центра.
+# Справочник центров остается в default и копируется на все шарды,
+# чтобы соединения с ним выполнялись внутри шарда
+SHARDED_MODELS = {
+    'tennis.tenniscourt',
+    'tennis.booking',
+    'tennis.courtblock',
+    'tennis.courtblock_courts',
+    'tennis.courtoccupancy',
+}
+
+# На шарде shard_N первичные ключи начинаются с (N + 1) * SHARD_ID_SPAN,
+# поэтому по id корта или бронирования сразу известен его шард
+SHARD_ID_SPAN = 10 ** 12
+
+# Шард, на который идут запросы без подсказки-экземпляра
+_current_shard = contextvars.ContextVar('current_shard', default=None)
+
+# {id центра: шард}; размещение центра не меняется, поэтому кэшируется на весь процесс
+_placements = {}
+
+
+def shard_aliases():
+    return sorted(getattr(settings, 'DATABASE_SHARDS', []), key=shard_index)
+
+
+def shard_index(alias):
+    return int(alias.rsplit('_', 1)[1])
+
+
+def enabled():
+    return bool(shard_aliases())
+
+
+def is_sharded(model):
+    return model._meta.label_lower in SHARDED_MODELS and enabled()
+
+
+def sharded_models():
+    return [
+        model for model in apps.get_models(include_auto_created=True)
+        if model._meta.label_lower in SHARDED_MODELS
+    ]
+
+
+def choose_shard():
+    """Шард для нового центра: тот, на котором меньше всего центров"""
+    aliases = shard_aliases()
+    if not aliases:
+        return ''
+    TennisCenter = apps.get_model('tennis', 'TennisCenter')
+    counts = dict(
+        TennisCenter._base_manager.using('default').filter(shard__in=aliases)
+        .order_by().values('shard').annotate(count=Count('id')).values_list('shard', 'count')
+    )
+    return min(aliases, key=lambda alias: counts.get(alias, 0))
+
+
+def remember_placement(center_id, alias):
+    if alias:
+        _placements[center_id] = alias
+
+
+def shard_for_center(center_id):
+    """Шард теннисного центра: явная карта TENNIS_SHARD_MAP или поле TennisCenter.shard.
+
+    Новые шарды не сдвигают существующие центры: размещение записывается при
+    создании центра. None - центра нет; центр без размещения - ошибка
+    настройки (выполните prepare_shards).
+    """
+    if not shard_aliases() or center_id is None:
+        return None
+    center_id = int(center_id)
+    if center_id in settings.TENNIS_SHARD_MAP:
+        return settings.TENNIS_SHARD_MAP[center_id]
+    if center_id not in _placements:
+        TennisCenter = apps.get_model('tennis', 'TennisCenter')
+        alias = TennisCenter._base_manager.using('default').filter(pk=center_id).values_list('shard', flat=True).first()
+        if alias is None:
+            return None
+        if not alias:
+            raise ImproperlyConfigured(f'Теннисный центр {center_id} не размещен на шарде: выполните prepare_shards')
+        _placements[center_id] = alias
+    return _placements[center_id]
+
+
+def shard_for_pk(pk):
+    """Шард строки по ее id; None для строк, созданных до шардирования"""
+    try:
+        alias = f'shard_{int(pk) // SHARD_ID_SPAN - 1}'
+    except (TypeError, ValueError):
+        return None
+    return alias if alias in shard_aliases() else None
+
+
+def current_shard():
+    return _current_shard.get()
+
+
+def current_db():
+    return _current_shard.get() or 'default'
+
+
+@contextmanager
+def use_shard(alias):
+    """Направляет запросы к шардированным моделям на alias внутри блока"""
+    token = _current_shard.set(alias)
+    try:
+        yield alias
+    finally:
+        _current_shard.reset(token)
+
+
+def for_center(center_id):
+    return use_shard(shard_for_center(center_id))
+
+
+def activate(alias):
+    """Шард до конца текущего запроса; сбрасывается в request_routing"""
+    _current_shard.set(alias)
+    return alias
+
+
+def activate_for_center(center_id):
+    return activate(shard_for_center(center_id))
+
+
+def each_shard():
+    """Обход всех шардов с маршрутизацией на каждый; без шардов - один проход по default"""
+    for alias in shard_aliases() or [None]:
+        with use_shard(alias):
+            yield alias
+
+
+def atomic(**kwargs):
+    """transaction.atomic на базе текущего шарда"""
+    return transaction.atomic(using=current_db(), **kwargs)
+
+
+def shard_querysets(queryset):
+    """Копии запроса по шардам, если шард не выбран; база каждой фиксируется сразу.
+
+    Внутри use_shard()/activate() и для нешардированных моделей - один
+    запрос к базе, которую выбирает маршрутизатор.
+    """
+    aliases = shard_aliases()
+    if aliases and is_sharded(queryset.model) and current_shard() is None:
+        return [queryset.using(alias) for alias in aliases]
+    return [queryset.using(queryset.db)]
+
+
+def scatter_gather(queryset, key=None, reverse=False, limit=None):
+    """Выполнение запроса на всех шардах и слияние результатов.
+
+    Каждый шард отдает строки в порядке queryset, поэтому при заданном key
+    списки сливаются heapq.merge без общей сортировки; limit применяется
+    после слияния.
+    """
+    parts = [list(part) for part in shard_querysets(queryset)]
+    rows = heapq.merge(*parts, key=key, reverse=reverse) if key else chain.from_iterable(parts)
+    return list(islice(rows, limit))
+
+
+def group_by_shard(ids):
+    """{шард: [id]} по диапазонам первичных ключей"""
+    groups = defaultdict(list)
+    for pk in ids:
+        groups[shard_for_pk(pk) or 'default'].append(pk)
+    return groups
+
+
+def prefetch_by_shard(centers, *lookups):
+    """prefetch_related для центров, сгруппированных по шардам"""
+    centers = list(centers)
+    groups = defaultdict(list)
+    for center in centers:
+        groups[shard_for_center(center.pk)].append(center)
+    for group in groups.values():
+        prefetch_related_objects(group, *lookups)
+    return centers
+
+
+def replicate(instance):
+    """Копия строки справочника (теннисного центра) на все шарды"""
+    model = type(instance)
+    values = {
+        field.attname: getattr(instance, field.attname)
+        for field in model._meta.concrete_fields if not field.primary_key
+    }
+    for alias in shard_aliases():
+        model._base_manager.using(alias).update_or_create(pk=instance.pk, defaults=values)
+
+
+def unreplicate(instance):
+    """Удаление копий строки справочника вместе с зависимыми строками шардов"""
+    for alias in shard_aliases():
+        type(instance)._base_manager.using(alias).filter(pk=instance.pk).delete()
+
+
+def prepare_shard(alias):
+    """Сдвиг счетчиков id шардированных таблиц в диапазон шарда"""
+    start = (shard_index(alias) + 1) * SHARD_ID_SPAN
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        for model in sharded_models():
+            table = model._meta.db_table
+            if connection.vendor == 'sqlite':
+                cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, start - 1])
+                elif row[0] < start - 1:
+                    cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [start - 1, table])
+            elif connection.vendor == 'postgresql':
+                quoted = connection.ops.quote_name(table)
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                    f"GREATEST(%s, (SELECT COALESCE(MAX(id), 0) FROM {quoted})))",
+                    [table, start - 1],
+                )
+            else:
+                raise NotImplementedError(f'Шардирование не поддерживает базу {connection.vendor}')
@@ -0,0 +1,28 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from . import sharding
+from .models import Booking, CourtBlock
+from .occupancy import refresh_bookings
+
+
+@receiver(pre_delete, sender=User)
+def delete_user_bookings(sender, instance, **kwargs):
+    """Каскад удаления пользователя по всем базам с бронированиями.
+
+    Пользователи живут в default, а CASCADE у Booking.user и SET_NULL у
+    CourtBlock.created_by Django выполняет только в базе пользователя и
+    не пересчитывает занятость. Поэтому строки удаляются здесь на каждом
+    шарде и в default (там же бронирования без шардов), а маски
+    затронутых кортов и дней пересчитываются.
+    """
+    for alias in sharding.shard_aliases() + ['default']:
+        with sharding.use_shard(alias), sharding.atomic():
+            # Строки блокировок кортов не удаляются вместе с сотрудником
+            bookings = Booking.objects.filter(user_id=instance.pk).exclude(status='blocked')
+            released = list(bookings.only('id', 'tennis_center_id', 'court_id', 'date'))
+            if released:
+                bookings.delete()
+                refresh_bookings(released)
+            CourtBlock.objects.filter(created_by_id=instance.pk).update(created_by=None)
@@ -0,0 +1,109 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+CACHE_PREFIX = 'singleflight'
+POLL_INTERVAL = 0.05
+
+_MISSING = object()
+
+
+class _Call:
+    """Выполняющийся в этом процессе расчет, которого ждут остальные потоки"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.failed = False
+
+
+_calls = {}
+_calls_lock = threading.Lock()
+
+
+def _generation(key):
+    return cache.get(f'{CACHE_PREFIX}:gen:{key}', 0)
+
+
+def coalesce(key, compute, ttl, scope=None):
+    """Один расчет compute() на ключ, одновременные вызовы ждут его результат.
+
+    Внутри процесса потоки ждут первого вызвавшего. Между воркерами
+    расчет выполняет тот, кто взял блокировку в кеше, остальные ждут
+    результат в кеше. Результат хранится ttl секунд. Если ждать пришлось
+    дольше SINGLEFLIGHT_WAIT_SECONDS или расчет упал, вызывающий считает сам.
+    scope - ключ для forget(), общий для нескольких результатов (по
+    умолчанию сам key).
+    """
+    generation = _generation(scope or key)
+    result_key = f'{CACHE_PREFIX}:result:{key}:{generation}'
+    value = cache.get(result_key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    wait = getattr(settings, 'SINGLEFLIGHT_WAIT_SECONDS', 3)
+    local_key = (key, generation)
+    with _calls_lock:
+        call = _calls.get(local_key)
+        leader = call is None
+        if leader:
+            call = _calls[local_key] = _Call()
+
+    if not leader:
+        if call.event.wait(wait) and not call.failed:
+            return call.result
+        return compute()
+
+    try:
+        call.result = _compute_once(key, generation, result_key, compute, ttl, wait)
+    except BaseException:
+        call.failed = True
+        raise
+    finally:
+        with _calls_lock:
+            _calls.pop(local_key, None)
+        call.event.set()
+    return call.result
+
+
+def _compute_once(key, generation, result_key, compute, ttl, wait):
+    """Расчет под блокировкой в кеше, общей для всех воркеров"""
+    lock_key = f'{CACHE_PREFIX}:lock:{key}:{generation}'
+    token = uuid.uuid4().hex
+    if cache.add(lock_key, token, timeout=wait):
+        try:
+            value = compute()
+            cache.set(result_key, value, timeout=ttl)
+            return value
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    # Считает другой воркер: ждем его результат, пока жива блокировка
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        value = cache.get(result_key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if cache.get(lock_key) is None:
+            break
+    return compute()
+
+
+def forget(key):
+    """Сброс результата по ключу (или всех результатов с этим scope).
+
+    Меняется поколение ключа, поэтому результат расчета, начатого до
+    сброса, новым вызовам уже не достанется.
+    """
+    gen_key = f'{CACHE_PREFIX}:gen:{key}'
+    if not cache.add(gen_key, 1, timeout=None):
+        try:
+            cache.incr(gen_key)
+        except ValueError:
+            cache.set(gen_key, 1, timeout=None)
@@ -1,3 +1,1349 @@
-from django.test import TestCase
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+import time as clock
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from operator import attrgetter
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import analytics, ical, sharding, urls as tennis_urls, waitingroom
+from .admin import BookingAdmin
+from .availability import day_availability, find_free_runs, find_free_slots, overlap_q, window_mask
+from .blocks import BlockConflict, apply_block, find_conflicts
+from .events import availability_channel, get_broker, publish_availability_change
+from .forms import BookingStep2Form
+from .log import QueueFileHandler, RequestIdFilter
+from .management.commands.audit_overlaps import Command as AuditOverlapsCommand
+from .management.commands.send_booking_reminders import Command as ReminderCommand
+from .middleware import RequestIdMiddleware
+from .occupancy import refresh_bookings
+from .ratelimit import get_client_ip
+from .reconciliation import BOOKING_REF_RE, StatementRow, read_statement, reconcile
+from .search import search_bookings
+from .timetable import build_timetable
+from .singleflight import coalesce
+from .models import TennisCenter, TennisCourt, CourtBlock, CourtOccupancy, Booking, BookingSession
+
+
+# Допустимое количество SQL-запросов на один запрос к странице.
+# Количество не должно зависеть от объема данных (признак N+1).
+QUERY_BUDGETS = {
+    'home': 4,
+    'register': 0,
+    'login': 0,
+    'logout': 4,
+    'profile': 4,
+    'regenerate_calendar_token': 3,
+    'booking_step1': 4,
+    'booking_step2': 8,
+    'booking_step2_post': 6,
+    'booking_step3': 3,
+    'booking_step4': 6,
+    'booking_step4_post': 14,
+    'booking_success': 3,
+    'waiting_room_status': 1,
+    'cancel_booking': 8,
+    'user_calendar': 4,
+    'court_calendar': 4,
+    'get_courts_ajax': 2,
+    'get_free_slots_ajax': 4,
+    'availability_stream': 1,
+    'ratelimit_stats': 2,
+    'booking_lookup': 4,
+}
+
+ADMIN_QUERY_BUDGETS = {
+    'tenniscenter': 7,
+    'tenniscourt': 6,
+    'booking': 6,
+    'bookingsession': 5,
+    'courtblock': 6,
+    'booking_timetable': 5,
+}
+
+
+@override_settings(RATELIMIT_ENABLED=False, PROFILER_SAMPLE_RATE=0)
+class QueryBudgetTests(TestCase):
+    """Бюджет SQL-запросов для каждого URL приложения и списков админки"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('player', 'player@example.com', 'secret-pass-123')
+        self.staff = User.objects.create_superuser('staff', 'staff@example.com', 'secret-pass-123')
+        self.booking_date = date.today() + timedelta(days=3)
+        self.seed(centers=1, courts_per_center=2, bookings_per_user=2)
+        self.center = TennisCenter.objects.order_by('id').first()
+        self.client.force_login(self.user)
+
+    def seed(self, centers, courts_per_center, bookings_per_user):
+        """Добавление центров, кортов, бронирований и сессий"""
+        offset = TennisCenter.objects.count()
+        for index in range(offset, offset + centers):
+            center = TennisCenter.objects.create(
+                name=f'Центр {index}', address='Алматы', phone_number='+77000000000',
+                email='center@example.com', number_of_courts=courts_per_center,
+                opening_time=time(8), closing_time=time(22),
+            )
+            courts = [
+                TennisCourt.objects.create(
+                    tennis_center=center, court_number=number + 1,
+                    price_per_hour=Decimal('5000'), surface_type='hard',
+                )
+                for number in range(courts_per_center)
+            ]
+            for number in range(bookings_per_user):
+                court = courts[number % len(courts)]
+                for user in (self.user, self.staff):
+                    Booking.objects.create(
+                        tennis_center=center, court=court, user=user,
+                        date=self.booking_date + timedelta(days=1 + number // 10),
+                        start_time=time(8 + number % 10), duration_hours=1,
+                        full_name=user.username, phone='+77000000000', email=user.email,
+                    )
+            BookingSession.objects.create(session_key=f'seed-{index}', user=self.staff, tennis_center_id=center.id)
+            CourtBlock.objects.create(
+                tennis_center=center, date_from=self.booking_date, date_to=self.booking_date,
+                start_time=time(6), end_time=time(7), reason='maintenance', created_by=self.staff,
+            )
+
+    def grow(self):
+        self.seed(centers=4, courts_per_center=6, bookings_per_user=20)
+
+    def count_queries(self, request):
+        with CaptureQueriesContext(connection) as queries:
+            response = request()
+        self.assertLess(response.status_code, 400, response)
+        return len(queries)
+
+    def assertQueryBudget(self, name, request, prepare=None, budgets=QUERY_BUDGETS):
+        """Проверка бюджета и неизменности числа запросов при росте данных"""
+        if prepare:
+            prepare()
+        request()  # Прогрев: создание сессии, кеши ContentType и т.п.
+
+        if prepare:
+            prepare()
+        small = self.count_queries(request)
+        self.grow()
+        if prepare:
+            prepare()
+        large = self.count_queries(request)
+
+        self.assertLessEqual(small, budgets[name], f'{name}: {small} запросов при бюджете {budgets[name]}')
+        self.assertEqual(small, large, f'{name}: число запросов растет с данными ({small} -> {large})')
+
+    def start_wizard(self, court=None):
+        self.client.post(reverse('booking_step1'), {'tennis_center': self.center.id})
+        self.client.post(reverse('booking_step2'), {
+            'date': self.booking_date.isoformat(),
+            'start_time': '20:00',
+            'duration_hours': 1,
+            'court': court.id if court else '',
+        })
+        self.client.post(reverse('booking_step3'), {'racket_rental': 0})
+
+    def create_own_booking(self):
+        court = self.center.courts.first()
+        return Booking.objects.create(
+            tennis_center=self.center, court=court, user=self.user,
+            date=self.booking_date, start_time=time(21), duration_hours=1,
+            full_name='player', phone='+77000000000', email='player@example.com',
+        )
+
+    def test_every_url_has_budget(self):
+        names = {pattern.name for pattern in tennis_urls.urlpatterns}
+        self.assertEqual(names - set(QUERY_BUDGETS), set())
+
+    def test_home(self):
+        self.assertQueryBudget('home', lambda: self.client.get(reverse('home')))
+
+    def test_register(self):
+        self.client.logout()
+        self.assertQueryBudget('register', lambda: self.client.get(reverse('register')))
+
+    def test_login(self):
+        self.client.logout()
+        self.assertQueryBudget('login', lambda: self.client.get(reverse('login')))
+
+    def test_logout(self):
+        self.assertQueryBudget(
+            'logout', lambda: self.client.post(reverse('logout')),
+            prepare=lambda: self.client.force_login(self.user),
+        )
+
+    def test_profile(self):
+        self.assertQueryBudget('profile', lambda: self.client.get(reverse('profile')))
+
+    def test_booking_step1(self):
+        self.assertQueryBudget('booking_step1', lambda: self.client.get(reverse('booking_step1')))
+
+    def test_booking_step2(self):
+        self.client.post(reverse('booking_step1'), {'tennis_center': self.center.id})
+        self.assertQueryBudget('booking_step2', lambda: self.client.get(reverse('booking_step2')))
+
+    def test_booking_step2_post(self):
+        self.client.post(reverse('booking_step1'), {'tennis_center': self.center.id})
+        self.assertQueryBudget('booking_step2_post', lambda: self.client.post(reverse('booking_step2'), {
+            'date': self.booking_date.isoformat(),
+            'start_time': '20:00',
+            'duration_hours': 1,
+            'court': '',
+        }))
+
+    def test_booking_step3(self):
+        self.start_wizard()
+        self.assertQueryBudget('booking_step3', lambda: self.client.get(reverse('booking_step3')))
+
+    def test_booking_step4(self):
+        self.start_wizard()
+        self.assertQueryBudget('booking_step4', lambda: self.client.get(reverse('booking_step4')))
+
+    def test_booking_step4_post(self):
+        def prepare():
+            Booking.objects.filter(user=self.user, start_time=time(20)).delete()
+            self.start_wizard(court=self.center.courts.order_by('id').first())
+
+        self.assertQueryBudget('booking_step4_post', lambda: self.client.post(reverse('booking_step4'), {
+            'full_name': 'Игрок', 'phone': '+7 777 123-45-67', 'email': 'player@example.com',
+        }), prepare=prepare)
+
+    def test_booking_success(self):
+        booking = self.create_own_booking()
+        self.assertQueryBudget(
+            'booking_success', lambda: self.client.get(reverse('booking_success', args=[booking.id]))
+        )
+
+    def test_waiting_room_status(self):
+        # Выдача билета; сам опрос только читает сессию (продление в LazySessionRenewalMiddleware)
+        self.client.get(reverse('booking_step1'))
+        self.assertQueryBudget('waiting_room_status', lambda: self.client.get(reverse('waiting_room_status')))
+
+    def test_cancel_booking(self):
+        state = {}
+
+        def prepare():
+            state['booking'] = self.create_own_booking()
+
+        self.assertQueryBudget(
+            'cancel_booking',
+            lambda: self.client.get(reverse('cancel_booking', args=[state['booking'].id])),
+            prepare=prepare,
+        )
+
+    def get_calendar(self, url):
+        response = self.client.get(url)
+        b''.join(response.streaming_content)
+        return response
+
+    def test_regenerate_calendar_token(self):
+        self.assertQueryBudget(
+            'regenerate_calendar_token',
+            lambda: self.client.post(reverse('regenerate_calendar_token')),
+        )
+
+    def test_user_calendar(self):
+        url = reverse('user_calendar', args=[ical.user_token(self.user)])
+        self.assertQueryBudget('user_calendar', lambda: self.get_calendar(url))
+
+    def test_court_calendar(self):
+        url = reverse('court_calendar', args=[self.center.courts.first().id])
+        self.assertQueryBudget('court_calendar', lambda: self.get_calendar(url))
+
+    def test_get_courts_ajax(self):
+        self.assertQueryBudget(
+            'get_courts_ajax', lambda: self.client.get(reverse('get_courts_ajax'), {'center_id': self.center.id})
+        )
+
+    def test_get_free_slots_ajax(self):
+        self.assertQueryBudget('get_free_slots_ajax', lambda: self.client.get(reverse('get_free_slots_ajax'), {
+            'center_id': self.center.id, 'date': self.booking_date.isoformat(), 'duration': 1,
+        }))
+
+    def test_availability_stream(self):
+        # Под WSGI поток не открывается, запрос только читает сессию
+        self.assertQueryBudget('availability_stream', lambda: self.client.get(reverse('availability_stream'), {
+            'center_id': self.center.id, 'date': self.booking_date.isoformat(),
+        }))
+
+    def test_ratelimit_stats(self):
+        self.client.force_login(self.staff)
+        self.assertQueryBudget('ratelimit_stats', lambda: self.client.get(reverse('ratelimit_stats')))
+
+    def test_booking_lookup(self):
+        self.client.force_login(self.staff)
+        self.assertQueryBudget('booking_lookup', lambda: self.client.get(reverse('booking_lookup'), {'q': 'player'}))
+
+    def assertChangelistBudget(self, model_name):
+        self.client.force_login(self.staff)
+        url = reverse(f'admin:tennis_{model_name}_changelist')
+        self.assertQueryBudget(model_name, lambda: self.client.get(url), budgets=ADMIN_QUERY_BUDGETS)
+
+    def test_admin_tenniscenter_changelist(self):
+        self.assertChangelistBudget('tenniscenter')
+
+    def test_admin_tenniscourt_changelist(self):
+        self.assertChangelistBudget('tenniscourt')
+
+    def test_admin_booking_changelist(self):
+        self.assertChangelistBudget('booking')
+
+    def test_admin_bookingsession_changelist(self):
+        self.assertChangelistBudget('bookingsession')
+
+    def test_admin_courtblock_changelist(self):
+        self.assertChangelistBudget('courtblock')
+
+    def test_admin_booking_timetable(self):
+        self.client.force_login(self.staff)
+        url = reverse('admin:tennis_booking_timetable')
+        self.assertQueryBudget(
+            'booking_timetable',
+            lambda: self.client.get(url, {'center': self.center.id, 'date': self.booking_date.isoformat()}),
+            budgets=ADMIN_QUERY_BUDGETS,
+        )
+
+
+@override_settings(RATELIMITS={'ajax': {'ip': '2/m'}}, RATELIMIT_ENABLED=True)
+class RateLimitClientIpTests(TestCase):
+    """Адрес клиента для лимитов по IP и подделка X-Forwarded-For"""
+
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+
+    def request(self, forwarded):
+        return self.factory.get('/', HTTP_X_FORWARDED_FOR=forwarded, REMOTE_ADDR='10.0.0.1')
+
+    def test_header_ignored_without_trusted_proxies(self):
+        self.assertEqual(get_client_ip(self.request('1.2.3.4')), '10.0.0.1')
+
+    @override_settings(RATELIMIT_PROXY_HOPS=1)
+    def test_proxied_address_taken_from_the_right(self):
+        self.assertEqual(get_client_ip(self.request('1.2.3.4, 203.0.113.7')), '203.0.113.7')
+        self.assertEqual(get_client_ip(self.request('203.0.113.7')), '203.0.113.7')
+
+    @override_settings(RATELIMIT_PROXY_HOPS=2)
+    def test_missing_hops_fall_back_to_remote_addr(self):
+        self.assertEqual(get_client_ip(self.request('203.0.113.7')), '10.0.0.1')
+
+    @override_settings(RATELIMIT_PROXY_HOPS=1)
+    def test_spoofed_header_does_not_reset_budget(self):
+        url = reverse('get_courts_ajax')
+        statuses = [
+            self.client.get(url, HTTP_X_FORWARDED_FOR=f'198.51.100.{n}, 203.0.113.7').status_code
+            for n in range(3)
+        ]
+        self.assertEqual(statuses, [200, 200, 429])
+
+
+class FailingForSomeEmailBackend(LocmemEmailBackend):
+    """Почтовый бэкенд, который не может доставить письма на fail@example.com"""
+
+    def send_messages(self, messages):
+        if any('fail@example.com' in message.to for message in messages):
+            raise ConnectionError('SMTP недоступен')
+        return super().send_messages(messages)
+
+
+class BookingRemindersTests(TestCase):
+    """Напоминания не уходят дважды и не теряются при ошибке отправки"""
+
+    def setUp(self):
+        user = User.objects.create_user('player', 'player@example.com', 'secret-pass-123')
+        center = TennisCenter.objects.create(
+            name='Центр', address='Алматы', phone_number='+77000000000', email='center@example.com',
+            number_of_courts=1, opening_time=time(0), closing_time=time(23, 59),
+        )
+        court = TennisCourt.objects.create(tennis_center=center, court_number=1, price_per_hour=Decimal('5000'))
+        starts_at = timezone.localtime() + timedelta(hours=3)
+        self.bookings = [
+            Booking.objects.create(
+                tennis_center=center, court=court, user=user, date=starts_at.date(),
+                start_time=starts_at.time().replace(microsecond=0), duration_hours=1,
+                full_name='Игрок', phone='+77000000000', email=email,
+            )
+            for email in ('player@example.com', 'fail@example.com')
+        ]
+
+    def run_command(self):
+        call_command('send_booking_reminders', hours=24, stdout=StringIO(), stderr=StringIO())
+
+    def test_second_run_sends_nothing(self):
+        Booking.objects.filter(email='fail@example.com').delete()
+        self.run_command()
+        self.run_command()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIsNotNone(Booking.objects.get().reminder_sent_at)
+
+    def test_rows_claimed_by_parallel_run_are_skipped(self):
+        # Параллельный запуск пометил строки после того, как мы выбрали кандидатов
+        candidates = list(Booking.objects.all())
+        Booking.objects.filter(email='fail@example.com').update(reminder_sent_at=timezone.now())
+        claimed = ReminderCommand.claim(candidates, timezone.now())
+        self.assertEqual([booking.email for booking in claimed], ['player@example.com'])
+
+    @override_settings(EMAIL_BACKEND='tennis.tests.FailingForSomeEmailBackend')
+    def test_failed_message_is_released_and_sent_ones_stay_marked(self):
+        self.run_command()
+        self.assertEqual([message.to for message in mail.outbox], [['player@example.com']])
+        sent, failed = [Booking.objects.get(pk=booking.pk) for booking in self.bookings]
+        self.assertIsNotNone(sent.reminder_sent_at)
+        self.assertIsNone(failed.reminder_sent_at)
+
+
+def create_center(courts=1, opening=time(8), closing=time(22)):
+    """Центр с courts кортами"""
+    center = TennisCenter.objects.create(
+        name='Центр', address='Алматы', phone_number='+77000000000', email='center@example.com',
+        number_of_courts=courts, opening_time=opening, closing_time=closing,
+    )
+    for number in range(courts):
+        TennisCourt.objects.create(
+            tennis_center=center, court_number=number + 1, price_per_hour=Decimal('5000'), surface_type='hard',
+        )
+    return center
+
+
+@override_settings(RATELIMIT_ENABLED=False, DATABASE_REPLICAS=['replica_test'])
+class ReplicaRoutingTests(TestCase):
+    """Чтение с отдельной SQLite-реплики, которая не видит свежих записей основной базы"""
+    databases = {'default', 'replica_test'}
+
+    def setUp(self):
+        self.center = create_center(courts=2)
+        self.client.force_login(User.objects.create_user('player', 'player@example.com', 'secret-pass-123'))
+
+    def get_courts(self):
+        response = self.client.get(reverse('get_courts_ajax'), {'center_id': self.center.id})
+        return response.json()['courts']
+
+    def test_replica_view_reads_replica_until_client_writes(self):
+        self.assertEqual(self.get_courts(), [])
+        self.client.post(reverse('booking_step1'), {'tennis_center': self.center.id})
+        self.assertIn('primary_pin', self.client.cookies)
+        self.assertEqual(len(self.get_courts()), 2)
+
+    def test_reads_outside_replica_block_use_primary(self):
+        self.assertTrue(TennisCourt.objects.filter(tennis_center=self.center).exists())
+
+
+@override_settings(RATELIMIT_ENABLED=False, WAITING_ROOM_ENABLED=False)
+class BookingFinalCheckTests(TestCase):
+    """Шаг 4 перепроверяет корт: бронь, подтвержденная позже, не создает пересечения"""
+
+    def setUp(self):
+        self.center = create_center(courts=2)
+        self.court = self.center.courts.order_by('court_number').first()
+        self.booking_date = date.today() + timedelta(days=3)
+
+    def wizard(self, username, court=None):
+        client = self.client_class()
+        client.force_login(User.objects.create_user(username, f'{username}@example.com', 'secret-pass-123'))
+        client.post(reverse('booking_step1'), {'tennis_center': self.center.id})
+        client.post(reverse('booking_step2'), {
+            'date': self.booking_date.isoformat(), 'start_time': '20:00',
+            'duration_hours': 1, 'court': court.id if court else '',
+        })
+        client.post(reverse('booking_step3'), {'racket_rental': 0})
+        return client
+
+    def confirm(self, client):
+        return client.post(reverse('booking_step4'), {
+            'full_name': 'Игрок', 'phone': '+7 777 123-45-67', 'email': 'player@example.com',
+        })
+
+    def test_second_confirmation_of_same_court_is_rejected(self):
+        first, second = self.wizard('first', self.court), self.wizard('second', self.court)
+        self.assertEqual(self.confirm(first).status_code, 302)
+        self.assertRedirects(self.confirm(second), reverse('booking_step2'), fetch_redirect_response=False)
+        self.assertEqual(Booking.objects.filter(court=self.court).count(), 1)
+
+    def test_any_court_request_takes_remaining_court(self):
+        first, second = self.wizard('first'), self.wizard('second')
+        self.confirm(first)
+        self.confirm(second)
+        self.assertEqual(
+            sorted(Booking.objects.values_list('court__court_number', flat=True)), [1, 2]
+        )
+
+
+class AvailabilitySnapshotTests(TestCase):
+    """Общий снимок занятости дня: один расчет на всех, сброс после записи"""
+
+    def setUp(self):
+        cache.clear()
+        self.center = create_center(courts=1)
+        self.court = self.center.courts.get()
+        self.booking_date = date.today() + timedelta(days=3)
+
+    def book(self):
+        booking = Booking.objects.create(
+            tennis_center=self.center, court=self.court, user=User.objects.create_user('player'),
+            date=self.booking_date, start_time=time(10), duration_hours=1,
+            full_name='Игрок', phone='+77000000000', email='player@example.com',
+        )
+        refresh_bookings([booking])
+        return booking
+
+    def test_concurrent_calls_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            clock.sleep(0.2)
+            return 'snapshot'
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(coalesce('test-day', compute, ttl=5)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['snapshot'] * 5)
+
+    def test_suggestions_follow_occupancy_masks(self):
+        self.book()
+        with self.assertNumQueries(2):
+            slots = find_free_slots(self.center, self.booking_date, 2, limit=24, days=1)
+        starts = [slot.start_time.hour for slot in slots]
+        # Бронь 10:00-11:00 закрывает двухчасовые начала в 9 и 10
+        self.assertEqual(starts, [8] + list(range(11, 21)))
+
+    def test_fully_booked_range_is_read_in_two_queries(self):
+        # Десять дней подряд корт занят все часы работы, на одиннадцатый свободен
+        CourtOccupancy.objects.bulk_create([
+            CourtOccupancy(tennis_center=self.center, court=self.court, date=self.booking_date + timedelta(days=offset),
+                           mask=window_mask(self.center))
+            for offset in range(10)
+        ])
+        free_day = self.booking_date + timedelta(days=10)
+
+        with self.assertNumQueries(2):
+            slots = find_free_slots(self.center, self.booking_date, 2, limit=1)
+        self.assertEqual(slots, [(free_day, time(8), self.court)])
+
+        with self.assertNumQueries(2):
+            runs = find_free_runs(self.booking_date, free_day, 2, tennis_center=self.center)
+        self.assertEqual([(day, court) for day, court, starts in runs], [(free_day, self.court)])
+        self.assertEqual(runs[0][2], list(range(8, 21)))
+
+    def test_admin_delete_invalidates_snapshot(self):
+        booking = self.book()
+        self.assertIn(self.court.id, day_availability(self.center, self.booking_date)[1])
+
+        self.client.force_login(User.objects.create_superuser('staff', 'staff@example.com', 'secret-pass-123'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('admin:tennis_booking_delete', args=[booking.pk]), {'post': 'yes'})
+        self.assertEqual(day_availability(self.center, self.booking_date)[1], {})
+
+    def test_step2_check_reads_primary_not_snapshot(self):
+        self.assertEqual(day_availability(self.center, self.booking_date)[1], {})
+        self.book()
+        # Снимок еще не сброшен, но проверка формы видит новую бронь
+        self.assertEqual(day_availability(self.center, self.booking_date)[1], {})
+        form = BookingStep2Form({
+            'date': self.booking_date.isoformat(), 'start_time': '10:00',
+            'duration_hours': 1, 'court': self.court.id,
+        }, tennis_center=self.center)
+        self.assertFalse(form.is_valid())
+
+
+@override_settings(WAITING_ROOM_CAPACITY=2)
+class WaitingRoomTests(TestCase):
+    """Очередь пропускает билеты по порядку и не уходит вперед выданных"""
+
+    def setUp(self):
+        cache.clear()
+
+    def next_second(self):
+        cache.delete(f'{waitingroom.CACHE_PREFIX}:tick')
+
+    def test_idle_ticks_do_not_admit_future_tickets(self):
+        for _ in range(3):
+            self.next_second()
+            waitingroom._admitted_up_to()
+        tickets = [waitingroom.issue() for _ in range(4)]
+        self.next_second()
+        self.assertEqual([waitingroom.admit(ticket) for ticket in tickets], [True, True, False, False])
+        self.assertEqual([waitingroom.position(ticket) for ticket in tickets[2:]], [1, 2])
+
+    def test_freed_slot_goes_to_first_waiting_ticket(self):
+        first, second, third, fourth = [waitingroom.issue() for _ in range(4)]
+        self.assertTrue(waitingroom.admit(first))
+        self.assertTrue(waitingroom.admit(second))
+        self.assertFalse(waitingroom.admit(third))
+
+        cache.delete(waitingroom._slot_key(first.slot))
+        self.next_second()
+        self.assertFalse(waitingroom.admit(fourth))
+        self.assertEqual(waitingroom.position(third), 0)
+        self.assertTrue(waitingroom.admit(third))
+        self.assertEqual(waitingroom.position(fourth), 1)
+
+    def test_counter_expiring_between_add_and_incr_is_recreated(self):
+        key = f'{waitingroom.CACHE_PREFIX}:pending'
+        cache.set(key, 1, timeout=10)
+        real_incr = cache.incr
+
+        def expire_then_incr(*args, **kwargs):
+            # Ключ истекает сразу после неудачного add
+            cache.delete(key)
+            return real_incr(*args, **kwargs)
+
+        with patch.object(cache, 'incr', side_effect=expire_then_incr):
+            self.assertEqual(waitingroom._incr(key, 2, timeout=10), 2)
+        self.assertEqual(cache.get(key), 2)
+
+    def test_newcomer_to_idle_room_is_admitted_at_once(self):
+        first = waitingroom.issue()
+        self.assertTrue(waitingroom.admit(first))
+        cache.delete(waitingroom._slot_key(first.slot))
+        # Та же секунда: граница не сдвигалась, но ждущих нет
+        self.assertTrue(waitingroom.admit(waitingroom.issue()))
+
+
+class CourtBlockTests(TestCase):
+    """Блокировка кортов: пересечения под блокировкой и скрытие часов из свободных"""
+
+    def setUp(self):
+        cache.clear()
+        self.center = create_center(courts=1)
+        self.court = self.center.courts.get()
+        self.staff = User.objects.create_superuser('staff', 'staff@example.com', 'secret-pass-123')
+        self.block_date = date.today() + timedelta(days=3)
+
+    def book(self, hour):
+        return Booking.objects.create(
+            tennis_center=self.center, court=self.court, user=self.staff,
+            date=self.block_date, start_time=time(hour), duration_hours=1,
+            full_name='Игрок', phone='+77000000000', email='player@example.com',
+        )
+
+    def create_block(self):
+        return CourtBlock.objects.create(
+            tennis_center=self.center, date_from=self.block_date, date_to=self.block_date,
+            start_time=time(10), end_time=time(12), reason='maintenance', created_by=self.staff,
+        )
+
+    def test_booking_made_after_form_check_is_rejected(self):
+        block = self.create_block()
+        booking = self.book(11)
+        with self.assertRaises(BlockConflict) as raised:
+            apply_block(block, [self.court])
+        self.assertEqual(raised.exception.conflicts, [booking])
+        self.assertFalse(Booking.objects.filter(status='blocked').exists())
+
+    def test_admin_shows_conflict_found_under_lock(self):
+        self.book(11)
+        self.client.force_login(self.staff)
+        stale = [[]]  # Первая проверка формы еще не видит брони
+
+        with patch('tennis.admin.find_conflicts', side_effect=lambda *args: stale.pop() if stale else find_conflicts(*args)):
+            response = self.client.post(reverse('admin:tennis_courtblock_add'), {
+                'tennis_center': self.center.id, 'date_from': self.block_date.isoformat(),
+                'date_to': self.block_date.isoformat(), 'start_time': '10:00', 'end_time': '12:00',
+                'reason': 'maintenance', 'comment': '',
+            })
+        self.assertContains(response, 'Пересечения с активными бронированиями: 1')
+        self.assertFalse(CourtBlock.objects.exists())
+
+    def test_deleting_block_author_keeps_courts_blocked(self):
+        block = self.create_block()
+        apply_block(block, [self.court])
+        self.staff.delete()
+
+        self.assertTrue(Booking.objects.filter(block=block, status='blocked').exists())
+        block.refresh_from_db()
+        self.assertIsNone(block.created_by_id)
+        form = BookingStep2Form({
+            'date': self.block_date.isoformat(), 'start_time': '10:00', 'duration_hours': 1, 'court': self.court.id,
+        }, tennis_center=self.center)
+        self.assertFalse(form.is_valid())
+
+    def test_deleting_customer_frees_occupancy(self):
+        customer = User.objects.create_user('player')
+        booking = self.book(10)
+        booking.user = customer
+        booking.save()
+        refresh_bookings([booking])
+        self.assertTrue(CourtOccupancy.objects.filter(court=self.court, mask__gt=0).exists())
+
+        customer.delete()
+
+        self.assertFalse(Booking.objects.filter(pk=booking.pk).exists())
+        self.assertFalse(CourtOccupancy.objects.filter(court=self.court, mask__gt=0).exists())
+
+    def test_blocked_hours_are_hidden_from_availability(self):
+        apply_block(self.create_block(), [self.court])
+        starts = [slot.start_time for slot in find_free_slots(self.center, self.block_date, 1, limit=24, days=1)]
+        self.assertIn(time(9), starts)
+        self.assertNotIn(time(10), starts)
+        self.assertNotIn(time(11), starts)
+        self.assertIn(time(12), starts)
+
+        form = BookingStep2Form({
+            'date': self.block_date.isoformat(), 'start_time': '11:00', 'duration_hours': 1, 'court': '',
+        }, tennis_center=self.center)
+        self.assertFalse(form.is_valid())
+
+
+class BookingSearchTests(TestCase):
+    """Поиск бронирований по телефону, имени, email и логину"""
+
+    def setUp(self):
+        center = create_center(courts=1)
+        court = center.courts.get()
+        self.bookings = {}
+        for username, full_name, phone, email in [
+            ('aigerim', 'Айгерим Садыкова', '8 (701) 234-56-78', 'aigerim@example.com'),
+            ('daniyar_k', 'Данияр Калиев', '+7 702 555 11 22', 'dk@mail.kz'),
+        ]:
+            self.bookings[username] = Booking.objects.create(
+                tennis_center=center, court=court, user=User.objects.create_user(username),
+                date=date.today(), start_time=time(10), duration_hours=1,
+                full_name=full_name, phone=phone, email=email,
+            )
+
+    def found(self, term):
+        return set(search_bookings(Booking.objects.all(), term).values_list('user__username', flat=True))
+
+    def test_full_phone_in_any_format(self):
+        self.assertEqual(self.found('+7 701 234 56 78'), {'aigerim'})
+        self.assertEqual(self.found('702 555 11 22'), {'daniyar_k'})
+
+    def test_part_of_phone(self):
+        self.assertEqual(self.found('555-11'), {'daniyar_k'})
+
+    def test_part_of_name_and_email(self):
+        # На SQLite регистр не-ASCII букв различается, поэтому как в данных
+        self.assertEqual(self.found('Садык'), {'aigerim'})
+        self.assertEqual(self.found('mail.kz'), {'daniyar_k'})
+
+    def test_part_of_username(self):
+        self.assertEqual(self.found('NIYAR'), {'daniyar_k'})
+
+    def test_short_term_matches_exact_username_only(self):
+        self.assertEqual(self.found('ai'), set())
+
+
+class ReconciliationTests(TestCase):
+    """Сверка выписки: по номеру брони, по сумме и дате, неоднозначные строки"""
+
+    def setUp(self):
+        center = create_center(courts=1)
+        self.court = center.courts.get()
+        self.user = User.objects.create_user('player')
+        self.today = timezone.localdate()
+
+    def book(self, price, created_days_ago=0):
+        booking = Booking.objects.create(
+            tennis_center=self.court.tennis_center, court=self.court, user=self.user,
+            date=self.today + timedelta(days=3), start_time=time(10), duration_hours=1,
+            total_price=Decimal(price), full_name='Игрок', phone='+77000000000', email='player@example.com',
+        )
+        Booking.objects.filter(pk=booking.pk).update(created_at=timezone.now() - timedelta(days=created_days_ago))
+        return booking
+
+    def row(self, amount, reference='', line=2):
+        return StatementRow(line, self.today, Decimal(amount), reference)
+
+    def test_reference_pattern_needs_booking_keyword(self):
+        self.assertEqual(BOOKING_REF_RE.findall('Оплата брони 15, booking #16, бронирование №17'), ['15', '16', '17'])
+        self.assertEqual(BOOKING_REF_RE.findall('Счет №123, чек #456, заказ 789'), [])
+
+    def test_match_by_booking_id_among_equal_amounts(self):
+        self.book('5000.00')
+        booking = self.book('5000.00')
+        report = reconcile([self.row('5000.00', f'Оплата брони {booking.id}')])
+        self.assertEqual([matched.id for row, matched in report.matched], [booking.id])
+        booking.refresh_from_db()
+        self.assertEqual(booking.status, 'paid')
+
+    def test_match_by_amount_and_date(self):
+        booking = self.book('7000.00', created_days_ago=2)
+        self.book('5000.00')
+        report = reconcile([self.row('7000.00', 'Kaspi перевод')], apply=False)
+        self.assertEqual([matched.id for row, matched in report.matched], [booking.id])
+        self.assertEqual(report.updated, 0)
+
+    def test_same_amount_and_date_is_ambiguous(self):
+        first, second = self.book('5000.00'), self.book('5000.00')
+        report = reconcile([self.row('5000.00', 'Счет №1')])
+        self.assertEqual(report.matched, [])
+        self.assertCountEqual(report.ambiguous[0][1], [first.id, second.id])
+        self.assertFalse(Booking.objects.filter(status='paid').exists())
+
+    def test_rows_are_matched_across_chunks_without_reuse(self):
+        booking = self.book('5000.00')
+        rows, errors = read_statement(StringIO(
+            'date;amount;reference\n'
+            f'{self.today:%d.%m.%Y};5000,00;Бронь {booking.id}\n'
+            f'{self.today:%d.%m.%Y};5000,00;Бронь {booking.id}\n'
+        ))
+        report = reconcile(rows, errors, apply=False, chunk_size=1)
+        self.assertEqual(len(report.matched), 1)
+        self.assertEqual([row.line for row in report.unmatched], [3])
+
+
+class AvailabilityStreamTests(TestCase):
+    """SSE-поток получает изменения, опубликованные через LocalBroker"""
+
+    def setUp(self):
+        self.center = create_center(courts=1)
+        self.booking_date = date.today() + timedelta(days=3)
+
+    async def test_published_change_reaches_subscriber(self):
+        response = await self.async_client.get(
+            reverse('availability_stream'), {'center_id': self.center.id, 'date': self.booking_date.isoformat()}
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+
+        message = {'action': 'created', 'court_id': 1, 'date': self.booking_date.isoformat(),
+                   'start_time': '10:00', 'duration_hours': 1}
+        get_broker().publish(availability_channel(self.center.id, self.booking_date), message)
+        event = (await asyncio.wait_for(anext(stream), timeout=1)).decode()
+        self.assertTrue(event.startswith('event: availability\n'))
+        self.assertEqual(json.loads(event.split('data: ', 1)[1]), message)
+        await stream.aclose()
+
+    def test_wsgi_request_gets_no_content(self):
+        response = self.client.get(reverse('availability_stream'), {'center_id': self.center.id})
+        self.assertEqual(response.status_code, 204)
+
+
+class OverlapTests(TestCase):
+    """Пересечения броней: условие overlap_q и проход audit_overlaps"""
+
+    def setUp(self):
+        center = create_center(courts=1)
+        self.court = center.courts.get()
+        self.user = User.objects.create_user('player')
+        self.booking_date = date.today() + timedelta(days=3)
+
+    def book(self, hour, hours, minute=0, created_minutes_ago=0):
+        booking = Booking.objects.create(
+            tennis_center=self.court.tennis_center, court=self.court, user=self.user,
+            date=self.booking_date, start_time=time(hour, minute), duration_hours=hours,
+            full_name='Игрок', phone='+77000000000', email='player@example.com',
+        )
+        Booking.objects.filter(pk=booking.pk).update(created_at=timezone.now() - timedelta(minutes=created_minutes_ago))
+        return booking
+
+    def overlapping(self, hour, hours, minute=0):
+        return list(Booking.objects.filter(overlap_q(time(hour, minute), hours)).values_list('id', flat=True))
+
+    def test_interval_starting_inside_earlier_booking(self):
+        booking = self.book(10, 3)
+        self.assertEqual(self.overlapping(11, 1), [booking.id])
+        self.assertEqual(self.overlapping(12, 2), [booking.id])
+        self.assertEqual(self.overlapping(9, 2, minute=30), [booking.id])
+
+    def test_adjacent_intervals_do_not_overlap(self):
+        self.book(10, 2)
+        self.assertEqual(self.overlapping(12, 1), [])
+        self.assertEqual(self.overlapping(8, 2), [])
+
+    def test_sweep_keeps_earliest_created_booking(self):
+        later = self.book(10, 2, created_minutes_ago=5)
+        earliest = self.book(11, 1, created_minutes_ago=60)
+        rows = Booking.objects.order_by('court_id', 'date', 'start_time', 'id').values_list(
+            'id', 'court_id', 'date', 'start_time', 'duration_hours', 'created_at'
+        )
+        self.assertEqual(
+            [(kept[0], duplicate[0]) for kept, duplicate in AuditOverlapsCommand.sweep(rows)],
+            [(earliest.id, later.id)],
+        )
+
+    def test_cancel_leaves_earliest_booking_active(self):
+        earliest = self.book(10, 2, created_minutes_ago=60)
+        later = self.book(11, 1, created_minutes_ago=5)
+        call_command('audit_overlaps', cancel=True, report=os.devnull, stdout=StringIO())
+        self.assertEqual(Booking.objects.get(pk=earliest.pk).status, 'pending')
+        self.assertEqual(Booking.objects.get(pk=later.pk).status, 'cancelled')
+
+
+class AnalyticsTests(TestCase):
+    """Отчет по спросу: загрузка кортов и время до игры"""
+
+    def setUp(self):
+        self.center = create_center(courts=2)
+        self.court = self.center.courts.order_by('court_number').first()
+        self.user = User.objects.create_user('player')
+
+    def book(self, day, hour, hours=1, lead=timedelta(hours=24)):
+        booking = Booking.objects.create(
+            tennis_center=self.center, court=self.court, user=self.user,
+            date=day, start_time=time(hour), duration_hours=hours,
+            full_name='Игрок', phone='+77000000000', email='player@example.com',
+        )
+        starts_at = timezone.make_aware(datetime.combine(day, time(hour)))
+        Booking.objects.filter(pk=booking.pk).update(created_at=starts_at - lead)
+
+    def test_occupancy_heatmap_shares_of_court_hours(self):
+        monday = date(2026, 10, 12)
+        self.book(monday, 10, hours=2)
+        heatmap = analytics.occupancy_heatmap(
+            analytics.load_columns(monday, monday + timedelta(days=6)), monday, monday + timedelta(days=6)
+        )
+        self.assertEqual(heatmap.shape, (1, 7, 24))
+        self.assertAlmostEqual(heatmap[0, 0, 10], 0.5)
+        self.assertAlmostEqual(heatmap[0, 0, 11], 0.5)
+        self.assertEqual(heatmap[0, 0, 12], 0)
+        self.assertEqual(heatmap[0, 1:].sum(), 0)
+
+    def test_lead_time_uses_offset_of_each_booking_date(self):
+        # Asia/Almaty: UTC+6 до 1 марта 2024 года, затем UTC+5
+        self.book(date(2024, 2, 28), 10)
+        self.book(date(2024, 3, 2), 10)
+        columns = analytics.load_columns(date(2024, 2, 1), date(2024, 3, 31))
+        self.assertEqual(sorted(columns.lead_hours.tolist()), [24.0, 24.0])
+
+    def test_command_writes_heatmap_to_its_stdout(self):
+        monday = date(2026, 10, 12)
+        self.book(monday, 10, hours=2)
+        out = StringIO()
+        call_command('booking_analytics', '--from=2026-10-12', '--to=2026-10-18', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[-7], 'Центр,Пн,50,50')
+        self.assertEqual(lines[-8], 'center,weekday,10:00,11:00')
+
+
+class CalendarFeedTests(TestCase):
+    """Лента .ics: условный GET и отзыв ссылки"""
+
+    def setUp(self):
+        center = create_center(courts=1)
+        self.user = User.objects.create_user('player', 'player@example.com', 'secret-pass-123')
+        self.booking = Booking.objects.create(
+            tennis_center=center, court=center.courts.get(), user=self.user,
+            date=date.today() + timedelta(days=3), start_time=time(10), duration_hours=1,
+            full_name='Игрок', phone='+77000000000', email='player@example.com',
+        )
+        self.url = reverse('user_calendar', args=[ical.user_token(self.user)])
+
+    def test_unchanged_feed_returns_304(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'BEGIN:VEVENT', b''.join(response.streaming_content))
+
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_feed_gets_new_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        Booking.objects.filter(pk=self.booking.pk).update(status='cancelled', updated_at=timezone.now())
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_regenerated_token_revokes_old_link(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('regenerate_calendar_token'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        new_url = reverse('user_calendar', args=[ical.user_token(self.user)])
+        self.assertNotEqual(new_url, self.url)
+        self.assertEqual(self.client.get(new_url).status_code, 200)
+
+    def test_tokens_are_random_not_derived_from_id(self):
+        other = User.objects.create_user('other')
+        self.assertNotIn(str(self.user.pk), ical.user_token(self.user).split(':'))
+        self.assertIsNone(ical.user_id_from_token(f'{other.pk}'))
+
+
+class TimetableTests(TestCase):
+    """Расписание дня: корты x часы работы центра"""
+
+    def setUp(self):
+        self.center = create_center(courts=2)
+        self.first, self.second = self.center.courts.order_by('court_number')
+        self.day = date.today() + timedelta(days=3)
+
+    def book(self, court, hour, hours):
+        return Booking.objects.create(
+            tennis_center=self.center, court=court, user=User.objects.create_user(f'player{hour}'),
+            date=self.day, start_time=time(hour), duration_hours=hours,
+            full_name='Игрок', phone='+77000000000', email='player@example.com',
+        )
+
+    def test_overlapping_bookings_share_one_conflict_cell(self):
+        first, second = self.book(self.first, 10, 2), self.book(self.first, 11, 2)
+        hours, matrix = build_timetable(self.center, self.day)
+        self.assertEqual(hours, list(range(8, 22)))
+
+        court, cells = matrix[0]
+        self.assertEqual(court['id'], self.first.id)
+        busy = [cell for cell in cells if cell.bookings]
+        self.assertEqual(len(busy), 1)
+        self.assertEqual((busy[0].hour, busy[0].span), (10, 3))
+        self.assertTrue(busy[0].conflict)
+        self.assertEqual([booking['id'] for booking in busy[0].bookings], [first.id, second.id])
+        self.assertEqual(sum(cell.span for cell in cells), len(hours))
+
+    def test_court_without_bookings_gets_full_row(self):
+        self.book(self.first, 10, 1)
+        hours, matrix = build_timetable(self.center, self.day)
+        self.assertEqual([court['id'] for court, cells in matrix], [self.first.id, self.second.id])
+        court, cells = matrix[1]
+        self.assertEqual([cell.hour for cell in cells], hours)
+        self.assertFalse(any(cell.bookings for cell in cells))
+
+
+@override_settings(RATELIMIT_ENABLED=False, DATABASE_SHARDS=['shard_0', 'shard_1'])
+class ShardingTests(TestCase):
+    """Корты и бронирования на двух SQLite-шардах; центры и пользователи - в default"""
+    databases = {'default', 'shard_0', 'shard_1'}
+
+    def setUp(self):
+        for alias in sharding.shard_aliases():
+            sharding.prepare_shard(alias)
+        self.user = User.objects.create_user('player', 'player@example.com', 'secret-pass-123')
+        self.first, self.second = self.make_center('Первый'), self.make_center('Второй')
+        self.day = date.today() + timedelta(days=3)
+
+    def make_center(self, name):
+        center = TennisCenter.objects.create(
+            name=name, address='Алматы', phone_number='+77000000000', email='center@example.com',
+            number_of_courts=1, opening_time=time(8), closing_time=time(22),
+        )
+        sharding.replicate(center)
+        with sharding.for_center(center.pk):
+            TennisCourt.objects.create(tennis_center=center, court_number=1, price_per_hour=Decimal('5000'), surface_type='hard')
+        return center
+
+    def book(self, center, day, hour=10, name='Игрок'):
+        with sharding.for_center(center.pk):
+            return Booking.objects.create(
+                tennis_center=center, court=TennisCourt.objects.get(tennis_center=center), user=self.user,
+                date=day, start_time=time(hour), duration_hours=1,
+                full_name=name, phone='+77000000000', email='player@example.com',
+            )
+
+    def test_centers_are_spread_over_shards(self):
+        self.assertEqual(
+            {sharding.shard_for_center(self.first.pk), sharding.shard_for_center(self.second.pk)},
+            {'shard_0', 'shard_1'},
+        )
+
+    def test_new_shard_does_not_move_existing_centers(self):
+        placement = {center.pk: sharding.shard_for_center(center.pk) for center in (self.first, self.second)}
+        sharding._placements.clear()
+        with self.settings(DATABASE_SHARDS=['shard_0', 'shard_1', 'shard_2']):
+            self.assertEqual({pk: sharding.shard_for_center(pk) for pk in placement}, placement)
+            self.assertEqual(TennisCenter.objects.create(
+                name='Третий', address='Алматы', phone_number='+77000000000', email='center@example.com',
+                number_of_courts=1, opening_time=time(8), closing_time=time(22),
+            ).shard, 'shard_2')
+
+    def test_center_without_placement_is_an_error(self):
+        TennisCenter.objects.filter(pk=self.first.pk).update(shard='')
+        sharding._placements.clear()
+        with self.assertRaises(ImproperlyConfigured):
+            sharding.shard_for_center(self.first.pk)
+        self.assertIsNone(sharding.shard_for_center(self.second.pk + 100))
+
+    def test_router_writes_rows_to_center_shard(self):
+        booking = self.book(self.second, self.day)
+        alias = sharding.shard_for_center(self.second.pk)
+        self.assertEqual(booking._state.db, alias)
+        self.assertEqual(booking.court._state.db, alias)
+        self.assertFalse(Booking.objects.using('default').exists())
+        with sharding.use_shard(alias):
+            self.assertEqual(list(Booking.objects.all()), [booking])
+
+    def test_shard_for_pk_uses_id_ranges(self):
+        booking = self.book(self.first, self.day)
+        alias = sharding.shard_for_center(self.first.pk)
+        self.assertGreaterEqual(booking.pk, (sharding.shard_index(alias) + 1) * sharding.SHARD_ID_SPAN)
+        self.assertEqual(sharding.shard_for_pk(booking.pk), alias)
+        self.assertIsNone(sharding.shard_for_pk(5))
+        self.assertIsNone(sharding.shard_for_pk(3 * sharding.SHARD_ID_SPAN))
+        self.assertIsNone(sharding.shard_for_pk('abc'))
+
+    def test_prepare_shard_keeps_existing_ids(self):
+        booking = self.book(self.first, self.day)
+        sharding.prepare_shard(booking._state.db)
+        self.assertGreater(self.book(self.first, self.day, hour=12).pk, booking.pk)
+
+    def test_scatter_gather_merges_shards_in_order_with_limit(self):
+        days = [self.day + timedelta(days=offset) for offset in range(4)]
+        for offset, day in enumerate(days):
+            self.book(self.first if offset % 2 else self.second, day)
+
+        rows = sharding.scatter_gather(Booking.objects.order_by('date'), key=attrgetter('date'), limit=3)
+        self.assertEqual([row.date for row in rows], days[:3])
+        rows = sharding.scatter_gather(Booking.objects.order_by('-date'), key=attrgetter('date'), reverse=True)
+        self.assertEqual([row.date for row in rows], days[::-1])
+        with sharding.for_center(self.first.pk):
+            self.assertEqual(len(sharding.scatter_gather(Booking.objects.all())), 2)
+
+    def test_deleting_user_removes_shard_bookings_and_detaches_blocks(self):
+        first, second = self.book(self.first, self.day), self.book(self.second, self.day)
+        with sharding.for_center(self.first.pk):
+            block = CourtBlock.objects.create(
+                tennis_center=self.first, date_from=self.day, date_to=self.day,
+                start_time=time(6), end_time=time(7), reason='maintenance', created_by=self.user,
+            )
+            refresh_bookings([first])
+            self.assertTrue(CourtOccupancy.objects.filter(mask__gt=0).exists())
+
+        self.user.delete()
+
+        for booking in (first, second):
+            with sharding.use_shard(booking._state.db):
+                self.assertFalse(Booking.objects.filter(pk=booking.pk).exists())
+        with sharding.for_center(self.first.pk):
+            block.refresh_from_db()
+            self.assertIsNone(block.created_by_id)
+            self.assertFalse(CourtOccupancy.objects.filter(mask__gt=0).exists())
+
+    def test_availability_change_waits_for_shard_commit(self):
+        booking = self.book(self.first, self.day)
+        with patch('tennis.events.get_broker') as broker:
+            with self.captureOnCommitCallbacks(using=booking._state.db, execute=True) as callbacks:
+                with sharding.use_shard(booking._state.db), sharding.atomic():
+                    publish_availability_change(booking, 'created')
+                broker.return_value.publish.assert_not_called()
+            self.assertEqual(len(callbacks), 1)
+            broker.return_value.publish.assert_called_once()
+
+    def test_admin_add_forms_list_courts_of_every_shard(self):
+        self.client.force_login(User.objects.create_superuser('staff', 'staff@example.com', 'secret-pass-123'))
+        for url in (reverse('admin:tennis_courtblock_add'), reverse('admin:tennis_booking_add')):
+            response = self.client.get(url)
+            self.assertContains(response, 'Первый - Корт 1')
+            self.assertContains(response, 'Второй - Корт 1')
+
+        alias = sharding.shard_for_center(self.second.pk)
+        with sharding.use_shard(alias):
+            court = TennisCourt.objects.get(tennis_center=self.second)
+        response = self.client.post(reverse('admin:tennis_courtblock_add'), {
+            'tennis_center': self.second.pk, 'courts': [court.pk],
+            'date_from': self.day.isoformat(), 'date_to': self.day.isoformat(),
+            'start_time': '10:00', 'end_time': '12:00', 'reason': 'maintenance', 'comment': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        with sharding.use_shard(alias):
+            self.assertTrue(Booking.objects.filter(court=court, status='blocked').exists())
+
+    def test_admin_booking_changes_are_published(self):
+        booking = self.book(self.second, self.day)
+        booking_admin = BookingAdmin(Booking, None)
+        request = RequestFactory().post('/')
+        with patch('tennis.admin.publish_availability_change') as publish:
+            with sharding.use_shard(booking._state.db):
+                booking.full_name = 'Другое имя'
+                booking_admin.save_model(request, booking, None, change=True)
+                publish.assert_not_called()
+
+                booking.status = 'cancelled'
+                booking_admin.save_model(request, booking, None, change=True)
+                self.assertEqual([call.args[1] for call in publish.call_args_list], ['cancelled'])
+
+                booking.status = 'pending'
+                booking.start_time = time(12)
+                booking_admin.save_model(request, booking, None, change=True)
+                self.assertEqual([call.args[1] for call in publish.call_args_list], ['cancelled', 'created'])
+
+    def test_admin_picks_shard_by_object_id_and_center_filter(self):
+        admin_site = BookingAdmin(Booking, None)
+        factory = RequestFactory()
+        booking = self.book(self.second, self.day, name='Второй игрок')
+        alias = sharding.shard_for_center(self.second.pk)
+
+        self.assertEqual(admin_site.request_shard(factory.get('/'), str(booking.pk)), alias)
+        self.assertEqual(admin_site.request_shard(factory.get('/', {'tennis_center__id__exact': self.second.pk})), alias)
+        self.assertEqual(admin_site.request_shard(factory.post('/', {'tennis_center': self.second.pk})), alias)
+        self.assertEqual(admin_site.request_shard(factory.get('/')), 'shard_0')
+
+        self.client.force_login(User.objects.create_superuser('staff', 'staff@example.com', 'secret-pass-123'))
+        response = self.client.get(reverse('admin:tennis_booking_change', args=[booking.pk]))
+        self.assertContains(response, 'Второй игрок')
+        response = self.client.get(reverse('admin:tennis_booking_changelist'), {'tennis_center__id__exact': self.second.pk})
+        self.assertContains(response, 'Второй игрок')
+
+
+class ExpirePendingBookingsTests(TestCase):
+    """Отмена неоплаченных в срок бронирований пачками с уведомлением"""
+
+    def setUp(self):
+        self.center = create_center(courts=1)
+        self.court = self.center.courts.get()
+        self.user = User.objects.create_user('player', 'player@example.com')
+        self.day = date.today() + timedelta(days=3)
+
+    def book(self, hour, created_hours_ago, status='pending', day=None):
+        booking = Booking.objects.create(
+            tennis_center=self.center, court=self.court, user=self.user, date=day or self.day,
+            start_time=time(hour), duration_hours=1, status=status,
+            full_name='Игрок', phone='+77000000000', email='player@example.com',
+        )
+        Booking.objects.filter(pk=booking.pk).update(created_at=timezone.now() - timedelta(hours=created_hours_ago))
+        return booking
+
+    def expire(self, *args):
+        out = StringIO()
+        call_command('expire_pending_bookings', '--hours=24', *args, stdout=out)
+        return out.getvalue()
+
+    def test_cancels_overdue_pending_bookings_in_batches(self):
+        overdue = [self.book(hour, created_hours_ago=30) for hour in range(8, 13)]
+        fresh = self.book(14, created_hours_ago=2)
+        paid = self.book(15, created_hours_ago=30, status='paid')
+        refresh_bookings(overdue)
+
+        output = self.expire('--batch-size=2')
+
+        self.assertIn('Отменено бронирований: 5, уведомлений: 5', output)
+        self.assertEqual(
+            set(Booking.objects.filter(status='cancelled').values_list('id', flat=True)),
+            {booking.id for booking in overdue},
+        )
+        self.assertEqual(Booking.objects.get(pk=fresh.pk).status, 'pending')
+        self.assertEqual(Booking.objects.get(pk=paid.pk).status, 'paid')
+        self.assertEqual(len(mail.outbox), 5)
+        # В занятости остались только свежая и оплаченная брони
+        self.assertEqual(CourtOccupancy.objects.get(court=self.court, date=self.day).mask, 1 << 14 | 1 << 15)
+
+    def test_past_bookings_are_left_alone(self):
+        past = self.book(10, created_hours_ago=30 * 24, day=date.today() - timedelta(days=30))
+        self.assertIn('Отменено бронирований: 0, уведомлений: 0', self.expire())
+        self.assertEqual(Booking.objects.get(pk=past.pk).status, 'pending')
+        self.assertEqual(mail.outbox, [])
+
+    def test_no_email_option(self):
+        self.book(10, created_hours_ago=30)
+        self.assertIn('Отменено бронирований: 1, уведомлений: 0', self.expire('--no-email'))
+        self.assertEqual(mail.outbox, [])
+
+
+@override_settings(RATELIMIT_ENABLED=False)
+class ProfilerTests(TestCase):
+    """Выборочный cProfile: сохранение замеров по view и отчет в админке"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.profiles = Path(directory.name)
+        create_center()
+
+    def test_sampled_request_is_saved_and_listed_in_hot_spots(self):
+        with self.settings(PROFILER_SAMPLE_RATE=1, PROFILER_DIR=self.profiles):
+            self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+        self.assertTrue((self.profiles / 'home.prof').exists())
+
+        self.client.force_login(User.objects.create_superuser('staff', 'staff@example.com', 'secret-pass-123'))
+        with self.settings(PROFILER_SAMPLE_RATE=0, PROFILER_DIR=self.profiles):
+            response = self.client.get(reverse('profiler_report'), {'project': '1'})
+        self.assertContains(response, 'home &mdash;')
+        self.assertContains(response, 'views.py:')
+        self.assertContains(response, '(home)')
+
+    def test_zero_sample_rate_records_nothing(self):
+        with self.settings(PROFILER_SAMPLE_RATE=0, PROFILER_DIR=self.profiles):
+            self.client.get(reverse('home'))
+        self.assertEqual(list(self.profiles.glob('*.prof')), [])
+
+
+@override_settings(RATELIMIT_ENABLED=False, SESSION_ENGINE='tennis.sessions.db', SESSION_COOKIE_AGE=3600, SESSION_RENEWAL_THRESHOLD=3000)
+class LazySessionRenewalTests(TestCase):
+    """Сессия пишется в базу только при изменении данных или перед истечением"""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('player', 'player@example.com', 'secret-pass-123'))
+
+    def session_writes(self, now=None):
+        with patch('tennis.sessions.time.time', return_value=now or clock.time()):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(reverse('profile')).status_code, 200)
+        return [
+            query['sql'] for query in queries.captured_queries
+            if 'django_session' in query['sql'] and not query['sql'].startswith('SELECT')
+        ]
+
+    def test_unchanged_session_is_not_written(self):
+        self.session_writes()
+        self.assertEqual(self.session_writes(), [])
+
+    def test_session_is_renewed_once_past_threshold(self):
+        self.session_writes()
+        # До истечения осталось 2900 секунд - меньше порога в 3000
+        writes = self.session_writes(now=clock.time() + 700)
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith('UPDATE'))
+        self.assertIn('expire_date', writes[0])
+        self.assertEqual(self.session_writes(now=clock.time() + 700), [])
+
+
+class JsonLogTests(TestCase):
+    """Лог через очередь: одна JSON-строка на запись с request_id запроса"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'tennis.log'
+        self.logger = logging.getLogger('tennis.tests.json_log')
+        self.logger.propagate = False
+        self.addCleanup(setattr, self.logger, 'propagate', True)
+
+    def attach(self, **kwargs):
+        handler = QueueFileHandler(self.path, **kwargs)
+        handler.addFilter(RequestIdFilter())
+        self.logger.addHandler(handler)
+        self.addCleanup(self.logger.removeHandler, handler)
+        return handler
+
+    def test_record_is_one_json_line_with_request_id(self):
+        handler = self.attach()
+
+        def view(request):
+            self.logger.warning('Бронь %s отменена', 7, extra={'booking_id': 7})
+            return HttpResponse()
+
+        request = RequestFactory().get('/', HTTP_X_REQUEST_ID='req-123')
+        RequestIdMiddleware(view)(request)
+        handler.stop()
+
+        lines = self.path.read_text(encoding='utf-8').splitlines()
+        self.assertEqual(len(lines), 1)
+        record = json.loads(lines[0])
+        self.assertEqual(record['request_id'], 'req-123')
+        self.assertEqual(record['message'], 'Бронь 7 отменена')
+        self.assertEqual(record['booking_id'], 7)
+        self.assertEqual(record['level'], 'WARNING')
+
+    def test_full_queue_drops_records(self):
+        handler = self.attach(queue_size=1)
+        # Без слушателя очередь никто не разбирает
+        handler.stop()
+
+        started = clock.monotonic()
+        for number in range(3):
+            self.logger.warning('Запись %s', number)
+        self.assertLess(clock.monotonic() - started, 1)
+        self.assertEqual(handler.dropped, 2)
+        self.assertEqual(handler.queue.qsize(), 1)
@@ -0,0 +1,101 @@
+from django.db.models import FilteredRelation, Q
+
+from .availability import working_minutes
+from .models import TennisCourt, Booking
+
+
+SURFACE_LABELS = dict(TennisCourt.SURFACE_CHOICES)
+STATUS_LABELS = dict(Booking.STATUS_CHOICES)
+
+
+class Cell:
+    """Клетка расписания: час корта, бронирования, начинающиеся в нем, и ширина"""
+
+    def __init__(self, hour):
+        self.hour = hour
+        self.bookings = []
+        self.span = 1
+
+    @property
+    def conflict(self):
+        return len(self.bookings) > 1
+
+
+def build_timetable(tennis_center, day):
+    """Матрица корты x часы работы центра на день.
+
+    Все корты центра с их бронированиями за день читаются одним запросом
+    (LEFT JOIN по FilteredRelation), корты без бронирований тоже попадают
+    в выборку. Бронь занимает клетку часа начала шириной в продолжительность;
+    пересекающиеся брони попадают в одну клетку и помечаются конфликтом.
+    Возвращает (часы, [(корт, клетки)]).
+    """
+    opening, closing = working_minutes(tennis_center)
+    hours = list(range(opening // 60, -(-closing // 60)))
+
+    rows = TennisCourt.objects.filter(tennis_center=tennis_center).annotate(
+        day_booking=FilteredRelation(
+            'booking',
+            condition=Q(booking__date=day, booking__status__in=Booking.ACTIVE_STATUSES),
+        ),
+    ).order_by('court_number', 'day_booking__start_time').values_list(
+        'id', 'court_number', 'surface_type', 'indoor',
+        'day_booking__id', 'day_booking__start_time', 'day_booking__duration_hours',
+        'day_booking__full_name', 'day_booking__phone', 'day_booking__status',
+        'day_booking__trainer_service', 'day_booking__racket_rental', 'day_booking__balls_rental',
+    )
+
+    courts = {}
+    for court_id, number, surface, indoor, booking_id, start_time, duration, *details in rows:
+        court = courts.setdefault(court_id, {
+            'id': court_id,
+            'number': number,
+            'surface': SURFACE_LABELS.get(surface, surface),
+            'indoor': indoor,
+            'bookings': [],
+        })
+        if booking_id is not None:
+            full_name, phone, status, trainer, rackets, balls = details
+            court['bookings'].append({
+                'id': booking_id,
+                'start_time': start_time,
+                'duration_hours': duration,
+                'full_name': full_name,
+                'phone': phone,
+                'status': status,
+                'status_display': STATUS_LABELS.get(status, status),
+                'trainer_service': trainer,
+                'racket_rental': rackets,
+                'balls_rental': balls,
+            })
+
+    matrix = []
+    for court in courts.values():
+        cells = {hour: Cell(hour) for hour in hours}
+        for booking in court['bookings']:
+            hour = min(max(booking['start_time'].hour, hours[0]), hours[-1]) if hours else None
+            if hour is not None:
+                cells[hour].bookings.append(booking)
+        matrix.append((court, _merge([cells[hour] for hour in hours])))
+    return hours, matrix
+
+
+def _end_hour(booking):
+    start = booking['start_time'].hour * 60 + booking['start_time'].minute
+    return -(-(start + booking['duration_hours'] * 60) // 60)
+
+
+def _merge(cells):
+    """Объединение клеток, перекрытых бронированиями, в одну широкую"""
+    merged = []
+    covered_until = None
+    for cell in cells:
+        if merged and cell.hour < covered_until:
+            current = merged[-1]
+            current.span += 1
+            current.bookings.extend(cell.bookings)
+            covered_until = max([covered_until] + [_end_hour(booking) for booking in cell.bookings])
+            continue
+        merged.append(cell)
+        covered_until = max([cell.hour + 1] + [_end_hour(booking) for booking in cell.bookings])
+    return merged
@@ -11,6 +11,7 @@ urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('logout/', auth_views.LogoutView.as_view(template_name='registration/logout.html'), name='logout'),
     path('profile/', views.profile_view, name='profile'),
+    path('profile/calendar/regenerate/', views.regenerate_calendar_token, name='regenerate_calendar_token'),
 
     # Процесс бронирования
     path('booking/step1/', views.booking_step1, name='booking_step1'),
@@ -18,10 +19,21 @@ urlpatterns = [
     path('booking/step3/', views.booking_step3, name='booking_step3'),
     path('booking/step4/', views.booking_step4, name='booking_step4'),
     path('booking/success/<int:booking_id>/', views.booking_success, name='booking_success'),
+    path('booking/waiting-room/status/', views.waiting_room_status, name='waiting_room_status'),
 
     # Управление бронированиями
     path('booking/cancel/<int:booking_id>/', views.cancel_booking, name='cancel_booking'),
 
+    # Календарные ленты
+    path('calendar/user/<str:token>/bookings.ics', views.user_calendar, name='user_calendar'),
+    path('calendar/court/<int:court_id>/bookings.ics', views.court_calendar, name='court_calendar'),
+
     # AJAX endpoints
     path('ajax/courts/', views.get_courts_ajax, name='get_courts_ajax'),
+    path('ajax/free-slots/', views.get_free_slots_ajax, name='get_free_slots_ajax'),
+    path('ajax/availability/stream/', views.availability_stream, name='availability_stream'),
+
+    # Служебные endpoints для персонала
+    path('staff/ratelimit/', views.ratelimit_stats, name='ratelimit_stats'),
+    path('staff/bookings/lookup/', views.booking_lookup, name='booking_lookup'),
 ]
\ No newline at end of file
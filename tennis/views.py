@@ -1,24 +1,43 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition, require_POST
+from django.core.handlers.asgi import ASGIRequest
 from django.db.models import Q
 from django.core.mail import send_mail
+from django.urls import reverse
 from django.conf import settings
-from datetime import datetime, timedelta, time
+from datetime import datetime, date, timedelta, time
 from .models import TennisCenter, TennisCourt, Booking, BookingSession
 from .forms import BookingStep2Form, BookingStep3Form, BookingStep4Form
+from .availability import find_free_slots, lock_free_court, overlap_q
+from .ratelimit import ratelimit, get_counters
+from .routers import use_replica
+from .search import search_bookings
+from .events import availability_channel, get_broker, publish_availability_change
+from .occupancy import refresh_bookings
+from . import ical
+from . import sharding
+from . import waitingroom
+import asyncio
 import json
+import logging
 
+logger = logging.getLogger(__name__)
 
+
+@use_replica
 def home(request):
     """Главная страница"""
-    tennis_centers = TennisCenter.objects.all()
+    tennis_centers = sharding.prefetch_by_shard(TennisCenter.objects.all(), 'courts')
     return render(request, 'tennis/home.html', {'tennis_centers': tennis_centers})
 
 
+@ratelimit('login', methods=['POST'])
 def register_view(request):
     """Регистрация пользователя"""
     if request.method == 'POST':
@@ -33,6 +52,7 @@ def register_view(request):
     return render(request, 'registration/register.html', {'form': form})
 
 
+@ratelimit('login', methods=['POST'])
 def login_view(request):
     """Авторизация пользователя"""
     if request.method == 'POST':
@@ -52,8 +72,24 @@ def login_view(request):
 @login_required
 def profile_view(request):
     """Личный кабинет пользователя"""
-    bookings = Booking.objects.filter(user=request.user)
-    return render(request, 'tennis/profile.html', {'bookings': bookings})
+    # Бронирования пользователя могут лежать на разных шардах
+    bookings = sharding.scatter_gather(
+        Booking.objects.filter(user=request.user).exclude(status='blocked').select_related(
+            'tennis_center', 'court__tennis_center'
+        ),
+        key=lambda booking: booking.created_at, reverse=True,
+    )
+    calendar_url = request.build_absolute_uri(reverse('user_calendar', args=[ical.user_token(request.user)]))
+    return render(request, 'tennis/profile.html', {'bookings': bookings, 'calendar_url': calendar_url})
+
+
+@login_required
+@require_POST
+def regenerate_calendar_token(request):
+    """Новая ссылка на календарь; старая перестает работать"""
+    ical.regenerate_token(request.user)
+    messages.success(request, 'Ссылка на календарь обновлена. Старая ссылка больше не работает.')
+    return redirect('profile')
 
 
 def get_or_create_booking_session(request):
@@ -71,6 +107,7 @@ def get_or_create_booking_session(request):
 
 
 @login_required
+@ratelimit('booking', methods=['POST'])
 def booking_step1(request):
     """Шаг 1 - Выбор теннисного центра"""
     if request.method == 'POST':
@@ -83,11 +120,12 @@ def booking_step1(request):
         else:
             messages.error(request, 'Пожалуйста, выберите теннисный центр')
 
-    tennis_centers = TennisCenter.objects.all()
+    tennis_centers = sharding.prefetch_by_shard(TennisCenter.objects.all(), 'courts')
     return render(request, 'tennis/booking_step1.html', {'tennis_centers': tennis_centers})
 
 
 @login_required
+@ratelimit('booking', methods=['POST'])
 def booking_step2(request):
     """Шаг 2 - Выбор даты и времени"""
     session = get_or_create_booking_session(request)
@@ -96,6 +134,7 @@ def booking_step2(request):
         messages.error(request, 'Сначала выберите теннисный центр')
         return redirect('booking_step1')
 
+    sharding.activate_for_center(session.tennis_center_id)
     tennis_center = get_object_or_404(TennisCenter, pk=session.tennis_center_id)
     courts = TennisCourt.objects.filter(tennis_center=tennis_center)
 
@@ -119,6 +158,7 @@ def booking_step2(request):
 
 
 @login_required
+@ratelimit('booking', methods=['POST'])
 def booking_step3(request):
     """Шаг 3 - Дополнительные услуги"""
     session = get_or_create_booking_session(request)
@@ -142,6 +182,7 @@ def booking_step3(request):
 
 
 @login_required
+@ratelimit('booking', methods=['POST'])
 def booking_step4(request):
     """Шаг 4 - Подтверждение заявки"""
     session = get_or_create_booking_session(request)
@@ -150,6 +191,7 @@ def booking_step4(request):
         messages.error(request, 'Пожалуйста, пройдите все предыдущие шаги')
         return redirect('booking_step1')
 
+    sharding.activate_for_center(session.tennis_center_id)
     tennis_center = get_object_or_404(TennisCenter, pk=session.tennis_center_id)
     court = None
     if session.court_id:
@@ -171,28 +213,45 @@ def booking_step4(request):
     if request.method == 'POST':
         form = BookingStep4Form(request.POST)
         if form.is_valid():
-            # Создание бронирования
-            booking = Booking.objects.create(
-                tennis_center=tennis_center,
-                court=court,
-                user=request.user,
-                date=session.date,
-                start_time=session.start_time,
-                duration_hours=session.duration_hours,
-                trainer_service=session.trainer_service,
-                racket_rental=session.racket_rental,
-                balls_rental=session.balls_rental,
-                total_price=total_price,
-                full_name=form.cleaned_data['full_name'],
-                phone=form.cleaned_data['phone'],
-                email=form.cleaned_data['email'],
+            # Создание бронирования: проверка и запись под блокировкой кортов
+            with sharding.atomic():
+                court = lock_free_court(
+                    tennis_center, session.date, session.start_time, session.duration_hours,
+                    court=court if session.court_id else None,
+                )
+                if court is None:
+                    messages.error(request, 'Выбранное время уже занято, выберите другое')
+                    return redirect('booking_step2')
+                total_price = calculate_booking_price(court, session)
+                booking = Booking.objects.create(
+                    tennis_center=tennis_center,
+                    court=court,
+                    user=request.user,
+                    date=session.date,
+                    start_time=session.start_time,
+                    duration_hours=session.duration_hours,
+                    trainer_service=session.trainer_service,
+                    racket_rental=session.racket_rental,
+                    balls_rental=session.balls_rental,
+                    total_price=total_price,
+                    full_name=form.cleaned_data['full_name'],
+                    phone=form.cleaned_data['phone'],
+                    email=form.cleaned_data['email'],
+                )
+                refresh_bookings([booking])
+
+            logger.info(
+                'Создано бронирование',
+                extra={'booking_id': booking.id, 'user_id': request.user.id, 'court_id': court.id},
             )
+            publish_availability_change(booking, 'created')
 
             # Отправка email подтверждения
             send_booking_confirmation_email(booking)
 
-            # Очистка сессии
+            # Очистка сессии и освобождение места в очереди
             session.delete()
+            waitingroom.release(request)
 
             messages.success(request, 'Бронирование успешно создано!')
             return redirect('booking_success', booking_id=booking.id)
@@ -218,18 +277,28 @@ def booking_step4(request):
 @login_required
 def booking_success(request, booking_id):
     """Страница успешного бронирования"""
-    booking = get_object_or_404(Booking, id=booking_id, user=request.user)
+    sharding.activate(sharding.shard_for_pk(booking_id))
+    booking = get_object_or_404(
+        Booking.objects.select_related('tennis_center', 'court__tennis_center'),
+        id=booking_id, user=request.user
+    )
     return render(request, 'tennis/booking_success.html', {'booking': booking})
 
 
 @login_required
+@ratelimit('booking')
 def cancel_booking(request, booking_id):
     """Отмена бронирования"""
+    sharding.activate(sharding.shard_for_pk(booking_id))
     booking = get_object_or_404(Booking, id=booking_id, user=request.user)
 
     if booking.can_be_cancelled():
         booking.status = 'cancelled'
-        booking.save()
+        with sharding.atomic():
+            booking.save()
+            refresh_bookings([booking])
+        logger.info('Бронирование отменено пользователем', extra={'booking_id': booking.id, 'user_id': request.user.id})
+        publish_availability_change(booking, 'cancelled')
         messages.success(request, 'Бронирование успешно отменено')
     else:
         messages.error(request, 'Это бронирование нельзя отменить')
@@ -239,19 +308,12 @@ def cancel_booking(request, booking_id):
 
 def get_available_courts(tennis_center, date, start_time, duration_hours):
     """Получение доступных кортов на указанное время"""
-    end_time = (datetime.combine(date, start_time) + timedelta(hours=duration_hours)).time()
-
     # Находим все занятые корты на это время
     occupied_courts = Booking.objects.filter(
         tennis_center=tennis_center,
         date=date,
-        status__in=['pending', 'paid']
-    ).filter(
-        Q(start_time__lt=end_time) &
-        Q(start_time__gte=start_time) |
-        Q(start_time__lte=start_time) &
-        Q(start_time__gt=start_time)  # Упрощенная логика, можно улучшить
-    ).values_list('court_id', flat=True)
+        status__in=Booking.ACTIVE_STATUSES
+    ).filter(overlap_q(start_time, duration_hours)).values_list('court_id', flat=True)
 
     # Возвращаем свободные корты
     available_courts = TennisCourt.objects.filter(
@@ -301,15 +363,18 @@ def send_booking_confirmation_email(booking):
             [booking.email],
             fail_silently=False,
         )
-    except Exception as e:
-        print(f"Ошибка отправки email: {e}")
+    except Exception:
+        logger.exception('Ошибка отправки email', extra={'booking_id': booking.id})
 
 
 # AJAX views for dynamic content
+@ratelimit('ajax')
+@use_replica
 def get_courts_ajax(request):
     """AJAX получение кортов для выбранного центра"""
     center_id = request.GET.get('center_id')
     if center_id:
+        sharding.activate_for_center(center_id)
         courts = TennisCourt.objects.filter(tennis_center_id=center_id)
         data = [{
             'id': court.id,
@@ -319,4 +384,191 @@ def get_courts_ajax(request):
             'indoor': court.indoor
         } for court in courts]
         return JsonResponse({'courts': data})
-    return JsonResponse({'courts': []})
\ No newline at end of file
+    return JsonResponse({'courts': []})
+
+
+@ratelimit('ajax')
+@use_replica
+def get_free_slots_ajax(request):
+    """AJAX поиск ближайших свободных слотов"""
+    center_id = request.GET.get('center_id')
+    if not center_id:
+        return JsonResponse({'slots': []})
+
+    tennis_center = get_object_or_404(TennisCenter, pk=center_id)
+    sharding.activate_for_center(tennis_center.pk)
+    court = None
+    if request.GET.get('court_id'):
+        court = get_object_or_404(TennisCourt, pk=request.GET['court_id'], tennis_center=tennis_center)
+
+    try:
+        duration_hours = int(request.GET.get('duration', 1))
+        limit = int(request.GET.get('limit', 5))
+        start_date = datetime.strptime(request.GET['date'], '%Y-%m-%d').date() if request.GET.get('date') else date.today()
+    except ValueError:
+        return JsonResponse({'error': 'Некорректные параметры'}, status=400)
+
+    if not 1 <= duration_hours <= 3:
+        return JsonResponse({'error': 'Продолжительность должна быть от 1 до 3 часов'}, status=400)
+
+    slots = find_free_slots(tennis_center, start_date, duration_hours, court=court, limit=min(limit, 20))
+    data = [{
+        'date': slot.date.isoformat(),
+        'start_time': slot.start_time.strftime('%H:%M'),
+        'court_id': slot.court.id,
+        'court_number': slot.court.court_number,
+    } for slot in slots]
+    return JsonResponse({'slots': data})
+
+
+def waiting_room_status(request):
+    """Состояние билета в очереди для страницы ожидания (без запросов к базе)"""
+    ticket = waitingroom.read_ticket(request)
+    if ticket is None:
+        return JsonResponse({'admitted': True, 'position': 0})
+
+    request.waiting_room_ticket = ticket
+    admitted = waitingroom.admit(ticket)
+    response = JsonResponse({
+        'admitted': admitted,
+        'position': 0 if admitted else waitingroom.position(ticket),
+    })
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def user_calendar_bookings(request, token):
+    """Бронирования ленты пользователя по секретному токену (токен ищется раз за запрос)"""
+    if not hasattr(request, '_calendar_user_id'):
+        request._calendar_user_id = ical.user_id_from_token(token)
+    user_id = request._calendar_user_id
+    if user_id is None:
+        raise Http404
+    return ical.feed_window(Booking.objects.filter(user_id=user_id).exclude(status='blocked'))
+
+
+def court_calendar_bookings(court_id):
+    """Занятость корта для ленты корта"""
+    sharding.activate(sharding.shard_for_pk(court_id))
+    return ical.feed_window(Booking.objects.filter(court_id=court_id, status__in=Booking.ACTIVE_STATUSES))
+
+
+def calendar_response(request, bookings, name, summary):
+    """Потоковый ответ .ics; строки читаются из тех же баз, что и версия ленты"""
+    bookings = bookings.select_related('tennis_center', 'court').order_by('date', 'start_time')
+    response = StreamingHttpResponse(
+        ical.stream_feed(sharding.shard_querysets(bookings), name, summary, request.get_host()),
+        content_type='text/calendar; charset=utf-8',
+    )
+    response['Content-Disposition'] = 'inline; filename="bookings.ics"'
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+# Календарные клиенты опрашивают ленты часто: большинство запросов
+# завершается 304 по ETag/Last-Modified без чтения самих бронирований
+@ratelimit('calendar')
+@use_replica
+@condition(
+    etag_func=lambda request, token: ical.feed_etag(request, user_calendar_bookings(request, token)),
+    last_modified_func=lambda request, token: ical.feed_last_modified(request, user_calendar_bookings(request, token)),
+)
+def user_calendar(request, token):
+    """Лента .ics бронирований пользователя"""
+    return calendar_response(
+        request, user_calendar_bookings(request, token), 'Теннис: мои бронирования',
+        lambda booking: f'Теннис, корт {booking.court.court_number}',
+    )
+
+
+@ratelimit('calendar')
+@use_replica
+@condition(
+    etag_func=lambda request, court_id: ical.feed_etag(request, court_calendar_bookings(court_id)),
+    last_modified_func=lambda request, court_id: ical.feed_last_modified(request, court_calendar_bookings(court_id)),
+)
+def court_calendar(request, court_id):
+    """Лента .ics занятости корта (без данных клиентов)"""
+    court = get_object_or_404(TennisCourt.objects.select_related('tennis_center'), pk=court_id)
+    return calendar_response(
+        request, court_calendar_bookings(court_id), str(court),
+        lambda booking: booking.full_name if booking.status == 'blocked' else 'Занято',
+    )
+
+
+@staff_member_required
+def ratelimit_stats(request):
+    """Счетчики ограничения частоты запросов для персонала"""
+    return JsonResponse({'counters': get_counters()})
+
+
+@staff_member_required
+@use_replica
+def booking_lookup(request):
+    """Быстрый поиск бронирований для ресепшена"""
+    term = request.GET.get('q', '')
+    if not term.strip():
+        return JsonResponse({'bookings': []})
+
+    bookings = search_bookings(
+        Booking.objects.select_related('tennis_center', 'court'), term
+    ).order_by('-date', '-start_time')[:20]
+    bookings = sharding.scatter_gather(
+        bookings, key=lambda booking: (booking.date, booking.start_time), reverse=True, limit=20
+    )
+    data = [{
+        'id': booking.id,
+        'full_name': booking.full_name,
+        'phone': booking.phone,
+        'email': booking.email,
+        'tennis_center': booking.tennis_center.name,
+        'court_number': booking.court.court_number,
+        'date': booking.date.isoformat(),
+        'start_time': booking.start_time.strftime('%H:%M'),
+        'status': booking.status,
+    } for booking in bookings]
+    return JsonResponse({'bookings': data})
+
+
+# Интервал комментариев-пингов в SSE-потоке, чтобы прокси не закрывали соединение
+SSE_HEARTBEAT_SECONDS = 15
+
+
+async def availability_stream(request):
+    """SSE-поток изменений занятости кортов центра на дату.
+
+    Работает только под ASGI: под WSGI долгое соединение заняло бы воркер,
+    поэтому клиенту отвечаем 204, и EventSource не переподключается.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+
+    try:
+        center_id = int(request.GET.get('center_id', ''))
+        booking_date = datetime.strptime(request.GET.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return JsonResponse({'error': 'Некорректные параметры'}, status=400)
+    if not await TennisCenter.objects.filter(pk=center_id).aexists():
+        return JsonResponse({'error': 'Центр не найден'}, status=404)
+
+    broker = get_broker()
+    channel = availability_channel(center_id, booking_date)
+    queue = broker.subscribe(channel)
+
+    async def events():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+                    continue
+                yield f'event: availability\ndata: {json.dumps(message)}\n\n'
+        finally:
+            broker.unsubscribe(channel, queue)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
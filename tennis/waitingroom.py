@@ -0,0 +1,155 @@
+from django.conf import settings
+from django.core.cache import cache
+
+
+CACHE_PREFIX = 'waitingroom'
+COOKIE_NAME = 'waiting_room'
+COOKIE_SALT = 'tennis.waitingroom'
+# Сколько живет билет в очереди
+TICKET_MAX_AGE = 3600
+# Сколько допущенные сдвигом границы билеты ждут опроса страницы ожидания
+# (каждые 3 секунды), прежде чем их места получат следующие
+ADMIT_GRACE_SECONDS = 10
+
+
+class Ticket:
+    """Билет очереди: порядковый номер и занятое место (None - ждет)"""
+
+    def __init__(self, number, slot=None):
+        self.number = number
+        self.slot = slot
+
+
+def enabled():
+    return getattr(settings, 'WAITING_ROOM_ENABLED', False)
+
+
+def _capacity():
+    return getattr(settings, 'WAITING_ROOM_CAPACITY', 100)
+
+
+def _active_seconds():
+    return getattr(settings, 'WAITING_ROOM_ACTIVE_SECONDS', 300)
+
+
+def _slot_key(index):
+    return f'{CACHE_PREFIX}:slot:{index}'
+
+
+def _incr(key, delta=1, timeout=None):
+    """Атомарное увеличение счетчика в кеше; отсутствующий ключ создается"""
+    while True:
+        if cache.add(key, delta, timeout=timeout):
+            return delta
+        try:
+            return cache.incr(key, delta)
+        except ValueError:
+            # Ключ истек между add и incr: создаем его заново
+            continue
+
+
+def read_ticket(request):
+    """Билет из подписанной cookie или None"""
+    value = request.get_signed_cookie(COOKIE_NAME, default=None, salt=COOKIE_SALT, max_age=TICKET_MAX_AGE)
+    if not value:
+        return None
+    try:
+        number, slot = value.split(':')
+        return Ticket(int(number), int(slot) if slot else None)
+    except ValueError:
+        return None
+
+
+def write_ticket(response, ticket):
+    if ticket is None:
+        response.delete_cookie(COOKIE_NAME)
+        return
+    value = f'{ticket.number}:{"" if ticket.slot is None else ticket.slot}'
+    response.set_signed_cookie(
+        COOKIE_NAME, value, salt=COOKIE_SALT,
+        max_age=TICKET_MAX_AGE, httponly=True, samesite='Lax',
+    )
+
+
+def issue():
+    """Новый билет в конец очереди"""
+    return Ticket(_incr(f'{CACHE_PREFIX}:issued'))
+
+
+def _free_slots():
+    taken = cache.get_many([_slot_key(index) for index in range(_capacity())])
+    return [index for index in range(_capacity()) if _slot_key(index) not in taken]
+
+
+def _admitted_up_to():
+    """Граница допуска: билеты с номером не больше нее могут занять место.
+
+    Граница сдвигается на число свободных мест не чаще раза в секунду и не
+    дальше последнего выданного билета, иначе новые билеты попадали бы за
+    границу сразу и обгоняли ждущих. Сколько допущенных еще не заняли место,
+    хранится ADMIT_GRACE_SECONDS. Билеты ушедших из очереди пользователей
+    граница просто проходит: после этого срока их места снова свободны.
+    """
+    up_to_key = f'{CACHE_PREFIX}:up_to'
+    up_to = cache.get(up_to_key, 0)
+    if cache.add(f'{CACHE_PREFIX}:tick', 1, timeout=1):
+        issued = cache.get(f'{CACHE_PREFIX}:issued', 0)
+        target = min(up_to + len(_free_slots()) - _pending(), issued)
+        if target > up_to:
+            _incr(f'{CACHE_PREFIX}:pending', target - up_to, timeout=ADMIT_GRACE_SECONDS)
+            return _incr(up_to_key, target - up_to)
+    return up_to
+
+
+def _pending():
+    """Допущенные сдвигом границы билеты, которые еще не заняли место"""
+    return max(0, cache.get(f'{CACHE_PREFIX}:pending', 0))
+
+
+def admit(ticket):
+    """Допуск к мастеру бронирования. True, если у билета есть место.
+
+    Место - ключ в кеше с арендой WAITING_ROOM_ACTIVE_SECONDS, которая
+    продлевается каждым запросом пользователя.
+    """
+    if ticket.slot is not None:
+        key = _slot_key(ticket.slot)
+        if cache.get(key) == ticket.number:
+            cache.touch(key, _active_seconds())
+            return True
+        ticket.slot = None
+
+    up_to = _admitted_up_to()
+    # Первый билет за границей проходит сразу, если никто из допущенных не
+    # ждет места: граница сдвигается вместе с занятым местом
+    head = ticket.number == up_to + 1 and not _pending()
+    if ticket.number > up_to and not head:
+        return False
+    for index in _free_slots():
+        if cache.add(_slot_key(index), ticket.number, timeout=_active_seconds()):
+            ticket.slot = index
+            if head:
+                _incr(f'{CACHE_PREFIX}:up_to')
+            else:
+                try:
+                    cache.decr(f'{CACHE_PREFIX}:pending')
+                except ValueError:
+                    pass
+            return True
+    return False
+
+
+def position(ticket):
+    """Сколько билетов впереди"""
+    return max(0, ticket.number - cache.get(f'{CACHE_PREFIX}:up_to', 0))
+
+
+def release(request):
+    """Освобождение места после завершения бронирования"""
+    ticket = getattr(request, 'waiting_room_ticket', None)
+    if ticket is None or ticket.slot is None:
+        return
+    key = _slot_key(ticket.slot)
+    if cache.get(key) == ticket.number:
+        cache.delete(key)
+    request.waiting_room_ticket = None
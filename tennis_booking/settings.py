@@ -43,14 +43,19 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tennis.middleware.RequestIdMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'tennis.middleware.LazySessionRenewalMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'tennis.middleware.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'tennis.middleware.WaitingRoomMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'tennis.middleware.ProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'tennis_booking.urls'
@@ -84,6 +89,60 @@ DATABASES = {
     )
 }
 
+# Реплики только для чтения: DATABASE_REPLICA_URLS через запятую.
+# Локально можно указать второй файл SQLite, например
+# DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3
+DATABASE_REPLICAS = []
+for index, url in enumerate(filter(None, os.environ.get("DATABASE_REPLICA_URLS", "").split(","))):
+    DATABASES[f"replica_{index}"] = dj_database_url.parse(url.strip())
+    DATABASES[f"replica_{index}"]["TEST"] = {"MIRROR": "default"}
+    DATABASE_REPLICAS.append(f"replica_{index}")
+
+# Шарды бронирований по теннисным центрам: DATABASE_SHARD_URLS через запятую
+# (алиасы shard_0, shard_1, ...). Локально - несколько файлов SQLite, например
+# DATABASE_SHARD_URLS=sqlite:///shard0.sqlite3,sqlite:///shard1.sqlite3.
+# После migrate --database=shard_N выполните manage.py prepare_shards
+DATABASE_SHARDS = []
+for index, url in enumerate(filter(None, os.environ.get("DATABASE_SHARD_URLS", "").split(","))):
+    DATABASES[f"shard_{index}"] = dj_database_url.parse(url.strip())
+    DATABASE_SHARDS.append(f"shard_{index}")
+
+# Новый центр размещается на шарде с наименьшим числом центров, шард
+# записывается в TennisCenter.shard. DATABASE_SHARD_MAP=1:shard_0,2:shard_1
+# переопределяет размещение (например, после переноса строк центра)
+TENNIS_SHARD_MAP = {
+    int(center_id): alias.strip()
+    for center_id, alias in (
+        item.split(":") for item in filter(None, os.environ.get("DATABASE_SHARD_MAP", "").split(","))
+    )
+}
+
+DATABASE_ROUTERS = ['tennis.routers.ShardRouter', 'tennis.routers.ReplicaRouter']
+
+# Сколько секунд после записи чтения пользователя идут только в основную базу
+REPLICA_PIN_SECONDS = 10
+
+# Cache (общий бэкенд для лимитов запросов; в продакшене укажите
+# CACHE_BACKEND/CACHE_LOCATION общего для всех воркеров хранилища)
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'tennis-booking'),
+    }
+}
+
+# Ограничение частоты запросов: бюджеты по IP и по пользователю
+RATELIMIT_ENABLED = os.environ.get("RATELIMIT_ENABLED", "True") == "True"
+# Сколько доверенных прокси перед приложением дописывают X-Forwarded-For
+# (на Render - 1). 0 - заголовок не учитывается, берется REMOTE_ADDR
+RATELIMIT_PROXY_HOPS = int(os.environ.get("RATELIMIT_PROXY_HOPS", "0"))
+RATELIMITS = {
+    'ajax': {'ip': '120/m'},
+    'login': {'ip': '10/m'},
+    'booking': {'ip': '60/m', 'user': '20/m'},
+    'calendar': {'ip': '30/m'},
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -146,9 +205,24 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'  # Для ра
 DEFAULT_FROM_EMAIL = 'noreply@tenniscourts.kz'
 ADMIN_EMAIL = 'admin@tenniscourts.kz'
 
+# Напоминания о бронированиях (manage.py send_booking_reminders)
+BOOKING_REMINDER_HOURS = 24
+BOOKING_REMINDER_BATCH_SIZE = 100
+
+# Срок оплаты: неоплаченные брони старше этого отменяются
+# (manage.py expire_pending_bookings)
+BOOKING_PAYMENT_DEADLINE_HOURS = 24
+BOOKING_EXPIRY_BATCH_SIZE = 500
+
 # Session settings (для сохранения данных между шагами бронирования)
 SESSION_COOKIE_AGE = 3600  # 1 час
-SESSION_SAVE_EVERY_REQUEST = True
+# Сессия продлевается лениво (tennis.middleware.LazySessionRenewalMiddleware):
+# запись только при изменении данных или когда до истечения осталось
+# меньше SESSION_RENEWAL_THRESHOLD секунд
+SESSION_SAVE_EVERY_REQUEST = False
+SESSION_RENEWAL_THRESHOLD = 50 * 60
+# 'tennis.sessions.cached_db' - чтение сессий из кеша с записью в базу
+SESSION_ENGINE = os.environ.get("SESSION_ENGINE", "tennis.sessions.db")
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False
 
 # Messages framework
@@ -170,19 +244,62 @@ SECURE_BROWSER_XSS_FILTER = True
 SECURE_CONTENT_TYPE_NOSNIFF = True
 X_FRAME_OPTIONS = 'DENY'
 
-# Logging (опционально)
+# Pub/sub для SSE-потока изменений занятости (tennis.events). LocalBroker
+# работает внутри одного ASGI-процесса
+AVAILABILITY_BROKER = 'tennis.events.LocalBroker'
+
+# Виртуальная очередь на шаги бронирования: сколько пользователей
+# одновременно проходят мастер и сколько секунд без запросов за ними
+# держится место. Остальные ждут на странице ожидания.
+# Очередь и счетчики живут в кеше: включайте только с общим для всех
+# воркеров CACHE_BACKEND (Redis, Memcached), с LocMem у каждого воркера
+# своя очередь
+WAITING_ROOM_ENABLED = os.environ.get("WAITING_ROOM_ENABLED", "False") == "True"
+WAITING_ROOM_CAPACITY = int(os.environ.get("WAITING_ROOM_CAPACITY", "100"))
+WAITING_ROOM_ACTIVE_SECONDS = 300
+WAITING_ROOM_URL_NAMES = ['booking_step1', 'booking_step2', 'booking_step3', 'booking_step4']
+
+# Занятость кортов на день считается один раз на (центр, дату) для всех
+# одновременных запросов и хранится в кеше указанное число секунд
+AVAILABILITY_CACHE_SECONDS = 5
+# Сколько ждать чужой расчет, прежде чем считать самому
+SINGLEFLIGHT_WAIT_SECONDS = 3
+
+# Профилирование: доля запросов под cProfile (0 - выключено) и заголовок,
+# которым персонал может запросить профиль конкретного запроса
+PROFILER_SAMPLE_RATE = float(os.environ.get("PROFILER_SAMPLE_RATE", "0"))
+PROFILER_HEADER = 'X-Profile'
+PROFILER_DIR = Path(os.environ.get("PROFILER_DIR", BASE_DIR / 'profiles'))
+
+# Logging: запись в файл идет через очередь в отдельном потоке,
+# файл ротируется, записи пишутся в JSON с request_id и booking_id
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {
+            '()': 'tennis.log.RequestIdFilter',
+        },
+    },
+    'formatters': {
+        'json': {
+            '()': 'tennis.log.JsonFormatter',
+        },
+    },
     'handlers': {
         'file': {
             'level': 'INFO',
-            'class': 'logging.FileHandler',
+            'class': 'tennis.log.QueueFileHandler',
             'filename': BASE_DIR / 'tennis_booking.log',
+            'max_bytes': 10 * 1024 * 1024,
+            'backup_count': 5,
+            'filters': ['request_id'],
         },
         'console': {
             'level': 'INFO',
             'class': 'logging.StreamHandler',
+            'formatter': 'json',
+            'filters': ['request_id'],
         },
     },
     'loggers': {
@@ -192,4 +309,4 @@ LOGGING = {
             'propagate': True,
         },
     },
-}
\ No newline at end of file
+}
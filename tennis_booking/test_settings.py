@@ -0,0 +1,14 @@
+"""
+Settings for running the tests: python manage.py test (or
+DJANGO_SETTINGS_MODULE=tennis_booking.test_settings for other runners).
+"""
+from .settings import *  # noqa: F401,F403
+
+# Отдельная SQLite-база для тестов маршрутизации: приложение читает с нее,
+# только когда тест включает ее через override_settings(DATABASE_REPLICAS=...)
+DATABASES.setdefault("replica_test", {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"})
+
+# Два шарда SQLite для тестов шардирования: включаются в тесте через
+# override_settings(DATABASE_SHARDS=[...])
+for alias in ("shard_0", "shard_1"):
+    DATABASES.setdefault(alias, {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"})
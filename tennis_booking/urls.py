@@ -17,7 +17,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from tennis.admin import analytics_view, profiler_report_view
+
 urlpatterns = [
+    path('admin/profiler/', admin.site.admin_view(profiler_report_view), name='profiler_report'),
+    path('admin/analytics/', admin.site.admin_view(analytics_view), name='analytics_report'),
     path('admin/', admin.site.urls),
     path('', include('tennis.urls')),
 ]
\ No newline at end of file